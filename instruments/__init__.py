@@ -1,2 +1,3 @@
 from .instrument import *
+from .keywords import connect_to_ktl
 
@@ -0,0 +1,42 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+##-------------------------------------------------------------------------
+## Asyncio Wrappers
+##-------------------------------------------------------------------------
+## The instrument control functions block for seconds to minutes while a
+## mechanism moves.  `to_async` turns one into a coroutine function which
+## runs the blocking call on a worker thread, so that independent moves can
+## be overlapped on an event loop with asyncio.gather.  Control functions get
+## their own thread pool so that long moves never starve the keyword pool.
+max_workers = 32
+_executor = None
+_lock = threading.Lock()
+
+
+def get_executor():
+    '''Return the thread pool used to run blocking control functions.
+    '''
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix='aio')
+        return _executor
+
+
+def to_async(func):
+    '''Return a coroutine function which runs `func` on the control thread
+    pool and returns its result (or raises its exception).
+    '''
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        call = functools.partial(context.run, func, *args, **kwargs)
+        return await loop.run_in_executor(get_executor(), call)
+    return wrapper
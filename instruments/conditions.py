@@ -0,0 +1,134 @@
+import functools
+import inspect
+import threading
+import time
+
+from instruments import keywords, timing
+
+
+##-------------------------------------------------------------------------
+## Condition Epochs
+##-------------------------------------------------------------------------
+## A passing condition check is remembered for the rest of the current
+## "condition epoch" so that back to back steps (e.g. setup_mask ->
+## waitfor_CSU -> execute_mask) do not re-read the same status keywords.  The
+## epoch ends on any keyword write, monitor update or completed wait made
+## through the keywords module, and a remembered pass is never trusted for
+## longer than `max_age` seconds.  Failures are never remembered.
+max_age = 1.0
+cache_stats = {'hits': 0, 'misses': 0}
+_lock = threading.Lock()
+_epoch = 0
+_passed = {}
+
+
+def new_epoch():
+    '''End the current condition epoch, forgetting all remembered passes.'''
+    global _epoch
+    with _lock:
+        _epoch += 1
+        _passed.clear()
+
+
+def mark_passed(*checks):
+    '''Record that the given checks have passed in the current epoch (for
+    example when they were evaluated together from a single snapshot).
+    '''
+    with _lock:
+        for check in checks:
+            _passed[check] = (_epoch, time.monotonic())
+
+
+def check(condition):
+    '''Run a condition check (a function of no arguments which raises on
+    failure) unless it has already passed in the current epoch.
+    '''
+    with _lock:
+        entry = _passed.get(condition, None)
+        if entry is not None and entry[0] == _epoch\
+           and time.monotonic() - entry[1] < max_age:
+            cache_stats['hits'] += 1
+            return
+        cache_stats['misses'] += 1
+        epoch = _epoch
+    condition()
+    with _lock:
+        if epoch == _epoch:
+            _passed[condition] = (epoch, time.monotonic())
+
+
+##-------------------------------------------------------------------------
+## instrument_step Decorator
+##-------------------------------------------------------------------------
+def instrument_step(pre=None, post=None, log=None):
+    '''Decorator which provides the standard pre- and post- condition wrapper
+    for an instrument function.
+
+    The `pre` checks are run before the function and the `post` checks after
+    it unless skipprecond=True or skippostcond=True respectively.  The
+    skipprecond and skippostcond arguments are passed on to the function if
+    it accepts them, so that checks which depend on the arguments can stay in
+    the function body.  The logger defaults to the `log` of the module in
+    which the function is defined.
+
+    @instrument_step(pre=[CSU_ok], post=[CSU_ok])
+    def waitfor_CSU(timeout=480, noshim=False):
+        ...
+    '''
+    pre = [] if pre is None else list(pre)
+    post = [] if post is None else list(post)
+
+    def decorator(func):
+        parameters = inspect.signature(func).parameters
+        passes_pre = 'skipprecond' in parameters
+        passes_post = 'skippostcond' in parameters
+        name = timing.function_name(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, skipprecond=False, skippostcond=False, **kwargs):
+            logger = log if log is not None else func.__globals__['log']
+            logger.debug(f"Executing: {func.__name__}")
+            if timing.enabled is not True:
+                return run(logger, None, args, skipprecond, skippostcond,
+                           kwargs)
+            clock = timing.Clock(name)
+            try:
+                return run(logger, clock, args, skipprecond, skippostcond,
+                           kwargs)
+            finally:
+                clock.stop()
+
+        def run(logger, clock, args, skipprecond, skippostcond, kwargs):
+            ##-----------------------------------------------------------------
+            ## Pre-Condition Checks
+            if skipprecond is True:
+                logger.debug('Skipping pre condition checks')
+            else:
+                for condition in pre:
+                    check(condition)
+            if clock is not None:
+                clock.lap('pre')
+            ##-----------------------------------------------------------------
+            ## Function Contents
+            if passes_pre is True:
+                kwargs['skipprecond'] = skipprecond
+            if passes_post is True:
+                kwargs['skippostcond'] = skippostcond
+            result = func(*args, **kwargs)
+            if clock is not None:
+                clock.lap('body')
+            ##-----------------------------------------------------------------
+            ## Post-Condition Checks
+            if skippostcond is True:
+                logger.debug('Skipping post condition checks')
+            else:
+                for condition in post:
+                    check(condition)
+            if clock is not None:
+                clock.lap('post')
+            return result
+        return wrapper
+    return decorator
+
+
+keywords.add_change_hook(new_epoch)
@@ -0,0 +1,621 @@
+import re
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from instruments import keywords, movetimes
+
+
+##-------------------------------------------------------------------------
+## Local KTL Stand-In
+##-------------------------------------------------------------------------
+## An in-process imitation of the parts of the ktl API used by this package
+## (cache, Service, Keyword with read/write/monitor/callback).  A Simulator
+## holds every keyword value and runs simple state machines for the MOSFIRE
+## CSU, detector, filter wheels, obsmode and rotator, and for the HIRES
+## detector, dewar and mechanisms, so that the existing control functions can
+## be run off-summit.
+##
+##   from instruments import fakektl
+##   sim = fakektl.install(read_latency=0.005, time_scale=0.01)
+##   mosfire.setup_mask(mosfire.Mask('0.7x46'))
+##
+## All simulated durations are multiplied by `time_scale`.
+class Exceptions(object):
+    '''Mirror of ktl.Exceptions'''
+    class ktlError(Exception):
+        pass
+
+
+ktlError = Exceptions.ktlError
+
+
+def _to_ascii(value):
+    if value is True:
+        return 'true'
+    if value is False:
+        return 'false'
+    return str(value)
+
+
+def _to_bool(ascii):
+    ascii = ascii.strip().lower()
+    if ascii in ['true', 'yes', 'on', 't', 'y']:
+        return True
+    if ascii in ['false', 'no', 'off', 'f', 'n', '']:
+        return False
+    try:
+        return float(ascii) != 0
+    except ValueError:
+        return True
+
+
+##-------------------------------------------------------------------------
+## Default Keyword Values
+##-------------------------------------------------------------------------
+def _default_values(outdir):
+    values = {
+        'dcs': {'INSTRUME': 'MOSFIRE', 'ROTPPOSN': '0.0', 'ROTDEST': '0.0',
+                'ROTMODE': 'stationary', 'ROTSTAT': 'in position',
+                'EL': '45.0'},
+        'mcsus': {'CSUREADY': '2', 'CSUSTAT': 'Move complete.',
+                  'MASKNAME': 'OPEN', 'SETUPNAME': 'OPEN', 'SETUPGO': '0',
+                  'INITBAR': '0'},
+        'mds': {'ITIME': '2000', 'COADDS': '1', 'SAMPMODE': '2',
+                'NUMREADS': '1', 'GO': 'false', 'IMAGEDONE': 'true',
+                'READY': 'true', 'OUTDIR': str(outdir), 'OBJECT': '',
+                'FILENAME': str(Path(outdir).joinpath('m0001.fits')),
+                'LASTFILE': ''},
+        'mosfire': {'OBSMODE': 'dark-imaging', 'SETOBSMODE': 'dark-imaging',
+                    'FILTER': 'Dark', 'OBSERVER': ''},
+        'mmf1s': {'STATUS': 'OK', 'POSNAME': 'NB1061', 'TARGNAME': 'NB1061'},
+        'mmf2s': {'STATUS': 'OK', 'POSNAME': 'Ks', 'TARGNAME': 'Ks'},
+        'mmgss': {'STATUS': 'OK'},
+        'mmgts': {'STATUS': 'OK'},
+        'mmprs': {'STATUS': 'OK'},
+        'mmdcs': {'STATUS': 'OK'},
+        'mfcs': {'ACTIVE': 'true', 'ENABLE': 'true', 'PA_EL': '0.00 45.00'},
+        'hiccd': {'OBSERVIP': 'false', 'EXPOSIP': 'false', 'WCRATE': 'false',
+                  'EXPOSE': 'false', 'AUTOSHUT': 'true', 'TTIME': '1',
+                  'OBSTYPE': 'Object', 'OUTDIR': str(outdir),
+                  'OUTFILE': 'hires', 'LFRAMENO': '0',
+                  'BINNING': '\n\tXbinning 2\n\tYbinning 1',
+                  'WINDOW': '\n\tchip number 1\n\txstart 0\n\tystart 0'
+                            '\n\txlen 6144\n\tylen 4096',
+                  'CCDGAIN': 'low', 'CCDSPEED': 'fast', 'TODISK': 'true',
+                  'UTBN2FIL': 'off', 'DWRN2LV': '80.0', 'RESN2LV': '60.0'},
+        'hires': {'LAMPNAME': 'none', 'LFILNAME': 'ng3', 'DECKNAME': 'C2',
+                  'FIL1NAME': 'clear', 'FIL2NAME': 'clear',
+                  'TVF1NAME': 'bg38', 'SLITNAME': 'opened',
+                  'COLLRED': 'red', 'COLLBLUE': 'not blue',
+                  'RCOCOVER': 'closed', 'BCOCOVER': 'closed',
+                  'ECHCOVER': 'closed', 'XDCOVER': 'closed',
+                  'CO1COVER': 'closed', 'CO2COVER': 'closed',
+                  'CAMCOVER': 'closed', 'DARKSLID': 'closed',
+                  'XDANGL': '0.0', 'XDRAW': '0', 'ECHANGL': '0.0',
+                  'ECHRAW': '0', 'COFRAW': '0', 'CAFRAW': '0',
+                  'COFNAME': 'DR00mm', 'ECHNAME': 'blaze', 'XDNAME': '0-order',
+                  'IODCELL': 'out', 'TEMPIOD1': '65.0', 'TEMPIOD2': '50.0',
+                  'MONIODT': '0', 'SETIODT': '50', 'IODHEAT': 'off',
+                  'LIGHTS': 'off', 'DOOR': 'closed'},
+        'expo': {'EXM0STA': 'Off', 'EXM0MOD': 'Off'},
+    }
+    for bar in range(1,93,1):
+        home = 4.0 if bar % 2 == 1 else 270.4
+        values['mcsus'][f'B{bar:02d}POS'] = f'{home:.3f}'
+        values['mcsus'][f'B{bar:02d}TARG'] = f'{home:.3f}'
+        values['mcsus'][f'B{bar:02d}STAT'] = 'OK'
+    return values
+
+
+## Seconds for each simulated mechanism move (before time_scale is applied).
+default_durations = {
+    'csu_setup': 2.0,       # SETUPGO with new targets -> ready to execute
+    'csu_overhead': 5.0,    # fixed part of a CSU move
+    'csu_speed': 5.0,       # bar speed in mm/s
+    'bar_init': 20.0,       # INITBAR
+    'filter_wheel': 15.0,   # per filter wheel move
+    'obsmode': 30.0,        # SETOBSMODE
+    'rotator_speed': 2.0,   # deg/s
+    'readout': 1.5,         # MOSFIRE per read
+    'hiccd_readout': 40.0,  # HIRES readout
+    'dewar_fill': 600.0,    # UTBN2FIL on -> off
+    'hires_mechanism': 5.0, # HIRES covers, filters, decker, gratings, ...
+    'hires_lamp': 1.0,      # HIRES lamps
+}
+
+hires_mechanisms = ['LFILNAME', 'DECKNAME', 'FIL1NAME', 'FIL2NAME',
+                    'TVF1NAME', 'SLITNAME', 'RCOCOVER', 'BCOCOVER',
+                    'ECHCOVER', 'XDCOVER', 'CO1COVER', 'CO2COVER', 'CAMCOVER',
+                    'DARKSLID', 'XDANGL', 'XDRAW', 'ECHANGL', 'ECHRAW',
+                    'COFRAW', 'CAFRAW', 'COFNAME', 'ECHNAME', 'XDNAME',
+                    'IODCELL']
+
+## Dark filter wheel combinations (from quick_dark)
+_dark_combos = [('H2', 'Y'), ('NB1061', 'J'), ('NB1061', 'H'),
+                ('NB1061', 'Ks'), ('NB1061', 'K'), ('J2', 'K'), ('J3', 'K'),
+                ('H1', 'K'), ('H2', 'K')]
+
+
+##-------------------------------------------------------------------------
+## Keyword and Service
+##-------------------------------------------------------------------------
+class Keyword(object):
+    '''Imitation of a ktl.Keyword.'''
+
+    def __init__(self, service, name):
+        self.service = service
+        self.name = name
+        self.full_name = f'{service.name}.{name}'
+        self.monitored = False
+        self._callbacks = []
+
+    def __repr__(self):
+        return f'<fakektl.Keyword {self.full_name}>'
+
+    def read(self, binary=False, wait=True, timeout=None):
+        sim = self.service.simulator
+        sim._check_faults(self.service.name, self.name)
+        sim._sleep(sim.latency('read', self.service.name), scaled=False)
+        value = sim.get(self.service.name, self.name)
+        return _to_bool(value) if binary is True else value
+
+    def write(self, value, wait=True, binary=False, timeout=None):
+        sim = self.service.simulator
+        sim._check_faults(self.service.name, self.name)
+        sim._sleep(sim.latency('write', self.service.name), scaled=False)
+        sim._write(self.service.name, self.name, value, wait=wait)
+
+    def monitor(self, start=True, prime=True, wait=True):
+        self.monitored = (start is True)
+
+    def callback(self, function, remove=False, preferred=False):
+        with self.service.simulator._lock:
+            if remove is True:
+                if function in self._callbacks:
+                    self._callbacks.remove(function)
+            elif function not in self._callbacks:
+                self._callbacks.append(function)
+
+    def _broadcast(self):
+        for function in list(self._callbacks):
+            function(self)
+
+    def __getitem__(self, item):
+        value = self.service.simulator.get(self.service.name, self.name)
+        if item == 'binary':
+            return _to_bool(value)
+        return value
+
+    def __str__(self):
+        return self.service.simulator.get(self.service.name, self.name)
+
+    def __int__(self):
+        return int(float(str(self)))
+
+    def __float__(self):
+        return float(str(self))
+
+    def __bool__(self):
+        return _to_bool(str(self))
+
+
+class Service(object):
+    '''Imitation of a ktl.Service.'''
+
+    def __init__(self, simulator, name):
+        self.simulator = simulator
+        self.name = name
+        self._keywords = {}
+
+    def __repr__(self):
+        return f'<fakektl.Service {self.name}>'
+
+    def __getitem__(self, keyword):
+        keyword = keyword.upper()
+        with self.simulator._lock:
+            if keyword not in self._keywords:
+                if self.simulator.strict is True\
+                   and keyword not in self.simulator._values[self.name]:
+                    raise KeyError(f'{self.name} has no keyword {keyword}')
+                self._keywords[keyword] = Keyword(self, keyword)
+            return self._keywords[keyword]
+
+    def keys(self):
+        return list(self.simulator._values[self.name].keys())
+
+
+##-------------------------------------------------------------------------
+## Simulator
+##-------------------------------------------------------------------------
+class Simulator(object):
+    '''Holds the state of every simulated service and drives the instrument
+    state machines.  It is also a drop-in keyword backend (it provides the
+    `cache` function), see `install`.
+
+    read_latency and write_latency are the seconds added to every read or
+    write and may be a number or a {service: seconds} dictionary.  durations
+    overrides entries in `default_durations`.
+    '''
+
+    def __init__(self, read_latency=0, write_latency=0, time_scale=1.0,
+                 durations=None, outdir=None, strict=False):
+        self.read_latency = read_latency
+        self.write_latency = write_latency
+        self.time_scale = time_scale
+        self.durations = dict(default_durations)
+        if durations is not None:
+            self.durations.update(durations)
+        if outdir is None:
+            outdir = tempfile.mkdtemp(prefix='fakektl_')
+        self.outdir = Path(outdir)
+        self.strict = strict
+        self.Exceptions = Exceptions
+        self._lock = threading.RLock()
+        self._values = _default_values(self.outdir)
+        self._services = {}
+        self._timers = []
+        self._csu_setup_pending = False
+        self._mds_frameno = 0
+        # Faults
+        self._bar_errors = {}
+        self._collision_row = None
+        self._timeouts = {}
+        self._down = []
+
+    ##---------------------------------------------------------------------
+    ## ktl API
+    def cache(self, service=None, keyword=None):
+        service = service.lower()
+        with self._lock:
+            if service in self._down:
+                raise ktlError(f'Unable to contact service {service}')
+            if service not in self._values:
+                if self.strict is True:
+                    raise ktlError(f'Unknown service {service}')
+                self._values[service] = {}
+            if service not in self._services:
+                self._services[service] = Service(self, service)
+        if keyword is None:
+            return self._services[service]
+        return self._services[service][keyword]
+
+    ##---------------------------------------------------------------------
+    ## Value access (no latency, no faults)
+    def get(self, service, keyword):
+        with self._lock:
+            return self._values[service.lower()].get(keyword.upper(), '')
+
+    def set(self, service, keyword, value):
+        '''Update a keyword value and broadcast to its callbacks, as a
+        keyword server would.
+        '''
+        service = service.lower()
+        keyword = keyword.upper()
+        with self._lock:
+            self._values.setdefault(service, {})[keyword] = _to_ascii(value)
+            kw = self._services.get(service, None)
+            kw = None if kw is None else kw._keywords.get(keyword, None)
+        if kw is not None:
+            kw._broadcast()
+
+    def latency(self, kind, service):
+        latency = {'read': self.read_latency,
+                   'write': self.write_latency}[kind]
+        if isinstance(latency, dict):
+            return latency.get(service, 0)
+        return latency
+
+    def _sleep(self, seconds, scaled=True):
+        if scaled is True:
+            seconds = seconds * self.time_scale
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def after(self, seconds, function, *args):
+        '''Run function(*args) after the (scaled) delay in a daemon thread.'''
+        timer = threading.Timer(seconds * self.time_scale, function, args=args)
+        timer.daemon = True
+        with self._lock:
+            self._timers = [t for t in self._timers if t.is_alive()]
+            self._timers.append(timer)
+        timer.start()
+        return timer
+
+    def stop(self):
+        '''Cancel all pending simulated events.'''
+        with self._lock:
+            for timer in self._timers:
+                timer.cancel()
+            self._timers = []
+
+    ##---------------------------------------------------------------------
+    ## Fault Injection
+    def inject_bar_error(self, bar, status='ERROR', persistent=False):
+        '''Put a CSU bar into an error state.  Unless persistent, the error is
+        cleared when the bar is initialised.
+        '''
+        self._bar_errors[int(bar)] = persistent
+        self.set('mcsus', f'B{int(bar):02d}STAT', status)
+
+    def inject_collision(self, row):
+        '''Make the next CSU setup abort with a collision at the given row.'''
+        self._collision_row = int(row)
+
+    def inject_timeout(self, service, keyword=None, delay=1.0):
+        '''Make reads and writes of service.keyword (or of every keyword on
+        the service) hang for `delay` seconds and then raise ktlError.
+        '''
+        keyword = None if keyword is None else keyword.upper()
+        self._timeouts[(service.lower(), keyword)] = delay
+
+    def set_service_down(self, service, down=True):
+        '''Make every access to a service raise ktlError.'''
+        service = service.lower()
+        if down is True and service not in self._down:
+            self._down.append(service)
+        elif down is False and service in self._down:
+            self._down.remove(service)
+
+    def clear_faults(self):
+        self._bar_errors = {}
+        self._collision_row = None
+        self._timeouts = {}
+        self._down = []
+
+    def _check_faults(self, service, keyword):
+        if service in self._down:
+            raise ktlError(f'Unable to contact service {service}')
+        for key in [(service, keyword), (service, None)]:
+            if key in self._timeouts:
+                time.sleep(self._timeouts[key])
+                raise ktlError(f'Timeout on {service}.{keyword}')
+
+    ##---------------------------------------------------------------------
+    ## Writes and State Machines
+    def _write(self, service, keyword, value, wait=True):
+        handler = getattr(self, f'_on_{service}_{keyword.lower()}', None)
+        if handler is None and service == 'hires'\
+           and keyword in hires_mechanisms:
+            handler = self._on_hires_mechanism
+        if handler is None and service == 'mcsus'\
+           and re.match(r'B\d\dTARG', keyword):
+            value = f'{float(value):.3f}'
+        if handler is None:
+            self.set(service, keyword, value)
+        else:
+            handler(keyword, value, wait)
+
+    ## MOSFIRE CSU
+    def _on_mcsus_setupgo(self, keyword, value, wait):
+        csuready = int(self.get('mcsus', 'CSUREADY'))
+        if csuready not in [1, 2]:
+            raise ktlError(f'CSU is not ready (CSUREADY={csuready})')
+        self.set('mcsus', 'SETUPGO', value)
+        if self._csu_setup_pending is False:
+            self.set('mcsus', 'CSUREADY', 4)
+            self.set('mcsus', 'CSUSTAT', 'Creating Group.')
+            self.after(self.durations['csu_setup'], self._csu_setup_done)
+        else:
+            self._csu_setup_pending = False
+            self.set('mcsus', 'CSUREADY', 3)
+            self.set('mcsus', 'CSUSTAT', 'Moving.')
+            pos = [float(self.get('mcsus', f'B{b:02d}POS'))
+                   for b in range(1,93,1)]
+            targ = [float(self.get('mcsus', f'B{b:02d}TARG'))
+                    for b in range(1,93,1)]
+            travel = max([abs(t-p) for p, t in zip(pos, targ)])
+            duration = self.durations['csu_overhead']\
+                       + travel / self.durations['csu_speed']
+            self.after(duration, self._csu_move_done)
+
+    def _csu_setup_done(self):
+        if self._collision_row is not None:
+            row = self._collision_row
+            self._collision_row = None
+            self.set('mcsus', 'CSUSTAT',
+                     f'Setup aborted.  Collision detected at row {row}')
+            self.set('mcsus', 'CSUREADY', 2)
+            return
+        self._csu_setup_pending = True
+        self.set('mcsus', 'CSUSTAT', 'Setup complete.')
+        self.set('mcsus', 'CSUREADY', 2)
+
+    def _csu_move_done(self):
+        failed = False
+        for bar in range(1,93,1):
+            if bar in self._bar_errors:
+                failed = True
+                continue
+            targ = self.get('mcsus', f'B{bar:02d}TARG')
+            self.set('mcsus', f'B{bar:02d}POS', targ)
+        if failed is True:
+            self.set('mcsus', 'CSUSTAT', 'Move failed.')
+            self.set('mcsus', 'CSUREADY', -1)
+        else:
+            self.set('mcsus', 'MASKNAME', self.get('mcsus', 'SETUPNAME'))
+            self.set('mcsus', 'CSUSTAT', 'Move complete.')
+            self.set('mcsus', 'CSUREADY', 2)
+
+    def _on_mcsus_initbar(self, keyword, value, wait):
+        self.set('mcsus', 'INITBAR', value)
+        bar = int(value)
+        bars = range(1,93,1) if bar == 0 else [bar]
+        for bar in bars:
+            self.set('mcsus', f'B{bar:02d}STAT', 'INITIALIZING')
+        self.after(self.durations['bar_init'], self._bars_homed, bars)
+
+    def _bars_homed(self, bars):
+        for bar in bars:
+            if self._bar_errors.get(bar, False) is True:
+                self.set('mcsus', f'B{bar:02d}STAT', 'ERROR')
+                continue
+            self._bar_errors.pop(bar, None)
+            home = 4.0 if bar % 2 == 1 else 270.4
+            self.set('mcsus', f'B{bar:02d}POS', f'{home:.3f}')
+            self.set('mcsus', f'B{bar:02d}TARG', f'{home:.3f}')
+            self.set('mcsus', f'B{bar:02d}STAT', 'OK')
+
+    ## MOSFIRE Detector
+    def _on_mds_go(self, keyword, value, wait):
+        if _to_bool(_to_ascii(value)) is False:
+            return
+        if _to_bool(self.get('mds', 'READY')) is False:
+            raise ktlError('Detector is not ready')
+        self.set('mds', 'GO', True)
+        self.set('mds', 'READY', False)
+        self.set('mds', 'IMAGEDONE', False)
+        exptime = float(self.get('mds', 'ITIME'))/1000\
+                  * int(self.get('mds', 'COADDS'))
+        nreads = 1 if self.get('mds', 'SAMPMODE') == '2'\
+                 else int(self.get('mds', 'NUMREADS'))
+        duration = exptime + 2*nreads*self.durations['readout']
+        self.after(duration, self._mds_exposure_done)
+
+    def _mds_exposure_done(self):
+        self._mds_frameno += 1
+        outdir = Path(self.get('mds', 'OUTDIR'))
+        outdir.mkdir(parents=True, exist_ok=True)
+        datestr = time.strftime('%y%m%d', time.gmtime())
+        lastfile = outdir.joinpath(f'm{datestr}_{self._mds_frameno:04d}.fits')
+        lastfile.touch()
+        nextfile = outdir.joinpath(f'm{datestr}_{self._mds_frameno+1:04d}.fits')
+        self.set('mds', 'LASTFILE', str(lastfile))
+        self.set('mds', 'FILENAME', str(nextfile))
+        self.set('mds', 'GO', False)
+        self.set('mds', 'IMAGEDONE', True)
+        self.set('mds', 'READY', True)
+
+    ## MOSFIRE Filter Wheels and Obsmode
+    def _update_filter(self):
+        f1 = self.get('mmf1s', 'POSNAME')
+        f2 = self.get('mmf2s', 'POSNAME')
+        if (f1, f2) in _dark_combos:
+            self.set('mosfire', 'FILTER', 'Dark')
+        elif f1 == 'Open':
+            self.set('mosfire', 'FILTER', f2)
+        else:
+            self.set('mosfire', 'FILTER', f1)
+
+    def _move_filter_wheel(self, service, destination):
+        self.set(service, 'TARGNAME', destination)
+        self.set(service, 'STATUS', 'Moving')
+
+        def done():
+            ## A wheel which has since been sent elsewhere does not stop here
+            if self.get(service, 'TARGNAME') != destination:
+                return
+            self.set(service, 'POSNAME', destination)
+            self.set(service, 'STATUS', 'OK')
+            self._update_filter()
+        self.after(self.durations['filter_wheel'], done)
+
+    def _on_mmf1s_targname(self, keyword, value, wait):
+        self._move_filter_wheel('mmf1s', value)
+
+    def _on_mmf2s_targname(self, keyword, value, wait):
+        self._move_filter_wheel('mmf2s', value)
+
+    def _on_mosfire_setobsmode(self, keyword, value, wait):
+        filter, mode = value.split('-')
+        self.set('mosfire', 'SETOBSMODE', value)
+        self.set('mmgts', 'STATUS', 'Moving')
+        if filter.lower() == 'dark':
+            self._move_filter_wheel('mmf1s', 'NB1061')
+            self._move_filter_wheel('mmf2s', 'Ks')
+        else:
+            self._move_filter_wheel('mmf1s', 'Open')
+            self._move_filter_wheel('mmf2s', filter)
+
+        def done():
+            self.set('mmgts', 'STATUS', 'OK')
+            self.set('mosfire', 'OBSMODE', value)
+        self.after(self.durations['obsmode'], done)
+
+    ## Rotator
+    def _on_dcs_rotmode(self, keyword, value, wait):
+        self.set('dcs', 'ROTMODE', value)
+        if value != 'stationary':
+            return
+        dest = float(self.get('dcs', 'ROTDEST'))
+        delta = abs(dest - float(self.get('dcs', 'ROTPPOSN')))
+        self.set('dcs', 'ROTSTAT', 'slewing')
+
+        def done():
+            self.set('dcs', 'ROTPPOSN', dest)
+            self.set('dcs', 'ROTSTAT', 'in position')
+        self.after(delta / self.durations['rotator_speed'], done)
+
+    ## HIRES Detector and Dewar
+    def _on_hiccd_expose(self, keyword, value, wait):
+        if _to_bool(_to_ascii(value)) is False:
+            return
+        if _to_bool(self.get('hiccd', 'OBSERVIP')) is True:
+            raise ktlError('Observation in progress')
+        self.set('hiccd', 'OBSERVIP', True)
+        self.set('hiccd', 'EXPOSIP', True)
+        self.after(float(self.get('hiccd', 'TTIME')), self._hiccd_readout)
+
+    def _hiccd_readout(self):
+        self.set('hiccd', 'EXPOSIP', False)
+        self.set('hiccd', 'WCRATE', True)
+        self.after(self.durations['hiccd_readout'], self._hiccd_done)
+
+    def _hiccd_done(self):
+        frameno = int(self.get('hiccd', 'LFRAMENO')) + 1
+        outdir = Path(self.get('hiccd', 'OUTDIR'))
+        outdir.mkdir(parents=True, exist_ok=True)
+        outfile = self.get('hiccd', 'OUTFILE')
+        outdir.joinpath(f'{outfile}{frameno:04d}.fits').touch()
+        self.set('hiccd', 'LFRAMENO', frameno)
+        self.set('hiccd', 'WCRATE', False)
+        self.set('hiccd', 'OBSERVIP', False)
+
+    def _on_hiccd_binning(self, keyword, value, wait):
+        binX, binY = value
+        self.set('hiccd', 'BINNING', f'\n\tXbinning {binX}\n\tYbinning {binY}')
+
+    def _on_hiccd_utbn2fil(self, keyword, value, wait):
+        self.set('hiccd', 'UTBN2FIL', value)
+        if value != 'on':
+            return
+
+        def done():
+            reserve = float(self.get('hiccd', 'RESN2LV')) - 10
+            self.set('hiccd', 'DWRN2LV', 100.0)
+            self.set('hiccd', 'RESN2LV', max(reserve, 0))
+            self.set('hiccd', 'UTBN2FIL', 'off')
+        self.after(self.durations['dewar_fill'], done)
+
+    ## HIRES Mechanisms
+    def _on_hires_lampname(self, keyword, value, wait):
+        self._move('hires', keyword, value, self.durations['hires_lamp'], wait)
+
+    def _on_hires_mechanism(self, keyword, value, wait):
+        self._move('hires', keyword, value, self.durations['hires_mechanism'],
+                   wait)
+
+    def _move(self, service, keyword, value, duration, wait):
+        '''Generic mechanism move: the keyword takes its new value after the
+        move duration.  A write with wait=True blocks until then.
+        '''
+        if wait is True:
+            self._sleep(duration)
+            self.set(service, keyword, value)
+        else:
+            self.after(duration, self.set, service, keyword, value)
+
+
+##-------------------------------------------------------------------------
+## Install
+##-------------------------------------------------------------------------
+def install(**kwargs):
+    '''Create a Simulator and make it the keyword backend used by the
+    instruments package.  Keyword arguments are passed to Simulator.
+    '''
+    simulator = Simulator(**kwargs)
+    keywords.set_backend(simulator)
+    ## Keep simulated move times out of the real move time database
+    movetimes.use_database(simulator.outdir / 'movetimes.sqlite')
+    return simulator
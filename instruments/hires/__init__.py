@@ -6,4 +6,5 @@ from .expo import *
 from .iodine import *
 from .mechs import *
 from .prv import *
+from .configure import *
 from .scripts import *
@@ -0,0 +1,69 @@
+'''Asyncio versions of the HIRES control functions.
+
+Each function here takes the same arguments as its blocking counterpart and
+returns a coroutine.  Independent moves can then be run concurrently:
+
+    from instruments.hires import aio
+    await asyncio.gather(aio.set_lamp('ThAr1'),
+                         aio.set_decker('B2'),
+                         aio.open_covers(),
+                         aio.set_xdang(0.5))
+'''
+from instruments.aio import to_async
+from instruments.waits import wait_for_async, wait_until_async
+
+from .cals import set_lamp, set_lamp_filter
+from .detector import set_binning, set_gain, set_exptime, set_obstype,\
+                      wait_for_observip, goi, take_exposure
+from .dewar import fill_dewar
+from .expo import expo_on, expo_off
+from .iodine import check_iodine_temps, iodine_start, iodine_stop,\
+                    iodine_in, iodine_out
+from .mechs import set_covers, open_covers, close_covers, open_slit,\
+                   set_decker, set_slit, set_filters, set_tvfilter,\
+                   set_cafraw, set_cofraw, set_xdang, set_xdraw,\
+                   set_echang, set_echraw
+
+
+##-------------------------------------------------------------------------
+## Calibrations
+##-------------------------------------------------------------------------
+set_lamp = to_async(set_lamp)
+set_lamp_filter = to_async(set_lamp_filter)
+iodine_start = to_async(iodine_start)
+iodine_stop = to_async(iodine_stop)
+iodine_in = to_async(iodine_in)
+iodine_out = to_async(iodine_out)
+check_iodine_temps = to_async(check_iodine_temps)
+
+##-------------------------------------------------------------------------
+## Detector
+##-------------------------------------------------------------------------
+set_binning = to_async(set_binning)
+set_gain = to_async(set_gain)
+set_exptime = to_async(set_exptime)
+set_obstype = to_async(set_obstype)
+wait_for_observip = to_async(wait_for_observip)
+goi = to_async(goi)
+take_exposure = to_async(take_exposure)
+fill_dewar = to_async(fill_dewar)
+expo_on = to_async(expo_on)
+expo_off = to_async(expo_off)
+
+##-------------------------------------------------------------------------
+## Mechanisms
+##-------------------------------------------------------------------------
+set_covers = to_async(set_covers)
+open_covers = to_async(open_covers)
+close_covers = to_async(close_covers)
+open_slit = to_async(open_slit)
+set_decker = to_async(set_decker)
+set_slit = to_async(set_slit)
+set_filters = to_async(set_filters)
+set_tvfilter = to_async(set_tvfilter)
+set_cafraw = to_async(set_cafraw)
+set_cofraw = to_async(set_cofraw)
+set_xdang = to_async(set_xdang)
+set_xdraw = to_async(set_xdraw)
+set_echang = to_async(set_echang)
+set_echraw = to_async(set_echraw)
@@ -2,25 +2,29 @@ from .core import *
 
 
 def lamp():
-    return get('hires', 'LAMPNAME')
+    return get('hires', 'LAMPNAME', cached=True)
 
 
+@locks.locked('hires_lamp')
+@timing.timed
 def set_lamp(lampname, wait=True):
     if lampname not in lampnames:
         log.error(f"{lampname} not known")
         log.error(f"Available lamps: {lampnames}")
     log.info(f'Setting lamp to {lampname}')
-    set('hires', 'LAMPNAME', lampname, wait=wait)
+    set('hires', 'LAMPNAME', lampname, wait=wait, only_if_changed=True)
     if wait is True:
         assert lamp() == lampname
 
 
 def lamp_filter():
-    return get('hires', 'LFILNAME')
+    return get('hires', 'LFILNAME', cached=True)
 
 
+@locks.locked('hires_lamp_filter')
+@timing.timed
 def set_lamp_filter(lfilname, wait=True):
     assert lfilname in ['bg12', 'bg13', 'bg14', 'bg38', 'clear', 'dt',
                         'etalon', 'gg495', 'ng3', 'ug1', 'ug5']
-    set('hires', 'LFILNAME', lfilname, wait=wait)
+    set('hires', 'LFILNAME', lfilname, wait=wait, only_if_changed=True)
     assert lamp_filter() == lfilname
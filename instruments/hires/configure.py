@@ -0,0 +1,173 @@
+import re
+from dataclasses import dataclass
+
+from instruments.planner import Plan, config_diff
+
+from .core import *
+from .cals import *
+from .detector import *
+from .mechs import *
+
+
+##-------------------------------------------------------------------------
+## Configuration Planner
+##-------------------------------------------------------------------------
+## The HIRES stages are independent of each other, with the exception of the
+## cross disperser: a raw XDRAW move is made after XDNAME has been set (which
+## moves the same grating).
+def configuration_plan(covers=None, lamp=None, lamp_filter=None, decker=None,
+                       filters=None, cofname=None, echname=None, xdname=None,
+                       slitname=None, xdraw=None, obstype=None, binning=None,
+                       gain=None, exptime=None, cofraw=None, cafraw=None):
+    """Build the Plan which brings HIRES to the given configuration.  Only the
+    items which are given are changed.  `filters` is a (fil1name, fil2name)
+    pair.
+    """
+    plan = Plan('HIRES configuration')
+    if covers is not None:
+        plan.add('covers', set_covers, covers)
+    if lamp is not None:
+        plan.add('lamp', set_lamp, lamp)
+    if lamp_filter is not None:
+        plan.add('lamp_filter', set_lamp_filter, lamp_filter)
+    if decker is not None:
+        plan.add('decker', set_decker, decker)
+    if filters is not None:
+        plan.add('filters', set_filters, *filters)
+    if cofname is not None:
+        plan.add('cofname', set, 'hires', 'COFNAME', cofname,
+                 only_if_changed=True)
+    if echname is not None:
+        plan.add('echname', set, 'hires', 'ECHNAME', echname,
+                 only_if_changed=True)
+    if xdname is not None:
+        plan.add('xdname', set, 'hires', 'XDNAME', xdname,
+                 only_if_changed=True)
+    if slitname is not None:
+        plan.add('slitname', set, 'hires', 'SLITNAME', slitname,
+                 only_if_changed=True)
+    if xdraw is not None:
+        plan.add('xdraw', set_xdraw, xdraw, after=['xdname'])
+    if obstype is not None:
+        plan.add('obstype', set_obstype, obstype)
+    if binning is not None:
+        plan.add('binning', set_binning, binning)
+    if gain is not None:
+        plan.add('gain', set_gain, gain)
+    if exptime is not None:
+        plan.add('exptime', set_exptime, exptime)
+    if cofraw is not None:
+        plan.add('cofraw', set_cofraw, cofraw)
+    if cafraw is not None:
+        plan.add('cafraw', set_cafraw, cafraw)
+    return plan
+
+
+@timing.timed
+def configure(covers=None, lamp=None, lamp_filter=None, decker=None,
+              filters=None, cofname=None, echname=None, xdname=None,
+              slitname=None, xdraw=None, obstype=None, binning=None,
+              gain=None, exptime=None, cofraw=None, cafraw=None):
+    """Bring HIRES to the given configuration, moving independent stages at
+    the same time.  Returns the completion report (a PlanReport) and raises
+    PlanError if any stage failed.
+    """
+    plan = configuration_plan(covers=covers, lamp=lamp,
+                              lamp_filter=lamp_filter, decker=decker,
+                              filters=filters, cofname=cofname,
+                              echname=echname, xdname=xdname,
+                              slitname=slitname, xdraw=xdraw, obstype=obstype,
+                              binning=binning, gain=gain, exptime=exptime,
+                              cofraw=cofraw, cafraw=cafraw)
+    log.info(f'Configuring HIRES: {", ".join(plan.steps.keys())}')
+    return plan.run(log=log)
+
+
+##-------------------------------------------------------------------------
+## Declarative Configuration
+##-------------------------------------------------------------------------
+@dataclass
+class HIRESConfig:
+    """A HIRES configuration.  Items left as None are "don't care" and are not
+    changed by apply().  Binning is given as a string such as '2x1'.
+    """
+    binning: str = None
+    gain: str = None
+    exptime: float = None
+    obstype: str = None
+    lamp: str = None
+    lamp_filter: str = None
+    decker: str = None
+    fil1name: str = None
+    fil2name: str = None
+    cofname: str = None
+    echname: str = None
+    xdname: str = None
+    slitname: str = None
+    cofraw: float = None
+    cafraw: float = None
+
+
+## Numeric items are considered unchanged within these tolerances
+config_tolerances = {'exptime': 0.001, 'cofraw': 0.5, 'cafraw': 0.5}
+## HIRESConfig item: (service, keyword)
+config_keywords = {'gain': ('hiccd', 'CCDGAIN'),
+                   'exptime': ('hiccd', 'TTIME'),
+                   'obstype': ('hiccd', 'OBSTYPE'),
+                   'lamp': ('hires', 'LAMPNAME'),
+                   'lamp_filter': ('hires', 'LFILNAME'),
+                   'decker': ('hires', 'DECKNAME'),
+                   'fil1name': ('hires', 'FIL1NAME'),
+                   'fil2name': ('hires', 'FIL2NAME'),
+                   'cofname': ('hires', 'COFNAME'),
+                   'echname': ('hires', 'ECHNAME'),
+                   'xdname': ('hires', 'XDNAME'),
+                   'slitname': ('hires', 'SLITNAME'),
+                   'cofraw': ('hires', 'COFRAW'),
+                   'cafraw': ('hires', 'CAFRAW'),
+                  }
+
+
+def current_config():
+    """Return the current HIRESConfig from a single bulk keyword read.
+    """
+    requests = list(config_keywords.values()) + [('hiccd', 'BINNING')]
+    values = keywords.read_batch(requests)
+    config = HIRESConfig(**{item: values[key]
+                            for item, key in config_keywords.items()})
+    for item in ['exptime', 'cofraw', 'cafraw']:
+        setattr(config, item, float(getattr(config, item)))
+    binningmatch = re.match(r'\n\tXbinning (\d)\n\tYbinning (\d)',
+                            values[('hiccd', 'BINNING')])
+    if binningmatch is not None:
+        config.binning = f'{binningmatch.group(1)}x{binningmatch.group(2)}'
+    return config
+
+
+def config_changes(config, current=None):
+    """Return a dictionary of the items of `config` which differ from the
+    `current` configuration (read from the instrument if not given).
+    """
+    if current is None:
+        current = current_config()
+    return config_diff(config, current, tolerances=config_tolerances)
+
+
+@timing.timed
+def apply(config, current=None):
+    """Bring HIRES to the given HIRESConfig, touching only the items which
+    differ from the current configuration and moving them in parallel.
+    Returns the completion report, or None if nothing needed to change.
+    """
+    if current is None:
+        current = current_config()
+    changes = config_changes(config, current=current)
+    if len(changes) == 0:
+        log.info('HIRES is already configured')
+        return None
+    fil1name = changes.pop('fil1name', None)
+    fil2name = changes.pop('fil2name', None)
+    if fil1name is not None or fil2name is not None:
+        changes['filters'] = (fil1name or current.fil1name,
+                              fil2name or current.fil2name)
+    return configure(**changes)
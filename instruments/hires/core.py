@@ -5,7 +5,7 @@ import sys
 from pathlib import Path
 import logging
 
-from instruments import connect_to_ktl, create_log
+from instruments import connect_to_ktl, create_log, keywords, locks, movetimes, timing, waits
 
 try:
     from ktl import Exceptions as ktlExceptions
@@ -45,28 +45,38 @@ slits = {'B1': (3.5, 0.574),
          }
 
 log = create_log(name, loglevel='INFO')
-services = {}
 
 
 ##-------------------------------------------------------------------------
 ## Define Common Functions
 ##-------------------------------------------------------------------------
 def connect(service):
-    if type(connect) is str and connect.lower() == 'all':
-        services.update(connect_to_ktl(name, serviceNames))
+    """Open one service (or 'all' HIRES services) in the shared keyword
+    connection pool.  Services are also opened lazily on first use, so this is
+    only needed to connect ahead of time.
+    """
+    if type(service) is str and service.lower() == 'all':
+        return connect_to_ktl(name, serviceNames)
     else:
-        services.update(connect_to_ktl(name, [service]))
+        return connect_to_ktl(name, [service])
 
 
-def get(service, keyword, mode=str):
+@timing.timed
+def get(service, keyword, mode=str, cached=False):
     """Generic function to get a keyword value.  Converts it to the specified
     mode and does some simple parsing of true and false strings.
+
+    If cached is True, the value is served from the monitored keyword cache
+    when possible rather than being read from the server.
     """
     log.debug(f'Querying {service} for {keyword}')
-    if services == {}:
+    if not keywords.available():
         return None
     assert mode in [str, float, int, bool]
-    kwresult = services[service][keyword].read()
+    if cached is True:
+        kwresult = keywords.cached_read(service, keyword)
+    else:
+        kwresult = keywords.read(service, keyword)
     log.debug(f'  Got result: "{kwresult}"')
 
     # Handle string versions of true and false
@@ -87,11 +97,22 @@ def get(service, keyword, mode=str):
         return kwresult
 
 
-def set(service, keyword, value, wait=True):
+@timing.timed
+def set(service, keyword, value, wait=True, only_if_changed=False):
     """Generic function to set a keyword value.
+
+    If only_if_changed is True, the write is skipped when the keyword already
+    has the requested value.  Do not use this for trigger keywords such as
+    EXPOSE.
     """
     log.debug(f'Setting {service}.{keyword} to "{value}" (wait={wait})')
-    if services == {}:
+    if not keywords.available():
         return None
-    services[service][keyword].write(value, wait=wait)
-    log.debug(f'  Done.')
+    if only_if_changed is True:
+        if keywords.write_if_changed(service, keyword, value, wait=wait):
+            log.debug(f'  Done.')
+        else:
+            log.debug(f'  Already set, write skipped.')
+    else:
+        keywords.write(service, keyword, value, wait=wait)
+        log.debug(f'  Done.')
@@ -1,6 +1,7 @@
 from .core import *
 
 import re
+import time
 from time import sleep
 
 try:
@@ -23,6 +24,8 @@ def binning():
         return None
 
 
+@locks.locked('hires_detector')
+@timing.timed
 def set_binning(input):
     if type(input) is str:
         try:
@@ -71,28 +74,32 @@ def windowing():
 def gain():
     """Return the gain as a string 'low' or 'high'.
     """
-    return get('hiccd', 'CCDGAIN')
+    return get('hiccd', 'CCDGAIN', cached=True)
 
 
+@locks.locked('hires_detector')
+@timing.timed
 def set_gain(input):
     """Set the gain as a string 'low' or 'high'.
     """
     if input.lower() not in ['high', 'low']:
         log.error(f"Gain {input} not understood.  Gain not set.")
         return None
-    set('hiccd', 'CCDGAIN', input.lower())
+    set('hiccd', 'CCDGAIN', input.lower(), only_if_changed=True)
 
 
 def ccdspeed():
     """Return the CCD readout speed as a string.
     """
-    return get('hiccd', 'CCDSPEED')
+    return get('hiccd', 'CCDSPEED', cached=True)
 
 
 def exptime():
     get('hiccd', 'TTIME', mode=int)
 
 
+@locks.locked('hires_detector')
+@timing.timed
 def set_exptime(exptime):
     set('hiccd', 'TTIME', exptime)
 
@@ -102,15 +109,17 @@ def is_writing():
 
 
 def obstype():
-    result = get('hiccd', 'obstype')
+    result = get('hiccd', 'obstype', cached=True)
     assert result in obstypes
     return result
 
 
+@locks.locked('hires_detector')
+@timing.timed
 def set_obstype(myobstype):
     log.info(f'Setting OBSTYPE to "{myobstype}"')
     if myobstype in obstypes:
-        set('hiccd', 'obstype', myobstype)
+        set('hiccd', 'obstype', myobstype, only_if_changed=True)
         return obstype()
     else:
         log.error(f'OBSTYPE {myobstype} not recognized.')
@@ -119,13 +128,18 @@ def set_obstype(myobstype):
             log.error(f'  {otype}')
 
 
+@timing.timed
 def wait_for_observip(timeout=300):
     if get('hiccd', 'OBSERVIP', mode=bool) is True:
         log.info(f'Waiting up to {timeout} seconds for observation to finish')
-        if not ktl.waitFor('($hiccd.OBSERVIP == False )', timeout=timeout):
+        if not waits.wait_until('hiccd', 'OBSERVIP',
+                                lambda kw: bool(kw) is False,
+                                timeout=timeout):
             raise Exception('Timed out waiting for OBSERVIP')
 
 
+@locks.locked('hires_detector')
+@timing.timed
 def goi(type=None, exptime=None, nexp=1, timeshim=True):
     """Takes one or more exposures of the given exposure time and type.
     Modeled after goi script.
@@ -142,32 +156,50 @@ def goi(type=None, exptime=None, nexp=1, timeshim=True):
         set_exptime(int(exptime))
 
     if type.lower() in ["dark", "bias", "zero"]:
-        set('hiccd', 'AUTOSHUT', False)
+        set('hiccd', 'AUTOSHUT', False, only_if_changed=True)
     else:
-        set('hiccd', 'AUTOSHUT', True)
+        set('hiccd', 'AUTOSHUT', True, only_if_changed=True)
 
+    ## Readout time depends on the binning and readout speed, so each
+    ## combination has its own model in the move time database
+    binned = binning()
+    readout = 'hiccd_readout' if binned is None\
+              else f'hiccd_readout_{binned[0]}x{binned[1]}_{ccdspeed()}'
     for i in range(nexp):
         exptime = get('hiccd', 'TTIME', mode=int)
         log.info(f"Taking exposure {i+1:d} of {nexp:d}")
         log.info(f"  Exposure Time = {exptime:d} s")
         set('hiccd', 'EXPOSE', True)
         if timeshim is True: sleep(1)
-        exposing = ktl.Expression("($hiccd.OBSERVIP == True) "
-                                  "and ($hiccd.EXPOSIP == True )")
-        reading = ktl.Expression("($hiccd.OBSERVIP == True) "
-                                 "and ($hiccd.WCRATE == True )")
-        obsdone = ktl.Expression("($hiccd.OBSERVIP == False)")
-
-        if not exposing.wait(timeout=30) and exptime > 2:
+        OBSERVIP = keywords.get_keyword('hiccd', 'OBSERVIP')
+        EXPOSIP = keywords.get_keyword('hiccd', 'EXPOSIP')
+        WCRATE = keywords.get_keyword('hiccd', 'WCRATE')
+        exposing = lambda: bool(OBSERVIP) and bool(EXPOSIP)
+        reading = lambda: bool(OBSERVIP) and bool(WCRATE)
+        obsdone = lambda: not bool(OBSERVIP)
+
+        if not waits.wait_for(exposing, [('hiccd', 'OBSERVIP'),
+                                         ('hiccd', 'EXPOSIP')],
+                              timeout=30) and exptime > 2:
             raise Exception('Timed out waiting for EXPOSING to start')
         log.info('  Exposing ...')
 
-        if not reading.wait(timeout=exptime+30):
+        started = time.monotonic()
+        timeout = movetimes.timeout('hiccd_exposure', exptime,
+                                    default=exptime+30)
+        if not waits.wait_for(reading, [('hiccd', 'OBSERVIP'),
+                                        ('hiccd', 'WCRATE')],
+                              timeout=timeout):
             raise Exception('Timed out waiting for READING to start')
         log.info('  Reading out ...')
+        reading_started = time.monotonic()
+        movetimes.record('hiccd_exposure', exptime, reading_started - started)
 
-        if not obsdone.wait(timeout=90):
+        timeout = movetimes.timeout(readout, default=90)
+        if not waits.wait_for(obsdone, [('hiccd', 'OBSERVIP')],
+                              timeout=timeout):
             raise Exception('Timed out waiting for READING to finish')
+        movetimes.record(readout, 0, time.monotonic() - reading_started)
         sleep(0.5)
         lf = lastfile()
         if lf.exists():
@@ -177,6 +209,7 @@ def goi(type=None, exptime=None, nexp=1, timeshim=True):
         log.info('Done')
 
 
+@timing.timed
 def take_exposure(type=None, exptime=None, nexp=1, timeshim=True):
     '''Alias take_exposure to goi
     '''
@@ -44,19 +44,17 @@ def RESN2LV():
     return get('hiccd', 'RESN2LV', mode=float)
 
 
+@timing.timed
 def fill_dewar():
     """Fill camera dewar using procedure in /local/home/hireseng/bin/filln2
     """
     log.info('Initiating dewar fill ...')
-    if WCRATE() is not False:
+    if get('hiccd', 'WCRATE', mode=bool) is not False:
         log.warning('The CCD is reading out. Try again when complete.')
         return None
     set('hiccd', 'UTBN2FIL', 'on')
-    while is_filling() is True:
-        dewar_level = DWRN2LV()
-        reserve_level = RESN2LV()
-        sleep(30)
+    waits.wait_until('hiccd', 'UTBN2FIL', lambda kw: str(kw) != 'on')
     log.info('  HIRES Dewar Fill is Complete.')
-    log.info('  CCD Dewar: {DWRN2LV():.1f} % full')
-    log.info('  Reserve Dewar: {RESN2LV():.1f} % full')
+    log.info(f'  CCD Dewar: {DWRN2LV():.1f} % full')
+    log.info(f'  Reserve Dewar: {RESN2LV():.1f} % full')
     return True
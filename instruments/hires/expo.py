@@ -5,11 +5,13 @@ def expo_status():
     return get('expo', 'EXM0STA')
 
 
+@timing.timed
 def expo_on():
     log.info('Turning exposure meter on')
-    set('expo', 'EXM0MOD', 'On')
+    set('expo', 'EXM0MOD', 'On', only_if_changed=True)
 
 
+@timing.timed
 def expo_off():
     log.info('Turning exposure meter off')
-    set('expo', 'EXM0MOD', 'Off')
+    set('expo', 'EXM0MOD', 'Off', only_if_changed=True)
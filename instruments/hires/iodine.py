@@ -10,6 +10,7 @@ def iodine_temps():
     return [tempiod1, tempiod2]
 
 
+@timing.timed
 def check_iodine_temps(target1=65, target2=50, range=0.05, wait=False):
     """Checks the iodine cell temperatures agains the given targets and
     range.  Default values are those used by the CPS team.
@@ -29,19 +30,22 @@ def check_iodine_temps(target1=65, target2=50, range=0.05, wait=False):
         if wait is True:
             log.info('  Waiting 10 minutes for iodine cell to reach '
                           'temperature')
-            done = ktl.waitFor(f'($hires.TEMPIOD1 > {target1-range}) and '\
-                               f'($hires.TEMPIOD1 < {target1+range}) and '\
-                               f'($hires.TEMPIOD2 > {target2-range}) and '\
-                               f'($hires.TEMPIOD2 < {target2+range})',\
-                               timeout=600)
+            TEMPIOD1 = keywords.get_keyword('hires', 'TEMPIOD1')
+            TEMPIOD2 = keywords.get_keyword('hires', 'TEMPIOD2')
+            at_temp = lambda: abs(float(TEMPIOD1) - target1) < range\
+                              and abs(float(TEMPIOD2) - target2) < range
+            done = waits.wait_for(at_temp, [('hires', 'TEMPIOD1'),
+                                            ('hires', 'TEMPIOD2')],
+                                  timeout=600)
             if done is False:
-                logger.warning('Iodine cell did not reach temperature'
+                log.warning('Iodine cell did not reach temperature'
                                     'within 10 minutes')
             return done
         else:
             return False
 
 
+@timing.timed
 def iodine_start():
     """Starts the iodine cell heater.  Cell takes ~45 minutes to warm up.
     
@@ -57,6 +61,7 @@ def iodine_start():
     set('hires', 'iodheat', 'on')
 
 
+@timing.timed
 def iodine_stop():
     """Turns off the iodine cell heater.
     
@@ -70,11 +75,13 @@ def iodine_stop():
     set('hires', 'iodheat', 'off')
 
 
+@timing.timed
 def iodine_in(wait=True):
     log.info('Inserting iodine cell')
-    set('hires', 'IODCELL', 'in', wait=wait)
+    set('hires', 'IODCELL', 'in', wait=wait, only_if_changed=True)
 
 
+@timing.timed
 def iodine_out(wait=True):
     log.info('Removing iodine cell')
-    set('hires', 'IODCELL', 'out', wait=wait)
+    set('hires', 'IODCELL', 'out', wait=wait, only_if_changed=True)
@@ -1,3 +1,6 @@
+from time import sleep
+import numpy as np
+
 from .core import *
 
 
@@ -8,7 +11,7 @@ def lights_are_on():
     """Returns True if lights are on in the enclosure.
     """
     log.debug('Getting status of enclosure lights ...')
-    lights_str = get('hires', 'lights')
+    lights_str = get('hires', 'lights', cached=True)
     log.debug(f'  lights are {lights_str}')
     return (lights_str == 'on')
 
@@ -17,7 +20,7 @@ def door_is_open():
     """Returns True if the door to the enclosure is open.
     """
     log.debug('Getting status of enclosure door ...')
-    door_str = get('hires', 'door')
+    door_str = get('hires', 'door', cached=True)
     log.debug(f'  door is {door_str}')
     return (door_str == 'open')
 
@@ -44,8 +47,8 @@ def collimator():
     not interpret the result.
     """
     log.info('Getting current collimator ...')
-    collred = get('hires', 'COLLRED')
-    collblue = get('hires', 'COLLBLUE')
+    collred = get('hires', 'COLLRED', cached=True)
+    collblue = get('hires', 'COLLBLUE', cached=True)
     if collred == 'red' and collblue == 'not blue':
         result = 'red'
     elif collred == 'not red' and collblue == 'blue':
@@ -59,6 +62,8 @@ def collimator():
 ##-------------------------------------------------------------------------
 ## Covers
 ##-------------------------------------------------------------------------
+@locks.locked('hires_covers')
+@timing.timed
 def set_covers(dest, wait=True):
     """Opens or closes all internal covers.
     
@@ -79,17 +84,17 @@ def set_covers(dest, wait=True):
     log.info(f'Setting {whichcollimator} covers to {dest}')
 
     if whichcollimator == 'red':
-        set('hires', 'rcocover', dest, wait=False)
+        set('hires', 'rcocover', dest, wait=False, only_if_changed=True)
     elif whichcollimator == 'blue':
-        set('hires', 'bcocover', dest, wait=False)
+        set('hires', 'bcocover', dest, wait=False, only_if_changed=True)
     else:
         log.error('Collimator is unknown. Cover not opened.')
-    set('hires', 'echcover', dest, wait=False)
-    set('hires', 'co1cover', dest, wait=False)
-    set('hires', 'xdcover', dest, wait=False)
-    set('hires', 'co2cover', dest, wait=False)
-    set('hires', 'camcover', dest, wait=False)
-    set('hires', 'darkslid', dest, wait=False)
+    set('hires', 'echcover', dest, wait=False, only_if_changed=True)
+    set('hires', 'co1cover', dest, wait=False, only_if_changed=True)
+    set('hires', 'xdcover', dest, wait=False, only_if_changed=True)
+    set('hires', 'co2cover', dest, wait=False, only_if_changed=True)
+    set('hires', 'camcover', dest, wait=False, only_if_changed=True)
+    set('hires', 'darkslid', dest, wait=False, only_if_changed=True)
 
     if wait is True:
         if whichcollimator == 'red':
@@ -107,10 +112,12 @@ def set_covers(dest, wait=True):
         log.info('  Done.')
 
 
+@timing.timed
 def open_covers(wait=True):
     set_covers('open', wait=wait)
 
 
+@timing.timed
 def close_covers(wait=True):
     set_covers('closed', wait=wait)
 
@@ -118,12 +125,14 @@ def close_covers(wait=True):
 ##-------------------------------------------------------------------------
 ## Slit, Decker, Filters
 ##-------------------------------------------------------------------------
+@timing.timed
 def open_slit(wait=True):
     """Open the slit jaws.
     """
-    set('hires', 'slitname', 'opened', wait=wait)
+    set('hires', 'slitname', 'opened', wait=wait, only_if_changed=True)
 
 
+@timing.timed
 def set_decker(deckname, wait=True):
     """Set the deckname keyword.  This method does not change any other
     configuration values.
@@ -131,42 +140,55 @@ def set_decker(deckname, wait=True):
     assert deckname in slits.keys()
     slitdims = slits[deckname]
     log.info(f'Setting decker to {deckname} ({slitdims[0]} x {slitdims[1]})')
-    set('hires', 'deckname', deckname, wait=wait)
+    set('hires', 'deckname', deckname, wait=wait, only_if_changed=True)
 
 
+@timing.timed
 def set_slit(deckname, wait=True):
     set_decker(deckname, wait=wait)
 
 
+@timing.timed
 def set_filters(fil1name, fil2name, wait=True):
     """Set the filter wheels.
     """
     log.info(f'Setting filters to {fil1name}, {fil2name}')
-    set('hires', 'fil1name', fil1name, wait=wait)
-    set('hires', 'fil2name', fil2name, wait=wait)
+    set('hires', 'fil1name', fil1name, wait=wait, only_if_changed=True)
+    set('hires', 'fil2name', fil2name, wait=wait, only_if_changed=True)
 
 
+@timing.timed
 def set_tvfilter(tvf1name, wait=True):
     log.info(f'Setting TVF1NAME to {tvf1name}')
-    set('hires', 'TVF1NAME', tvf1name, wait=wait)
+    set('hires', 'TVF1NAME', tvf1name, wait=wait, only_if_changed=True)
 
 
 ##-------------------------------------------------------------------------
 ## Focus
 ##-------------------------------------------------------------------------
+@timing.timed
 def set_cafraw(cafraw, wait=True):
     log.info(f'Setting CAFRAW to {cafraw:.3f}')
-    set('hires', 'cafraw', cafraw, wait=wait)
+    set('hires', 'cafraw', cafraw, wait=wait, only_if_changed=True)
 
 
+@timing.timed
 def set_cofraw(cofraw, wait=True):
     log.info(f'Setting COFRAW to {cofraw:.3f}')
-    set('hires', 'cofraw', cofraw, wait=wait)
+    set('hires', 'cofraw', cofraw, wait=wait, only_if_changed=True)
 
 
 ##-------------------------------------------------------------------------
 ## Grating Angles
 ##-------------------------------------------------------------------------
+def _move(keyword, dest, size):
+    '''Make one grating move and store its duration in the move time database
+    keyed on the size of the move (in degrees or counts).
+    '''
+    with movetimes.timed(f'hires_{keyword.lower()}', abs(size)):
+        set('hires', keyword, dest, wait=True)
+
+
 def xdang():
     return get('hires', 'XDANGL', mode=float)
 
@@ -175,11 +197,13 @@ def xdraw():
     return get('hires', 'XDRAW', mode=int)
 
 
+@locks.locked('hires_xd')
+@timing.timed
 def set_xdang(dest, simple=False, threshold=0.5, step=0.5):
     log.info(f'Moving XDANGL to {dest:.3f} deg')
     if simple is True:
         log.debug(f"Making simple move to {dest:.3f}")
-        set('hires', 'XDANGL', dest, wait=True)
+        _move('XDANGL', dest, dest - xdang())
     else:
         delta = dest - xdang()
         log.debug(f'Total move is {delta:.3f} deg')
@@ -189,19 +213,21 @@ def set_xdang(dest, simple=False, threshold=0.5, step=0.5):
             for i in range(nsteps):
                 movedest = xdang() + np.sign(delta)*step
                 log.debug(f"Making intermediate move to {movedest:.3f}")
-                set('hires', 'XDANGL', movedest, wait=True)
+                _move('XDANGL', movedest, step)
                 sleep(1)
         log.debug(f"Making final move to {dest:.3f}")
-        set('hires', 'XDANGL', dest, wait=True)
+        _move('XDANGL', dest, dest - xdang())
     log.info(f"Done.  XDANGL = {xdang():.3f} deg")
     return xdang()
 
 
+@locks.locked('hires_xd')
+@timing.timed
 def set_xdraw(dest, simple=False, threshold=2000, step=2000):
     log.info(f'Moving XDRAW to {dest:.3f} counts')
     if simple is True:
         log.debug(f"Making simple move to {dest:.3f}")
-        set('hires', 'XDRAW', dest, wait=True)
+        _move('XDRAW', dest, dest - xdraw())
     else:
         delta = dest - xdraw()
         log.debug(f'Total move is {delta:.3f} counts')
@@ -211,10 +237,10 @@ def set_xdraw(dest, simple=False, threshold=2000, step=2000):
             for i in range(nsteps):
                 movedest = xdraw() + np.sign(delta)*step
                 log.debug(f"Making intermediate move to {movedest:.3f}")
-                set('hires', 'XDRAW', movedest, wait=True)
+                _move('XDRAW', movedest, step)
                 sleep(1)
         log.debug(f"Making final move to {dest:.3f}")
-        set('hires', 'XDRAW', dest, wait=True)
+        _move('XDRAW', dest, dest - xdraw())
     log.debug(f"Done.  XDRAW = {xdraw():.3f} steps")
     return xdraw()
 
@@ -226,11 +252,13 @@ def echraw():
     return get('hires', 'ECHRAW', mode=int)
 
 
+@locks.locked('hires_echelle')
+@timing.timed
 def set_echang(dest, simple=False, threshold=0.5, step=0.5):
     log.info(f'Moving ECHANGL to {dest:.3f} deg')
     if simple is True:
         log.debug(f"Making simple move to {dest:.3f}")
-        set('hires', 'ECHANGL', dest, wait=True)
+        _move('ECHANGL', dest, dest - echang())
     else:
         delta = dest - echang()
         log.debug(f'Total move is {delta:.3f} deg')
@@ -240,19 +268,21 @@ def set_echang(dest, simple=False, threshold=0.5, step=0.5):
             for i in range(nsteps):
                 movedest = echang() + np.sign(delta)*step
                 log.debug(f"Making intermediate move to {movedest:.3f}")
-                set('hires', 'ECHANGL', movedest, wait=True)
+                _move('ECHANGL', movedest, step)
                 sleep(1)
         log.debug(f"Making final move to {dest:.3f}")
-        set('hires', 'ECHANGL', dest, wait=True)
+        _move('ECHANGL', dest, dest - echang())
     log.info(f"Done.  ECHANGL = {echang():.3f} deg")
     return echang()
 
 
+@locks.locked('hires_echelle')
+@timing.timed
 def set_echraw(dest, simple=False, threshold=2000, step=2000):
     log.info(f'Moving ECHRAW to {dest:.3f} counts')
     if simple is True:
         log.debug(f"Making simple move to {dest:.3f}")
-        set('hires', 'ECHRAW', dest, wait=True)
+        _move('ECHRAW', dest, dest - echraw())
     else:
         delta = dest - echraw()
         log.debug(f'Total move is {delta:.3f} counts')
@@ -262,10 +292,10 @@ def set_echraw(dest, simple=False, threshold=2000, step=2000):
             for i in range(nsteps):
                 movedest = echraw() + np.sign(delta)*step
                 log.debug(f"Making intermediate move to {movedest:.3f}")
-                set('hires', 'ECHRAW', movedest, wait=True)
+                _move('ECHRAW', movedest, step)
                 sleep(1)
         log.debug(f"Making final move to {dest:.3f}")
-        set('hires', 'ECHRAW', dest, wait=True)
+        _move('ECHRAW', dest, dest - echraw())
     log.debug(f"Done.  ECHRAW = {echraw():.3f} steps")
     return echraw()
 
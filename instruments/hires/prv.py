@@ -13,6 +13,7 @@ from .mechs import *
 # -----------------------------------------------------------------------------
 # Afternoon Setup for PRV
 # -----------------------------------------------------------------------------
+@timing.timed
 def PRV_afternoon_setup(check_iodine=True, fnroot=None):
     """Configure the instrument for afternoon setup (PRV mode).
     """
@@ -120,6 +121,7 @@ https://caltech-ipac.github.io/hiresprv/setup.html#spectrograph-alignment-and-fo
 # -----------------------------------------------------------------------------
 # PRV Calibrations
 # -----------------------------------------------------------------------------
+@timing.timed
 def PRV_calibrations():
     print('Running PRV afternoon calibrations.  Before running this, the '
           'instrument should already be configured for PRV observations.')
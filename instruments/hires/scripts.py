@@ -7,6 +7,7 @@ from .dewar import *
 from .expo import *
 from .iodine import *
 from .mechs import *
+from .configure import *
 
 from time import sleep
 from astropy.io import fits
@@ -54,6 +55,7 @@ def estimate_flat_times(flattime=30, target_level=60000):
     return flattimes
 
 
+@timing.timed
 def take_characterization_data(noflats=True, nframes=5, binning='2x1',
           darktimes=[60,120,300,600,900],
           flattimes=[10, 15, 20, 25, 30, 40, 50, 60, 80, 100, 140, 180],
@@ -97,6 +99,7 @@ def take_characterization_data(noflats=True, nframes=5, binning='2x1',
 # -----------------------------------------------------------------------------
 # Calibrate Cross Disperser
 # -----------------------------------------------------------------------------
+@timing.timed
 def calibrate_cd():
     # Check that lights are off and foor is closed in the HIRES enclosure
     if enclosure_safe() is False:
@@ -127,53 +130,20 @@ def calibrate_cd():
     set('hiccd', 'postpix', 80)
 
     # modify -s hires xdraw = -10000
-    set_xdraw(-10000)
-    open_covers()
-    set_obstype('IntFlat')
+    configure(xdraw=-10000, covers='open', obstype='IntFlat')
 
     # -------------------------------------------------------------------------
     # Loop until done
     done = False
     while not done:
         # -------------------------------------------------------------------------
-        # prep for calibration images
-        # modify -s hires lfilname=ng3 nowait
-        set_lamp_filter('ng3', wait=False)
-        # modify -s hires lampname=quartz2 nowait
-        set_lamp('quartz2', wait=False)
-        # modify -s hires deckname=D5 nowait
-        set_decker('D5', wait=False)
-        # modify -s hires fil1name=clear nowait
-        # modify -s hires fil2name=clear nowait
-        set_filters('clear', 'clear', wait=False)
-        # modify -s hires cofname=DR00mm nowait
+        # prep for calibration images: all stages are moved at once and the
+        # cross disperser is driven to XDRAW = -10000 once at 0-order.
         cofname = {'red': 'DR00mm', 'blue': 'DB00mm'}[mode]
-        set('hires', 'COFNAME', cofname, wait=False)
-        # modify -s hires echname=blaze nowait
-        set('hires', 'ECHNAME', 'blaze', wait=False)
-        # modify -s hires slitname=opened nowait
-        open_slit(wait=False)
-        # modify -s hires xdname=0-order nowait
-        set('hires', 'XDNAME', '0-order', wait=False)
-
-        # modify -s hires lfilname=ng3 wait
-        set_lamp_filter('ng3')
-        # modify -s hires lampname=quartz2 wait
-        set_lamp('quartz2')
-        # modify -s hires deckname=D5 wait
-        set_decker('D5')
-        # modify -s hires fil1name=clear wait
-        # modify -s hires fil2name=clear wait
-        set_filters('clear', 'clear')
-        # modify -s hires coll=red wait
-        # modify -s hires cofname=DR00mm wait
-        set('hires', 'COFNAME', cofname)
-        # modify -s hires echname=blaze wait
-        set('hires', 'ECHNAME', 'blaze')
-        # modify -s hires slitname=opened wait
-        open_slit()
-
-        set_xdraw(-10000)
+        configure(lamp_filter='ng3', lamp='quartz2', decker='D5',
+                  filters=('clear', 'clear'), cofname=cofname,
+                  echname='blaze', slitname='opened', xdname='0-order',
+                  xdraw=-10000)
         take_exposure()
     
         # Analyze Result
@@ -1,28 +1,50 @@
 import logging
+import threading
 from pathlib import Path
 
 
 ##-------------------------------------------------------------------------
 ## Create logger object
 ##-------------------------------------------------------------------------
+## create_log may be called again for the same logger (e.g. when a module is
+## reloaded, or from several threads at once) without stacking up duplicate
+## handlers: the handlers it added before are reused and their level updated.
+_log_lock = threading.Lock()
+
+
+def _find_handler(log, kind, logfile=None):
+    for handler in log.handlers:
+        if getattr(handler, 'create_log', None) != kind:
+            continue
+        if logfile is None or Path(handler.baseFilename) == logfile:
+            return handler
+    return None
+
+
 def create_log(name='KeckInstrument', loglevel=logging.INFO, logfile=None):
     if type(loglevel) == str:
         loglevel = getattr(logging, loglevel.upper())
-    log = logging.getLogger(name)
-    log.setLevel(logging.DEBUG)
-    ## Set up console output
-    LogConsoleHandler = logging.StreamHandler()
-    LogConsoleHandler.setLevel(loglevel)
-    LogFormat = logging.Formatter('%(asctime)s %(levelname)8s: %(message)s')
-    LogConsoleHandler.setFormatter(LogFormat)
-    log.addHandler(LogConsoleHandler)
-    ## Set up file output
-    if logfile is not None:
-        logfile = Path(logfile).expanduser()
-        if logfile.parent.exists() and logfile.parent.is_dir():
-            LogFileHandler = logging.FileHandler(logfile)
-            LogFileHandler.setLevel(logging.DEBUG)
-            LogFileHandler.setFormatter(LogFormat)
-            log.addHandler(LogFileHandler)
-    
+    with _log_lock:
+        log = logging.getLogger(name)
+        log.setLevel(logging.DEBUG)
+        LogFormat = logging.Formatter('%(asctime)s %(levelname)8s: %(message)s')
+        ## Set up console output
+        LogConsoleHandler = _find_handler(log, 'console')
+        if LogConsoleHandler is None:
+            LogConsoleHandler = logging.StreamHandler()
+            LogConsoleHandler.create_log = 'console'
+            LogConsoleHandler.setFormatter(LogFormat)
+            log.addHandler(LogConsoleHandler)
+        LogConsoleHandler.setLevel(loglevel)
+        ## Set up file output
+        if logfile is not None:
+            logfile = Path(logfile).expanduser().absolute()
+            if logfile.parent.exists() and logfile.parent.is_dir()\
+               and _find_handler(log, 'file', logfile) is None:
+                LogFileHandler = logging.FileHandler(logfile)
+                LogFileHandler.create_log = 'file'
+                LogFileHandler.setLevel(logging.DEBUG)
+                LogFileHandler.setFormatter(LogFormat)
+                log.addHandler(LogFileHandler)
+
     return log
@@ -0,0 +1,553 @@
+import contextvars
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+try:
+    import ktl
+except ModuleNotFoundError as e:
+    ktl = None
+
+from instruments import retry, subscriptions
+
+##-------------------------------------------------------------------------
+## Keyword Connection Pool
+##-------------------------------------------------------------------------
+## One process-wide registry of KTL services and keyword handles.  Each
+## service is opened once and each keyword handle is looked up once, then
+## reused by every caller in the mosfire and hires packages.
+_backend = ktl
+_services = {}
+_keywords = {}
+_lock = threading.RLock()
+_service_locks = {}
+_executor = None
+_values = {}
+_unconfirmed = {}
+_updaters = {}
+_listeners = []
+_change_hooks = []
+_origin = contextvars.ContextVar('keyword_origin', default=None)
+cache_stats = {'hits': 0, 'misses': 0, 'writes_skipped': 0}
+## Enough workers to issue every POS and TARG keyword of the 92 CSU bars in a
+## single wave.  Threads are only created as they are needed.
+max_workers = 192
+
+
+class KeywordServiceError(Exception):
+    '''Raised when a keyword service can not be opened or a keyword can not
+    be found on it.
+    '''
+    pass
+
+
+class UnknownKeyword(KeywordServiceError):
+    '''Raised when a keyword can not be found on a service which is up.
+    '''
+    pass
+
+
+class ServiceUnavailable(KeywordServiceError):
+    '''Raised, without contacting the server, when a service has failed
+    repeatedly and is considered down (see instruments.retry).
+    '''
+    pass
+
+
+def available():
+    '''Return True if a keyword backend (normally the ktl module) is
+    available.
+    '''
+    return _backend is not None
+
+
+def set_backend(backend):
+    '''Use `backend` in place of the ktl module for all keyword access (for
+    example a fakektl.Simulator).  Any open connections are dropped.
+    '''
+    global _backend
+    with _lock:
+        _backend = backend
+        disconnect_all()
+
+
+def _service_lock(service):
+    '''Return the lock which serialises opening a service and looking up its
+    keywords, so that a slow service does not hold up the others.
+    '''
+    with _lock:
+        return _service_locks.setdefault(service, threading.RLock())
+
+
+def get_service(service):
+    '''Return the (cached) service object for the named KTL service.  The
+    service is opened on first use and reused for every later call.
+    '''
+    service = service.lower()
+    with _lock:
+        if service in _services:
+            return _services[service]
+        backend = _backend
+    if backend is None:
+        raise KeywordServiceError(f'No keyword backend available to open '
+                                  f'service "{service}"')
+    with _service_lock(service):
+        with _lock:
+            if service in _services:
+                return _services[service]
+        try:
+            opened = backend.cache(service=service)
+        except Exception as e:
+            raise KeywordServiceError(f'Unable to open service "{service}": '
+                                      f'{e}')
+        with _lock:
+            return _services.setdefault(service, opened)
+
+
+def _lookup(key):
+    try:
+        return get_service(key[0])[key[1]]
+    except KeyError as e:
+        raise UnknownKeyword(f'Unable to find keyword {key[0]}.{key[1]}: {e}')
+
+
+def get_keyword(service, keyword):
+    '''Return the (cached) keyword handle for service.keyword.  If the lookup
+    fails for any reason other than the keyword not existing, the service is
+    reconnected once before giving up.
+    '''
+    key = (service.lower(), keyword.upper())
+    with _lock:
+        if key in _keywords:
+            return _keywords[key]
+    with _service_lock(key[0]):
+        with _lock:
+            if key in _keywords:
+                return _keywords[key]
+        try:
+            kw = _lookup(key)
+        except KeywordServiceError:
+            raise
+        except Exception:
+            reconnect(key[0])
+            try:
+                kw = _lookup(key)
+            except KeywordServiceError:
+                raise
+            except Exception as e:
+                raise UnknownKeyword(f'Unable to find keyword '
+                                     f'{key[0]}.{key[1]}: {e}')
+        with _lock:
+            return _keywords.setdefault(key, kw)
+
+
+def reconnect(service):
+    '''Drop the cached service and all of its keyword handles so that they
+    are re-opened on next use.
+    '''
+    service = service.lower()
+    with _lock:
+        _services.pop(service, None)
+        for key in [key for key in _keywords.keys() if key[0] == service]:
+            _keywords.pop(key)
+            _values.pop(key, None)
+    subscriptions.reattach(service)
+
+
+def disconnect_all():
+    '''Drop every cached service and keyword handle.
+    '''
+    with _lock:
+        _services.clear()
+        _keywords.clear()
+        _values.clear()
+    subscriptions.reattach()
+
+
+##-------------------------------------------------------------------------
+## Event Listeners
+##-------------------------------------------------------------------------
+## Listeners (for example the traffic recorder) are called in the calling
+## thread for every read, write, wait and monitor update as:
+##     listener(event, service, keyword, value, start, duration, ok)
+## where start is the unix time and duration is in seconds.  With no
+## listeners registered the only overhead is an empty list check.
+def add_listener(listener):
+    '''Register a function to be called for every keyword event.'''
+    with _lock:
+        if listener not in _listeners:
+            _listeners.append(listener)
+
+
+def remove_listener(listener):
+    '''Unregister a function added with add_listener.'''
+    with _lock:
+        if listener in _listeners:
+            _listeners.remove(listener)
+
+
+def notify_listeners(event, service, keyword, value, start, duration,
+                     ok=True):
+    '''Pass a keyword event to every registered listener.  A listener which
+    raises is never allowed to break the keyword access it is observing.
+    '''
+    for listener in list(_listeners):
+        try:
+            listener(event, service, keyword, value, start, duration, ok)
+        except Exception:
+            pass
+
+
+##-------------------------------------------------------------------------
+## Change Hooks
+##-------------------------------------------------------------------------
+## Hooks are called with no arguments after every keyword write, monitor
+## update of a cached keyword and completed keyword wait, whether or not any
+## listeners are registered.  instruments.conditions uses one to end its
+## condition epoch.
+def add_change_hook(hook):
+    '''Register a function to be called whenever keyword values may have
+    changed.
+    '''
+    with _lock:
+        if hook not in _change_hooks:
+            _change_hooks.append(hook)
+
+
+def remove_change_hook(hook):
+    '''Unregister a function added with add_change_hook.'''
+    with _lock:
+        if hook in _change_hooks:
+            _change_hooks.remove(hook)
+
+
+def notify_change():
+    '''Call every change hook.'''
+    for hook in list(_change_hooks):
+        try:
+            hook()
+        except Exception:
+            pass
+
+
+def _observed(event, service, keyword, value, call, *args, **kwargs):
+    '''Run call(*args, **kwargs) and report it to the listeners.  For reads
+    the value reported is the value returned.
+    '''
+    start = time.time()
+    t0 = time.perf_counter()
+    ok = False
+    try:
+        result = call(*args, **kwargs)
+        ok = True
+        return result
+    finally:
+        if event == 'read':
+            value = result if ok else None
+        notify_listeners(event, service, keyword, value, start,
+                         time.perf_counter() - t0, ok=ok)
+
+
+def _guarded(service, call, *args, **kwargs):
+    '''Run call(*args, **kwargs) under the circuit breaker of the service:
+    fail fast if the service is known to be down, otherwise record whether
+    the call worked.
+    '''
+    if retry.enabled is not True:
+        return call(*args, **kwargs)
+    breaker = retry.breaker(service)
+    if not breaker.allow():
+        raise ServiceUnavailable(f'Service "{service}" is down after '
+                                 f'{breaker.failures} consecutive failures')
+    try:
+        result = call(*args, **kwargs)
+    except UnknownKeyword:
+        breaker.success()
+        raise
+    except Exception:
+        breaker.failure()
+        raise
+    breaker.success()
+    return result
+
+
+def _read_once(service, keyword):
+    try:
+        return get_keyword(service, keyword).read()
+    except KeywordServiceError:
+        raise
+    except Exception:
+        reconnect(service)
+        raise
+
+
+def _read(service, keyword):
+    return retry.policy_for(service).call(_guarded, service, _read_once,
+                                          service, keyword,
+                                          label=service.lower(),
+                                          give_up=(UnknownKeyword,
+                                                   ServiceUnavailable))
+
+
+def read(service, keyword):
+    '''Read a keyword value via the shared connection pool.  A failed read
+    reconnects the service and is retried under the retry policy of the
+    service (see instruments.retry).  Raises ServiceUnavailable at once if
+    the service is known to be down.
+    '''
+    if not _listeners:
+        return _read(service, keyword)
+    return _observed('read', service, keyword, None, _read, service, keyword)
+
+
+def _write_once(service, keyword, value, wait):
+    return get_keyword(service, keyword).write(value, wait=wait)
+
+
+def _write(service, keyword, value, wait=True, policy=None):
+    policy = retry.no_retry if policy is None else policy
+    return policy.call(_guarded, service, _write_once,
+                       service, keyword, value, wait, label=service.lower(),
+                       give_up=(UnknownKeyword, ServiceUnavailable))
+
+
+def write(service, keyword, value, wait=True, policy=None):
+    '''Write a keyword value via the shared connection pool.  Writes are not
+    retried (a write may start a move) unless a RetryPolicy is given.  Raises
+    ServiceUnavailable at once if the service is known to be down.
+    '''
+    key = (service.lower(), keyword.upper())
+    with _lock:
+        _values.pop(key, None)
+        _unconfirmed[key] = (value, time.monotonic())
+    try:
+        if not _listeners:
+            return _write(service, keyword, value, wait=wait, policy=policy)
+        return _observed('write', service, keyword, value, _write, service,
+                         keyword, value, wait=wait, policy=policy)
+    finally:
+        notify_change()
+
+
+##-------------------------------------------------------------------------
+## Keyword Value Cache
+##-------------------------------------------------------------------------
+## Read-mostly keywords can be served from a local cache.  The first cached
+## read of a keyword subscribes it on the subscription hub and every
+## broadcast from the server replaces the cached value, so cached values stay
+## current without further round trips.  A write through this module drops the cached value,
+## and nothing is cached for that keyword again until a broadcast or read
+## shows the value written (or confirm_timeout seconds have passed), so a
+## broadcast of the old value which was already in flight can not put it back.
+confirm_timeout = 10
+
+
+def _cacheable(key, value):
+    '''Return True if a value seen for key may be cached (called with _lock
+    held).
+    '''
+    entry = _unconfirmed.get(key, None)
+    if entry is None:
+        return True
+    written, when = entry
+    if same_value(value, written) or time.monotonic() - when > confirm_timeout:
+        del _unconfirmed[key]
+        return True
+    return False
+
+
+def _cache_updater(key):
+    def update(kw):
+        with _lock:
+            value = kw['ascii']
+            if _cacheable(key, value):
+                _values[key] = (value, time.monotonic())
+        notify_change()
+        if _listeners:
+            notify_listeners('monitor', key[0], key[1], value, time.time(), 0)
+    return update
+
+
+def cached_read(service, keyword, ttl=None):
+    '''Return the value of service.keyword from the local cache if there is
+    one (and it is younger than `ttl` seconds when a ttl is given), otherwise
+    read it from the server and start monitoring it.
+    '''
+    key = (service.lower(), keyword.upper())
+    with _lock:
+        entry = _values.get(key, None)
+        if entry is not None\
+           and (ttl is None or time.monotonic() - entry[1] < ttl):
+            cache_stats['hits'] += 1
+            return entry[0]
+        cache_stats['misses'] += 1
+    with _lock:
+        updater = _updaters.setdefault(key, _cache_updater(key))
+    subscriptions.subscribe(service, keyword, updater)
+    started = time.monotonic()
+    value = read(service, keyword)
+    with _lock:
+        ## A broadcast which arrived while the read was in flight is newer
+        ## than the value read, keep it.
+        entry = _values.get(key, None)
+        if entry is not None and entry[1] >= started:
+            return entry[0]
+        if _cacheable(key, value):
+            _values[key] = (value, time.monotonic())
+    return value
+
+
+def same_value(current, value):
+    '''Compare a keyword value (as read, a string) with a value about to be
+    written, allowing for booleans and numbers written in another form.
+    '''
+    current = str(current).strip()
+    if isinstance(value, bool):
+        truths = ['true', 'yes', 'on', '1']
+        return (current.lower() in truths) is value
+    if isinstance(value, (int, float)):
+        try:
+            return float(current) == float(value)
+        except ValueError:
+            return False
+    return current == str(value).strip()
+
+
+def write_if_changed(service, keyword, value, wait=True, ttl=None):
+    '''Write service.keyword only if its (cached) current value differs from
+    `value`.  Returns True if the write was issued, False if it was skipped.
+
+    Do not use this for trigger keywords (e.g. GO, EXPOSE, SETUPGO) which must
+    be written even when the value has not changed.
+    '''
+    if same_value(cached_read(service, keyword, ttl=ttl), value):
+        with _lock:
+            cache_stats['writes_skipped'] += 1
+        return False
+    write(service, keyword, value, wait=wait)
+    return True
+
+
+def clear_cache():
+    '''Drop all cached values and reset the cache counters.'''
+    with _lock:
+        _values.clear()
+        _unconfirmed.clear()
+        for stat in cache_stats.keys():
+            cache_stats[stat] = 0
+
+
+##-------------------------------------------------------------------------
+## Bulk Keyword Access
+##-------------------------------------------------------------------------
+def get_executor():
+    '''Return the shared thread pool used to issue keyword requests
+    concurrently.
+    '''
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix='keywords')
+        return _executor
+
+
+def expand(names, indices=None):
+    '''Expand a keyword family into a list of keyword names.  `names` is either
+    a list of keyword names or a format pattern such as "B{:02d}POS" which is
+    filled in with each value in `indices`.
+    '''
+    if isinstance(names, str):
+        if indices is None:
+            return [names]
+        return [names.format(index) for index in indices]
+    return list(names)
+
+
+def origin():
+    '''Return the stack frame which submitted the bulk keyword request being
+    run in the current thread, or None outside of a bulk request.  Listeners
+    use this to find the function which really asked for the keywords.
+    '''
+    return _origin.get()
+
+
+def _run_from(frame, call, *args, **kwargs):
+    token = _origin.set(frame)
+    try:
+        return call(*args, **kwargs)
+    finally:
+        _origin.reset(token)
+
+
+def _submit(call, *args, **kwargs):
+    '''Submit call(*args, **kwargs) to the shared executor.  When anything is
+    listening, the submitting frame is handed on to the worker thread (see
+    origin).
+    '''
+    if not _listeners:
+        return get_executor().submit(call, *args, **kwargs)
+    return get_executor().submit(_run_from, sys._getframe(1), call,
+                                 *args, **kwargs)
+
+
+def read_many(service, names, indices=None, dtype=None):
+    '''Read a family of keywords on one service concurrently and return the
+    values as a numpy array in the same order as the keyword names.
+
+    Example: read_many('mcsus', 'B{:02d}POS', range(1,93), dtype=float)
+    '''
+    names = expand(names, indices=indices)
+    futures = [_submit(read, service, kw) for kw in names]
+    results = [future.result() for future in futures]
+    if dtype is None:
+        return np.array(results)
+    return np.array(results).astype(dtype)
+
+
+def read_batch(requests):
+    '''Read a list of (service, keyword) pairs, which may span several
+    services, concurrently.  Returns a dictionary of {(service, KEYWORD):
+    value}.  Raises KeywordServiceError naming every keyword which could not
+    be read.
+    '''
+    keys = [(service.lower(), keyword.upper()) for service, keyword in requests]
+    futures = {key: _submit(read, *key) for key in keys}
+    values = {}
+    errors = []
+    for key, future in futures.items():
+        try:
+            values[key] = future.result()
+        except Exception as e:
+            errors.append(f'{key[0]}.{key[1]} ({e})')
+    if len(errors) > 0:
+        raise KeywordServiceError(f'Unable to read {", ".join(errors)}')
+    return values
+
+
+def write_many(service, values, wait=True):
+    '''Write a set of keywords on one service concurrently.  `values` is a
+    dictionary of {keyword: value}.  All writes are dispatched at once and
+    then all acknowledgements are collected.
+
+    Returns a dictionary of {keyword: exception} for every write which failed
+    (an empty dictionary means every write succeeded).
+    '''
+    futures = {kw: _submit(write, service, kw, value, wait=wait)
+               for kw, value in values.items()}
+    errors = {}
+    for kw, future in futures.items():
+        try:
+            future.result()
+        except Exception as e:
+            errors[kw] = e
+    return errors
+
+
+def connect_to_ktl(instrument, serviceNames):
+    '''Open each of the named services for an instrument and return them as a
+    dictionary keyed by service name.
+    '''
+    return {service: get_service(service) for service in serviceNames}
@@ -0,0 +1,283 @@
+import asyncio
+import functools
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+try:
+    import fcntl
+except ModuleNotFoundError as e:
+    fcntl = None
+
+
+##-------------------------------------------------------------------------
+## Mechanism Resource Locks
+##-------------------------------------------------------------------------
+## Control functions take a lock on the mechanisms they drive so that two
+## callers (threads of one script, or separate scripts and daemons on the
+## same host) can not drive the same mechanism at once.  Locks are either
+## "shared" (many holders, e.g. read-only checks which must not see a move
+## start) or "exclusive" (one holder, for anything which moves a mechanism).
+##
+## Within a process the locks are reentrant per owner, the thread (or asyncio
+## task) which took them: a function holding a lock can call other locked
+## functions.  Other threads, including the planner's and aio's worker
+## threads started by the holder, wait like any other caller, so a step which
+## needs a lock must take it itself (see _move_csu in mosfire.configure)
+## rather than rely on one held by the code which runs the plan.  Between
+## processes
+## the locks are advisory flock() locks on one file per resource in
+## `directory` (set with the KECK_LOCKS environment variable).  The directory
+## is shared by every account which runs control scripts on the host: the
+## default directory and the lock files are made writable by all when they
+## are created, and a KECK_LOCKS directory must be writable by all of those
+## accounts (e.g. group writable).
+##
+## A caller which can not take a lock within `default_timeout` seconds gets a
+## LockTimeout rather than blocking for ever behind a hung process.
+##
+##     with locks.acquire('csu', timeout=60):
+##         setup_mask(mask)
+##         execute_mask()
+##         waitfor_CSU()
+##
+##     @locks.locked('filter_wheels')
+##     def quick_dark(...):
+resources = ['csu', 'filter_wheels', 'grating_turret', 'rotator', 'fcs',
+             'detector', 'hires_covers', 'hires_lamp', 'hires_lamp_filter',
+             'hires_xd', 'hires_echelle', 'hires_detector']
+directory = Path(os.environ.get('KECK_LOCKS',
+                 Path(tempfile.gettempdir()) / 'keck_instrument_locks'))
+enabled = True
+default_timeout = 900
+poll = 0.05
+_lock = threading.Lock()
+_locks = {}
+
+
+class LockTimeout(Exception):
+    '''Raised when a resource lock can not be acquired within the timeout.'''
+    pass
+
+
+def _owner():
+    '''Identify the thread, or the asyncio task within it, taking a lock.'''
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    return (threading.get_ident(), None if task is None else id(task))
+
+
+class ResourceLock(object):
+    '''A shared/exclusive lock on one named resource, backed by a file lock
+    so that it also excludes other processes.
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.condition = threading.Condition()
+        self.readers = {}
+        self.writer = None
+        self.depth = 0
+        self.fd = None
+
+    def _lock_file(self, exclusive, deadline):
+        '''Take the process-wide file lock (called with the condition held
+        when the lock goes from free to held in this process).
+        '''
+        if fcntl is None:
+            return True
+        fd = _open_lock_file(self.name)
+        flag = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        while True:
+            try:
+                fcntl.flock(fd, flag | fcntl.LOCK_NB)
+                self.fd = fd
+                return True
+            except BlockingIOError:
+                if deadline is not None and time.monotonic() >= deadline:
+                    os.close(fd)
+                    return False
+                time.sleep(poll)
+
+    def _unlock_file(self):
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+
+    def held_by(self, owner):
+        '''Return True (exclusive), False (shared) or None (not held) for the
+        hold of `owner` on this lock.
+        '''
+        with self.condition:
+            if self.writer == owner:
+                return True
+            return False if owner in self.readers else None
+
+    def acquire(self, exclusive=True, timeout=None, owner=None):
+        '''Returns True if the lock was acquired within `timeout` seconds.
+        An owner which already holds the lock takes it again at once, except
+        that a shared hold can not be upgraded to an exclusive one.
+        '''
+        owner = _owner() if owner is None else owner
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            if self.writer == owner:
+                self.depth += 1
+                return True
+            if owner in self.readers:
+                if exclusive is True:
+                    raise RuntimeError(f'Can not upgrade the shared lock on '
+                                       f'{self.name} to an exclusive lock')
+                self.readers[owner] += 1
+                return True
+            def free():
+                return self.writer is None\
+                       and (exclusive is False or len(self.readers) == 0)
+            while not free():
+                remaining = None if deadline is None\
+                            else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+            if self.writer is None and len(self.readers) == 0:
+                if not self._lock_file(exclusive, deadline):
+                    return False
+            if exclusive is True:
+                self.writer = owner
+                self.depth = 1
+            else:
+                self.readers[owner] = 1
+            return True
+
+    def release(self, owner=None):
+        owner = _owner() if owner is None else owner
+        with self.condition:
+            if self.writer == owner:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.writer = None
+            else:
+                self.readers[owner] -= 1
+                if self.readers[owner] == 0:
+                    self.readers.pop(owner)
+            if self.writer is None and len(self.readers) == 0:
+                self._unlock_file()
+            self.condition.notify_all()
+
+    def __repr__(self):
+        state = 'exclusive' if self.writer is not None else\
+                f'shared by {len(self.readers)}' if len(self.readers) > 0\
+                else 'free'
+        return f'<ResourceLock {self.name}: {state}>'
+
+
+def _open_lock_file(name):
+    '''Open (creating it if needed) the lock file of a resource.  A new file
+    is made writable by all, an existing one (which may belong to another
+    account) is opened read only, which is all flock() needs.
+    '''
+    if not directory.exists():
+        try:
+            directory.mkdir(parents=True)
+            os.chmod(directory, 0o1777)
+        except FileExistsError:
+            pass
+    path = directory / f'{name}.lock'
+    try:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o666)
+        os.fchmod(fd, 0o666)
+        return fd
+    except FileExistsError:
+        return os.open(path, os.O_RDONLY)
+
+
+def get_lock(name):
+    '''Return the ResourceLock for a named resource.'''
+    if name not in resources:
+        raise ValueError(f'Unknown resource "{name}"')
+    with _lock:
+        if name not in _locks:
+            _locks[name] = ResourceLock(name)
+        return _locks[name]
+
+
+class acquire(object):
+    '''Context manager which holds locks on the named resources.  Locks are
+    taken in a fixed order so that two callers can not deadlock each other.
+    Raises LockTimeout if they can not all be acquired within `timeout`
+    seconds (default: `default_timeout`, None waits for ever).
+    '''
+    def __init__(self, *names, shared=False, timeout=-1):
+        self.names = sorted(set(names))
+        self.exclusive = not shared
+        self.timeout = default_timeout if timeout == -1 else timeout
+        self.taken = []
+        self.owner = None
+
+    def __enter__(self):
+        if enabled is not True:
+            return self
+        self.owner = _owner()
+        deadline = None if self.timeout is None\
+                   else time.monotonic() + self.timeout
+        for name in self.names:
+            remaining = None if deadline is None\
+                        else max(0, deadline - time.monotonic())
+            lock = get_lock(name)
+            try:
+                acquired = lock.acquire(self.exclusive, timeout=remaining,
+                                        owner=self.owner)
+            except RuntimeError:
+                self._release()
+                raise
+            if not acquired:
+                self._release()
+                holder = 'another process' if repr(lock).endswith('free>')\
+                         else f'this process ({lock})'
+                raise LockTimeout(f'Unable to lock {name} within '
+                                  f'{self.timeout} s, it is held by {holder}')
+            self.taken.append(name)
+        return self
+
+    def _release(self):
+        for name in reversed(self.taken):
+            get_lock(name).release(owner=self.owner)
+        self.taken = []
+
+    def __exit__(self, *args):
+        self._release()
+        return False
+
+
+def locked(*names, shared=False, timeout=-1):
+    '''Decorator which holds the named resource locks while the function
+    runs.
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with acquire(*names, shared=shared, timeout=timeout):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def held():
+    '''Return {resource: True if exclusive} for the locks held by the current
+    thread (or asyncio task).
+    '''
+    owner = _owner()
+    with _lock:
+        locks = list(_locks.items())
+    holds = {name: lock.held_by(owner) for name, lock in locks}
+    return {name: hold for name, hold in holds.items() if hold is not None}
+
+
+def status():
+    '''Return the state of every resource lock used in this process.'''
+    with _lock:
+        return {name: repr(lock) for name, lock in _locks.items()}
@@ -0,0 +1,206 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from instruments import keywords, movetimes, retry, timing
+
+
+##-------------------------------------------------------------------------
+## Metrics Endpoint
+##-------------------------------------------------------------------------
+## An optional HTTP endpoint on localhost which serves live control
+## performance metrics in the Prometheus text format:
+##     keck_keyword_seconds        keyword read/write latency per service
+##     keck_keyword_errors_total   failed keyword reads/writes per service
+##     keck_function_wait_seconds  time blocked in keyword waits per function
+##     keck_function_seconds       wall time per function call
+##     keck_move_seconds           mechanism move times (CSU, filters, ...)
+##     keck_move_failures_total    failed moves per mechanism
+##     keck_exposure_overhead_seconds  exposure duration minus integration
+##     keck_retries_total          retries per service (or function)
+##     keck_service_breaker        circuit breaker state per service
+##                                 (0 closed, 1 half-open, 2 open)
+## All values are held in fixed size histograms and counters keyed by
+## service, function or mechanism, so memory use does not grow over the
+## night.  Starting the endpoint enables call timing (instruments.timing).
+##
+##     from instruments import metrics
+##     metrics.start(port=9464)
+##     ...
+##     curl http://localhost:9464/metrics
+default_port = 9464
+## Upper bounds (seconds) of the exported histogram buckets
+buckets = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5,
+           5, 10, 30, 60, 120, 300, 600]
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_server = None
+_thread = None
+
+
+def _histogram(name, labels):
+    key = (name, labels)
+    with _lock:
+        if key not in _histograms:
+            _histograms[key] = timing.Histogram()
+        return _histograms[key]
+
+
+def _count(name, labels):
+    key = (name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + 1
+
+
+##-------------------------------------------------------------------------
+## Collectors
+##-------------------------------------------------------------------------
+def _on_keyword_event(event, service, keyword, value, start, duration, ok):
+    if event not in ['read', 'write']:
+        return
+    labels = (('service', service.lower()), ('operation', event))
+    _histogram('keck_keyword_seconds', labels).record(duration)
+    if ok is not True:
+        _count('keck_keyword_errors_total', labels)
+
+
+def _on_move(mechanism, size, duration, success):
+    if success is not True:
+        _count('keck_move_failures_total', (('mechanism', mechanism),))
+        return
+    _histogram('keck_move_seconds', (('mechanism', mechanism),))\
+        .record(duration)
+    detector, exposure, mode = mechanism.partition('_exposure')
+    if exposure != '':
+        labels = (('detector', detector),)
+        if mode != '':
+            labels += (('mode', mode.lstrip('_')),)
+        _histogram('keck_exposure_overhead_seconds', labels)\
+            .record(max(duration - size, 0))
+
+
+def reset():
+    '''Forget all collected metrics.'''
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+##-------------------------------------------------------------------------
+## Prometheus Text Format
+##-------------------------------------------------------------------------
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')\
+                     .replace('\n', '\\n')
+
+
+def _labels(labels, extra=()):
+    labels = tuple(labels) + tuple(extra)
+    if len(labels) == 0:
+        return ''
+    text = ','.join([f'{k}="{_escape(v)}"' for k, v in labels])
+    return '{' + text + '}'
+
+
+def _format_histogram(name, labels, h):
+    lines = []
+    for le in buckets:
+        lines.append(f'{name}_bucket{_labels(labels, [("le", le)])} '
+                     f'{h.count_below(le)}')
+    lines.append(f'{name}_bucket{_labels(labels, [("le", "+Inf")])} '
+                 f'{h.count}')
+    lines.append(f'{name}_sum{_labels(labels)} {h.total:.6f}')
+    lines.append(f'{name}_count{_labels(labels)} {h.count}')
+    return lines
+
+
+def exposition():
+    '''Return all metrics in the Prometheus text exposition format.'''
+    with _lock:
+        histograms = dict(_histograms)
+        counters = dict(_counters)
+    ## Function timings come from the timing module
+    for (function, phase), h in timing.histograms().items():
+        if phase == 'total':
+            histograms[('keck_function_seconds',
+                        (('function', function),))] = h
+        elif phase == 'wait':
+            histograms[('keck_function_wait_seconds',
+                        (('function', function),))] = h
+    for label, n in dict(retry.retry_counts).items():
+        counters[('keck_retries_total', (('name', label),))] = n
+    states = {'closed': 0, 'half-open': 1, 'open': 2}
+    gauges = {('keck_service_breaker', (('service', service),)): states[state]
+              for service, (state, failures) in retry.status().items()}
+
+    lines = []
+    for name in sorted(set([key[0] for key in histograms])):
+        lines.append(f'# TYPE {name} histogram')
+        for (n, labels), h in sorted(histograms.items()):
+            if n == name:
+                lines.extend(_format_histogram(name, labels, h))
+    for name in sorted(set([key[0] for key in counters])):
+        lines.append(f'# TYPE {name} counter')
+        for (n, labels), value in sorted(counters.items()):
+            if n == name:
+                lines.append(f'{name}{_labels(labels)} {value}')
+    for name in sorted(set([key[0] for key in gauges])):
+        lines.append(f'# TYPE {name} gauge')
+        for (n, labels), value in sorted(gauges.items()):
+            if n == name:
+                lines.append(f'{name}{_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+##-------------------------------------------------------------------------
+## HTTP Server
+##-------------------------------------------------------------------------
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ['/', '/metrics']:
+            self.send_error(404)
+            return
+        body = exposition().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start(port=default_port, address='127.0.0.1'):
+    '''Start collecting metrics and serve them at http://address:port/metrics
+    from a background thread.  Returns the port (useful with port=0).
+    '''
+    global _server, _thread
+    if _server is not None:
+        return _server.server_address[1]
+    _server = ThreadingHTTPServer((address, port), MetricsHandler)
+    _server.daemon_threads = True
+    keywords.add_listener(_on_keyword_event)
+    movetimes.add_listener(_on_move)
+    timing.enable()
+    _thread = threading.Thread(target=_server.serve_forever,
+                               name='instrument_metrics', daemon=True)
+    _thread.start()
+    return _server.server_address[1]
+
+
+def stop():
+    '''Stop the endpoint and stop collecting metrics.'''
+    global _server, _thread
+    keywords.remove_listener(_on_keyword_event)
+    movetimes.remove_listener(_on_move)
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        _thread.join()
+    _server = None
+    _thread = None
+
+
+def running():
+    return _server is not None
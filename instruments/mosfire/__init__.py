@@ -3,7 +3,10 @@ from .obsmode import *
 from .filter import *
 from .fcs import *
 from .metadata import *
+from .csustate import *
 from .csu import *
 from .mask import *
 from .detector import *
-from .rotator import *
\ No newline at end of file
+from .rotator import *
+from .health import *
+from .configure import *
\ No newline at end of file
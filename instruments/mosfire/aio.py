@@ -0,0 +1,64 @@
+'''Asyncio versions of the MOSFIRE control functions.
+
+Each function here takes the same arguments as its blocking counterpart and
+returns a coroutine.  Independent moves can then be run concurrently:
+
+    from instruments.mosfire import aio
+    await asyncio.gather(aio.set_rotpposn(0),
+                         aio.set_exptime(120),
+                         aio.set_sampmode('MCDS16'))
+
+The CSU and the filter wheels are not independent (the instrument is made
+dark before the bars move and the observing mode is changed once they have
+arrived), so do not gather CSU and obsmode calls.  Use configure() or apply()
+for those, which order them with the configuration planner.
+'''
+from instruments.aio import to_async
+from instruments.waits import wait_for_async, wait_until_async
+
+from .csu import setup_mask, execute_mask, initialise_bars, waitfor_CSU,\
+                 get_current_mask
+from .detector import waitfor_exposure, set_exptime, set_coadds,\
+                      set_sampmode, take_exposure, goi
+from .fcs import update_FCS
+from .filter import waitfordark, quick_dark, go_dark
+from .metadata import set_outdir, set_object, set_observer
+from .obsmode import set_obsmode
+from .rotator import set_rotpposn
+
+
+##-------------------------------------------------------------------------
+## CSU
+##-------------------------------------------------------------------------
+setup_mask = to_async(setup_mask)
+execute_mask = to_async(execute_mask)
+initialise_bars = to_async(initialise_bars)
+waitfor_CSU = to_async(waitfor_CSU)
+get_current_mask = to_async(get_current_mask)
+
+##-------------------------------------------------------------------------
+## Detector
+##-------------------------------------------------------------------------
+waitfor_exposure = to_async(waitfor_exposure)
+set_exptime = to_async(set_exptime)
+set_coadds = to_async(set_coadds)
+set_sampmode = to_async(set_sampmode)
+take_exposure = to_async(take_exposure)
+goi = to_async(goi)
+
+##-------------------------------------------------------------------------
+## Mechanisms
+##-------------------------------------------------------------------------
+update_FCS = to_async(update_FCS)
+waitfordark = to_async(waitfordark)
+quick_dark = to_async(quick_dark)
+go_dark = to_async(go_dark)
+set_obsmode = to_async(set_obsmode)
+set_rotpposn = to_async(set_rotpposn)
+
+##-------------------------------------------------------------------------
+## Metadata
+##-------------------------------------------------------------------------
+set_outdir = to_async(set_outdir)
+set_object = to_async(set_object)
+set_observer = to_async(set_observer)
@@ -0,0 +1,142 @@
+from dataclasses import dataclass
+
+from instruments.planner import Plan, PlanError, config_diff
+
+from .core import *
+from .csu import setup_mask, execute_mask, waitfor_CSU
+from .csustate import mask_diff
+from .detector import set_exptime, set_coadds, set_sampmode
+from .fcs import update_FCS
+from .filter import go_dark
+from .obsmode import set_obsmode
+from .rotator import set_rotpposn
+
+
+##-----------------------------------------------------------------------------
+## Configuration Planner
+##-----------------------------------------------------------------------------
+## Real dependencies between MOSFIRE mechanisms:
+##   * the instrument is made dark before the CSU bars move
+##   * the observing mode (which moves the filter wheels) is only changed
+##     once the instrument no longer needs to be dark, i.e. after the bars
+##     have reached their destination
+##   * the FCS is updated after the rotator is in position
+## Everything else (mask setup, rotator, detector parameters) is independent.
+def _move_csu():
+    with locks.acquire('csu'):
+        execute_mask()
+        waitfor_CSU()
+
+
+def configuration_plan(mask=None, obsmode=None, rotpposn=None, exptime=None,
+                       coadds=None, sampmode=None, dark=None, updateFCS=None):
+    '''Build the Plan which brings MOSFIRE to the given configuration.  Only
+    the items which are given are changed.  By default the instrument is made
+    dark when the mask changes and the FCS is updated when the rotator moves.
+    '''
+    plan = Plan('MOSFIRE configuration')
+    if dark is None:
+        dark = mask is not None
+    if updateFCS is None:
+        updateFCS = rotpposn is not None
+    if dark is True:
+        plan.add('dark', go_dark, wait=True)
+    if mask is not None:
+        plan.add('setup_mask', setup_mask, mask)
+        plan.add('move_CSU', _move_csu, after=['dark', 'setup_mask'])
+    if obsmode is not None:
+        plan.add('obsmode', set_obsmode, obsmode, wait=True,
+                 after=['dark', 'move_CSU'])
+    if rotpposn is not None:
+        plan.add('rotator', set_rotpposn, rotpposn)
+    if updateFCS is True:
+        plan.add('FCS', update_FCS, after=['rotator'])
+    if exptime is not None:
+        plan.add('exptime', set_exptime, exptime)
+    if coadds is not None:
+        plan.add('coadds', set_coadds, coadds)
+    if sampmode is not None:
+        plan.add('sampmode', set_sampmode, sampmode)
+    return plan
+
+
+@timing.timed
+def configure(mask=None, obsmode=None, rotpposn=None, exptime=None,
+              coadds=None, sampmode=None, dark=None, updateFCS=None):
+    '''Bring MOSFIRE to the given configuration, moving independent mechanisms
+    at the same time.  Returns the completion report (a PlanReport).
+    '''
+    plan = configuration_plan(mask=mask, obsmode=obsmode, rotpposn=rotpposn,
+                              exptime=exptime, coadds=coadds,
+                              sampmode=sampmode, dark=dark,
+                              updateFCS=updateFCS)
+    log.info(f'Configuring MOSFIRE: {", ".join(plan.steps.keys())}')
+    try:
+        return plan.run(log=log)
+    except PlanError as e:
+        raise FailedCondition(str(e)) from e
+
+
+##-----------------------------------------------------------------------------
+## Declarative Configuration
+##-----------------------------------------------------------------------------
+@dataclass
+class MOSFIREConfig:
+    '''A MOSFIRE configuration.  Items left as None are "don't care" and are
+    not changed by apply().  The CSU mask is not part of the configuration
+    (the current mask is not a single keyword), pass it to configure().
+    '''
+    obsmode: str = None
+    exptime: float = None
+    coadds: int = None
+    sampmode: str = None
+    rotpposn: float = None
+
+
+## Numeric items are considered unchanged within these tolerances
+config_tolerances = {'exptime': 0.001, 'rotpposn': 0.1}
+
+
+def current_config():
+    '''Return the current MOSFIREConfig from a single bulk keyword read.
+    '''
+    values = keywords.read_batch([('mosfire', 'OBSMODE'),
+                                  ('mds', 'ITIME'),
+                                  ('mds', 'COADDS'),
+                                  ('mds', 'SAMPMODE'),
+                                  ('mds', 'NUMREADS'),
+                                  ('dcs', 'ROTPPOSN')])
+    sampmode = {2: 'CDS', 3: 'MCDS'}.get(int(values[('mds', 'SAMPMODE')]),
+                                         'UNKNOWN')
+    if sampmode == 'MCDS':
+        sampmode += values[('mds', 'NUMREADS')]
+    return MOSFIREConfig(obsmode=values[('mosfire', 'OBSMODE')],
+                         exptime=float(values[('mds', 'ITIME')])/1000,
+                         coadds=int(values[('mds', 'COADDS')]),
+                         sampmode=sampmode,
+                         rotpposn=float(values[('dcs', 'ROTPPOSN')]))
+
+
+def config_changes(config, current=None):
+    '''Return a dictionary of the items of `config` which differ from the
+    `current` configuration (read from the instrument if not given).
+    '''
+    if current is None:
+        current = current_config()
+    return config_diff(config, current, tolerances=config_tolerances)
+
+
+@timing.timed
+def apply(config, current=None, mask=None):
+    '''Bring MOSFIRE to the given MOSFIREConfig, touching only the items which
+    differ from the current configuration and moving them in parallel.  A
+    `mask` is only set up if some bars need to move.  Returns the completion report, or None if nothing needed to change.
+    '''
+    changes = config_changes(config, current=current)
+    if mask is not None and len(mask_diff(mask)) == 0:
+        log.info(f'CSU bars are already in position for {mask.name}')
+        mask = None
+    if len(changes) == 0 and mask is None:
+        log.info('MOSFIRE is already configured')
+        return None
+    return configure(mask=mask, **changes)
@@ -1,4 +1,5 @@
 from pathlib import Path
+from datetime import datetime as dt
 import yaml
 import numpy as np
 import socket
@@ -8,7 +9,8 @@ try:
 except ModuleNotFoundError as e:
     pass
 
-from instruments import create_log
+from instruments import conditions, create_log, keywords, locks, movetimes, retry, timing, waits
+from instruments.conditions import instrument_step
 
 
 ##-------------------------------------------------------------------------
@@ -34,9 +36,13 @@ modes = ['dark-imaging', 'dark-spectroscopy', 'imaging', 'spectroscopy']
 filters = ['Y', 'J', 'H', 'K', 'J2', 'J3', 'NB']
 csu_bar_state_file = Path('/s/sdata1300/logs/server/mcsus/csu_bar_state')
 
-# Load default CSU coordinate transformations
 filepath = Path(__file__).parent
-with open(filepath.joinpath('MOSFIRE_transforms.txt'), 'r') as FO:
+transforms_file = filepath.joinpath('MOSFIRE_transforms.txt')
+
+# Load default CSU coordinate transformations.  The transforms in use are
+# csu.transforms, these matrices are kept for scripts which use them directly
+# and are updated by csu.set_transforms.
+with open(transforms_file, 'r') as FO:
     Aphysical_to_pixel, Apixel_to_physical = yaml.safe_load(FO.read())
 Aphysical_to_pixel = np.array(Aphysical_to_pixel)
 Apixel_to_physical = np.array(Apixel_to_physical)
@@ -50,8 +56,7 @@ log = create_log(name, loglevel='DEBUG')
 def instrument_is_MOSFIRE():
     '''Checks whether MOSFIRE is the currently selected instrument.
     '''
-    INSTRUMEkw = ktl.cache(service='dcs', keyword='INSTRUME')
-    if INSTRUMEkw.read() != 'MOSFIRE':
+    if keywords.cached_read('dcs', 'INSTRUME') != 'MOSFIRE':
         raise FailedCondition('MOSFIRE is not the selected instrument')
 
 
@@ -75,38 +80,100 @@ def check_connectivity():
                 raise FailedCondition(f"ping {address}: {stdout} {stderr}")
 
 
-def pupil_rotator_ok():
+def pupil_rotator_ok(snapshot=None):
     '''Commonly used pre- and post- condition to check whether there are errors
     in the pupil rotator status.
     '''
-    mmprs_statuskw = ktl.cache(keyword='STATUS', service='mmprs')
-    pupil_status = mmprs_statuskw.read()
+    pupil_status = keywords.read('mmprs', 'STATUS') if snapshot is None\
+                   else snapshot.status('pupil_rotator')
     if pupil_status != 'OK':
         raise FailedCondition(f'Pupil rotator status is {pupil_status}')
 
 
-def trapdoor_ok():
+def trapdoor_ok(snapshot=None):
     '''Commonly used pre- and post- condition to check whether there are errors
     in the trap door (aka dust cover) status.
     '''
-    mmdcs_statuskw = ktl.cache(keyword='STATUS', service='mmdcs')
-    trapdoor_status = mmdcs_statuskw.read()
+    trapdoor_status = keywords.read('mmdcs', 'STATUS') if snapshot is None\
+                      else snapshot.status('trapdoor')
     if trapdoor_status != 'OK':
         raise FailedCondition(f'Trap door status is {trapdoor_status}')
 
 
-def dustcover_ok():
+def dustcover_ok(snapshot=None):
     '''Alias for trapdoor_ok
     '''
-    return trapdoor_ok()
-
-
-# def check_mechanisms():
-#     '''Simple loop to check all mechanisms.
-#     '''
-#     log.info('Checking mechanisms')
-#     mechs = ['filter1', 'filter2', 'FCS', 'grating_shim', 'grating_turret',
-#              'pupil_rotator', 'trapdoor']
-#     for mech in mechs:
-#         statusfn = getattr(sys.modules[__name__], f'{mech}_ok')
-#         statusfn()
+    return trapdoor_ok(snapshot=snapshot)
+
+
+##-----------------------------------------------------------------------------
+## Health Snapshot
+##-----------------------------------------------------------------------------
+## The status keyword of each mechanism.  The FCS and CSU have their own
+## state keywords which are included in the snapshot separately.
+mechanisms = {'filter1': ('mmf1s', 'STATUS'),
+              'filter2': ('mmf2s', 'STATUS'),
+              'grating_shim': ('mmgss', 'STATUS'),
+              'grating_turret': ('mmgts', 'STATUS'),
+              'pupil_rotator': ('mmprs', 'STATUS'),
+              'trapdoor': ('mmdcs', 'STATUS'),
+             }
+csu_bars = np.arange(1, 93, 1)
+
+
+class HealthSnapshot(object):
+    '''The state of the instrument mechanisms at one moment, as returned by
+    health_snapshot().  The *_ok condition checks accept one of these in
+    place of reading the keywords themselves.
+    '''
+    def __init__(self, values, time=None):
+        self.values = values
+        self.time = dt.utcnow() if time is None else time
+
+    def value(self, service, keyword):
+        key = (service.lower(), keyword.upper())
+        if key not in self.values:
+            raise KeyError(f'{service}.{keyword} is not in this snapshot')
+        return self.values[key]
+
+    def status(self, mechanism):
+        return self.value(*mechanisms[mechanism])
+
+    @property
+    def csuready(self):
+        return int(self.value('mcsus', 'CSUREADY'))
+
+    @property
+    def bar_status(self):
+        return np.array([self.value('mcsus', f'B{bar:02d}STAT')
+                         for bar in csu_bars])
+
+    @property
+    def fcs_active(self):
+        return keywords.same_value(self.value('mfcs', 'ACTIVE'), True)
+
+    @property
+    def fcs_enabled(self):
+        return keywords.same_value(self.value('mfcs', 'ENABLE'), True)
+
+    def __repr__(self):
+        lines = [f'HealthSnapshot at {self.time.isoformat()}']
+        for (service, keyword), value in self.values.items():
+            lines.append(f'  {service}.{keyword} = {value}')
+        return '\n'.join(lines)
+
+
+def health_snapshot(mechs=True, csu=True, fcs=True):
+    '''Read the status of every mechanism, the CSU (including the status of
+    all 92 bars) and the FCS in a single concurrent sweep and return a
+    HealthSnapshot.  Groups which are not needed can be left out.
+    '''
+    requests = []
+    if mechs is True:
+        requests.extend(mechanisms.values())
+    if csu is True:
+        requests.append(('mcsus', 'CSUREADY'))
+        requests.extend([('mcsus', f'B{bar:02d}STAT') for bar in csu_bars])
+    if fcs is True:
+        requests.extend([('mfcs', 'ACTIVE'), ('mfcs', 'ENABLE')])
+    return HealthSnapshot(keywords.read_batch(requests))
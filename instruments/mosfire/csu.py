@@ -2,7 +2,11 @@ import inspect
 from datetime import datetime as dt
 from datetime import timedelta as tdelta
 from time import sleep
+import re
+import threading
+import time
 import numpy as np
+import yaml
 from astropy.table import Table, Column, Row
 
 try:
@@ -10,36 +14,53 @@ try:
 except ModuleNotFoundError as e:
     pass
 
+try:
+    import inotify_simple
+except ModuleNotFoundError as e:
+    inotify_simple = None
+
+from instruments import subscriptions
+
+from . import core
 from .core import *
 from .mask import *
+from .csustate import *
+from .states import csu_machine, csu_start_timeout
 
 
 ##-----------------------------------------------------------------------------
 ## pre- and post- conditions
 ##-----------------------------------------------------------------------------
-def CSUbar_ok(barnum):
+def CSUbar_ok(barnum, snapshot=None):
     '''Commonly used pre- and post- condition to check whether there are errors
-    in the CSU bar status for a specified bar.
+    in the CSU bar status for a specified bar.  A list of bar numbers may also
+    be given, in which case the status keywords are read in one bulk request
+    and every bar which is not OK is reported.
     '''
-    bstatkw = ktl.cache(keyword=f"B{int(barnum):02d}STAT", service='mcsus')
-    bar_status = bstatkw.read()
-    if bar_status != 'OK':
-        raise FailedCondition(f'Bar {int(barnum):02d} status is {bar_status}')
+    bars = np.atleast_1d(barnum).astype(int)
+    if snapshot is None:
+        bar_status = keywords.read_many('mcsus', 'B{:02d}STAT', bars)
+    else:
+        bar_status = snapshot.bar_status[bars-1]
+    bad = bar_status != 'OK'
+    if np.any(bad):
+        msg = ', '.join([f'Bar {bar:02d} status is {status}'
+                         for bar, status in zip(bars[bad], bar_status[bad])])
+        raise FailedCondition(msg)
 
 
-def CSUbars_ok():
-    '''Simple loop to check all bars in the CSU.
+def CSUbars_ok(snapshot=None):
+    '''Check all bars in the CSU using a single bulk read.
     '''
-    for barnum in range(1,93,1):
-        CSUbar_ok(barnum)
+    CSUbar_ok(range(1,93,1), snapshot=snapshot)
 
 
-def CSU_ok():
+def CSU_ok(snapshot=None):
     '''Commonly used pre- and post- condition to check whether the CSU is in an
     error state.
     '''
-    csureadykw = ktl.cache(keyword='CSUREADY', service='mcsus')
-    csuready = int(csureadykw.read())
+    csuready = int(keywords.read('mcsus', 'CSUREADY')) if snapshot is None\
+               else snapshot.csuready
     translation = {0: 'Unknown',
                    1: 'System Started',
                    2: 'Ready for Move',
@@ -53,12 +74,12 @@ def CSU_ok():
         raise FailedCondition(f'CSU is not ready: {translation}')
 
 
-def CSUready():
+def CSUready(snapshot=None):
     '''Commonly used pre- and post- condition to check whether the CSU is ready
     for a move.
     '''
-    csureadykw = ktl.cache(keyword='CSUREADY', service='mcsus')
-    csuready = int(csureadykw.read())
+    csuready = int(keywords.read('mcsus', 'CSUREADY')) if snapshot is None\
+               else snapshot.csuready
     translation = {0: 'Unknown',
                    1: 'System Started',
                    2: 'Ready for Move',
@@ -72,238 +93,338 @@ def CSUready():
         raise FailedCondition(f'CSU is not ready: {translation}')
 
 
+def CSU_and_bars_ok():
+    '''CSU_ok and CSUbars_ok evaluated from a single keyword sweep.
+    '''
+    snapshot = health_snapshot(mechs=False, fcs=False)
+    CSU_ok(snapshot=snapshot)
+    CSUbars_ok(snapshot=snapshot)
+    conditions.mark_passed(CSU_ok, CSUbars_ok)
+
+
 ##-----------------------------------------------------------------------------
 ## Setup Mask
 ##-----------------------------------------------------------------------------
-def setup_mask(mask, skipprecond=False, skippostcond=False):
+@locks.locked('csu')
+@instrument_step(pre=[CSU_and_bars_ok], post=[CSU_and_bars_ok])
+def setup_mask(mask, force=False, timeout=None, skipprecond=False,
+               skippostcond=False):
     '''Setup the given mask.  Accepts a Mask object.
+
+    Only the targets of bars which change are written.  If every bar is
+    already within move_tolerance of the mask and no other move is pending,
+    nothing is done (and the following execute_mask does nothing either)
+    unless force=True.
+
+    The setup must finish within `timeout` seconds (default: from the move
+    time database, or 480 s) or FailedCondition is raised.
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
     ##-------------------------------------------------------------------------
     ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
+    if skipprecond is not True:
         if type(mask) != Mask:
             raise FailedCondition(f"Input {mask} is not a Mask object")
-        CSU_ok()
-        CSUbars_ok()
-    
+        check_collisions(mask)
+
     ##-------------------------------------------------------------------------
     ## Script Contents
     log.info(f'Setting up mask: {mask.name}')
     log.debug('Setting bar target position keywords')
 
-    mcsus = ktl.cache(service='mcsus')
-    for slit in mask.slitpos:
-        rbn = slit['rightBarNumber']
-        rbp = slit['rightBarPositionMM']
-        lbn = slit['leftBarNumber']
-        lbp = slit['leftBarPositionMM']
-        log.debug(f"  Setting B{rbn:02d}TARG = {rbp}")
-        mcsus[f"B{rbn:02d}TARG"].write(rbp)
-        log.debug(f"  Setting B{lbn:02d}TARG = {lbp}")
-        mcsus[f"B{lbn:02d}TARG"].write(lbp)
+    state = CSUState.from_mask(mask)
+    use = np.isfinite(state.target)
+    if force is not True:
+        current = CSUState.from_keywords()
+        moves = mask_diff(state, current=current)
+        if len(moves) == 0 and current.travel() <= move_tolerance:
+            log.info(f'CSU bars are already in position for {mask.name}')
+            return None
+        log.debug(f'{len(moves)} bars need to move')
+        use = moving_bars(state, current.target)
+    targets = {f"B{bar:02d}TARG": target for bar, target
+               in zip(state.bars['bar'][use], state.target[use])}
+    for kw, target in targets.items():
+        log.debug(f"  Setting {kw} = {target}")
+    errors = keywords.write_many('mcsus', targets)
+    if len(errors) > 0:
+        for kw, e in sorted(errors.items()):
+            log.error(f"  Failed to set {kw}: {e}")
+        raise FailedCondition(f"Failed to set {len(errors)} bar targets: "
+                              f"{', '.join(sorted(errors.keys()))}")
 
     log.debug('Invoke SETUP process on CSU')
-    mcsus['SETUPGO'].write(1)
-    mcsus['SETUPNAME'].write(mask.name)
+    csu_machine.command('csu_setup')
+    keywords.write('mcsus', 'SETUPGO', 1)
+    keywords.write('mcsus', 'SETUPNAME', mask.name)
 
     ##-------------------------------------------------------------------------
     ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
-        csustat = ktl.cache(keyword='CSUSTAT', service='mcsus')
-        csustat.monitor()
-        while str(csustat) == 'Creating Group.':
-            sleep(1)
-        if re.search('Setup aborted.  Collision detected at row (\d+)', str(csustat)):
+    if skippostcond is not True:
+        if timeout is None:
+            timeout = csu_machine.expected_timeout(480)
+        endat = time.monotonic() + timeout
+        csustat = keywords.get_keyword('mcsus', 'CSUSTAT')
+        done = csu_machine.wait_for_cycle(['configuring'], ['ready', 'error'],
+                                          timeout=timeout,
+                                          start_timeout=csu_start_timeout)
+        if done is True:
+            remaining = max(endat - time.monotonic(), 0)
+            done = waits.wait_until('mcsus', 'CSUSTAT',
+                                    lambda kw: str(kw) != 'Creating Group.',
+                                    timeout=remaining)
+        if done is not True:
+            raise FailedCondition(f'CSU setup of {mask.name} did not finish '
+                                  f'within {timeout:.0f} s')
+        if re.search(r'Setup aborted.  Collision detected at row (\d+)',
+                     str(csustat)):
             raise FailedCondition(str(csustat))
-        CSU_ok()
-        CSUbars_ok()
-    
+
     return None
 
 
 ##-----------------------------------------------------------------------------
 ## execute_mask
 ##-----------------------------------------------------------------------------
-def execute_mask(skipprecond=False, skippostcond=False):
-    '''Execute a mask which has already been set up.
+@locks.locked('csu')
+@instrument_step(pre=[CSUbars_ok, CSUready])
+def execute_mask(force=False):
+    '''Execute a mask which has already been set up.  Does nothing (unless
+    force=True) if no bar is more than move_tolerance from its target.
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
-    ##-------------------------------------------------------------------------
-    ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
-        CSUbars_ok()
-        CSUready()
-    
-    ##-------------------------------------------------------------------------
-    ## Script Contents
-    csugokw = ktl.cache(service='mcsus', keyword='SETUPGO')
-    csugokw.write(1)
-    sleep(3) # shim needed because CSUREADY keyword doesn't update fast enough
-    
-    ##-------------------------------------------------------------------------
-    ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
-        pass
-    
+    travel = CSUState.from_keywords().travel()
+    if force is not True and travel <= move_tolerance:
+        log.info('CSU bars are already in position, not executing')
+        return None
+    log.debug(f'Largest bar move is {travel:.1f} mm')
+    csu_machine.command('csu_move', size=travel)
+    keywords.write('mcsus', 'SETUPGO', 1)
+
     return None
 
 
 ##-----------------------------------------------------------------------------
 ## Initialize Bars
 ##-----------------------------------------------------------------------------
-def initialise_bars(bars=None, skipprecond=False, skippostcond=False):
+## All of the bars asked for are initialised (homed) together: one INITBAR=0
+## write for every bar, otherwise the INITBAR writes of the bars are sent
+## back to back without waiting for each to complete.  The bars are then
+## followed through their BxxSTAT keywords until every one has homed or
+## failed.  A bar whose status has not left OK within init_start_timeout
+## seconds of the command is read back directly.
+init_start_timeout = 10
+
+
+class BarInitTracker(object):
+    '''Follow the BxxSTAT keywords of bars being initialised and report the
+    progress of each bar as it is "started", "homed" or "failed".  If given,
+    progress(bar, event, status) is called for each event (from the keyword
+    monitor thread).
+    '''
+    def __init__(self, bars, progress=None):
+        self.bars = sorted(set([int(bar) for bar in bars]))
+        self.progress = progress
+        self.events = {bar: None for bar in self.bars}
+        self.commanded = {}
+        self.condition = threading.Condition()
+        self.subscriptions = []
+
+    def __enter__(self):
+        for bar in self.bars:
+            self.subscriptions.append(
+                subscriptions.subscribe('mcsus', f'B{bar:02d}STAT',
+                                        self._updater(bar)))
+        return self
+
+    def __exit__(self, *args):
+        for subscription in self.subscriptions:
+            subscription.cancel()
+        return False
+
+    def _updater(self, bar):
+        def update(kw):
+            self.update(bar, kw['ascii'])
+        return update
+
+    def command(self, bars):
+        '''Note that initialisation of the given bars is being commanded.'''
+        with self.condition:
+            for bar in bars:
+                self.commanded[bar] = time.monotonic()
+
+    def update(self, bar, status, quiet=False):
+        '''Handle a new status of a bar.  With quiet=True a bar which is OK
+        but was never seen to start is taken to have homed already.
+        '''
+        status = str(status).strip()
+        with self.condition:
+            previous = self.events.get(bar, None)
+            if bar not in self.commanded or previous in ['homed', 'failed']:
+                return
+            if 'ERROR' in status.upper():
+                event = 'failed'
+            elif status == 'OK':
+                event = 'homed' if previous == 'started' or quiet else None
+            else:
+                event = 'started' if previous is None else None
+            if event is None:
+                return
+            self.events[bar] = event
+            self.condition.notify_all()
+        log.debug(f'  Bar {bar:02d} {event} ({status})')
+        if self.progress is not None:
+            try:
+                self.progress(bar, event, status)
+            except Exception as e:
+                log.warning(f'Bar initialisation progress callback '
+                            f'failed: {e}')
+
+    def finished(self, bars):
+        with self.condition:
+            return all([self.events[bar] in ['homed', 'failed']
+                        for bar in bars])
+
+    def _check_quiet(self, bars):
+        '''Read the status of bars which have not been seen to start.'''
+        with self.condition:
+            now = time.monotonic()
+            quiet = [bar for bar in bars if self.events[bar] is None
+                     and now - self.commanded[bar] > init_start_timeout]
+        if len(quiet) > 0:
+            status = keywords.read_many('mcsus', 'B{:02d}STAT', quiet)
+            for bar, value in zip(quiet, status):
+                self.update(bar, value, quiet=True)
+
+    def wait(self, bars, timeout=None):
+        '''Block until every one of the bars has homed or failed.  Returns
+        False on timeout.
+        '''
+        endat = None if timeout is None else time.monotonic() + timeout
+        while not self.finished(bars):
+            step = 1
+            if endat is not None:
+                step = min(step, endat - time.monotonic())
+                if step <= 0:
+                    return False
+            with self.condition:
+                self.condition.wait(step)
+            self._check_quiet(bars)
+        return True
+
+
+@locks.locked('csu')
+@instrument_step()
+def initialise_bars(bars=None, wait=True, timeout=None, progress=None,
+                    skipprecond=False, skippostcond=False):
     '''Initialize one or more CSU bars.
     
     To initialize all bars, no arguments are needed (bars=None).  To initialize
     a single bar, set bars equal to the ID number of the bar (1-92).  To
     initialize a subset of bars, set bars equal to a list of bar ID numbers.
+
+    The bars are initialised together.  With wait=True they are followed
+    until each has homed or failed, and `progress` is called as
+    progress(bar, event, status) for each "started", "homed" or "failed"
+    event.  `timeout` defaults to a prediction from earlier initialisations.
+    Returns {bar: last event}.
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
+    if bars is None:
+        bars = list(bar_numbers)
+    elif np.ndim(bars) == 0:
+        bars = [bars]
+    else:
+        bars = list(bars)
     ##-------------------------------------------------------------------------
     ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
-        if bars is None:
-            return
-        if type(bars) == int:
-            bars = list(bars)
-        if type(bars) != list:
-            raise FailedCondition(f'Input {bars} not parsed')
+    if skipprecond is not True:
         for bar in bars:
-            if type(bar) != int:
+            if not isinstance(bar, (int, np.integer)):
                 raise FailedCondition(f'Bar {bar} is not integer')
             if bar < 1 or bar > 92:
                 raise FailedCondition(f'Bar {bar} is not in range 1-92')
-    
+
     ##-------------------------------------------------------------------------
     ## Script Contents
-    CSUINITBARkw = ktl.cache(keyword='INITBAR', service='mcsus')
-    if bars is None:
-        log.info('Initializing all bars')
-        CSUINITBARkw.write(0)
-    if type(bars) == int:
-        bars = list(bars)
-    for bar in bars:
-        log.info(f'Initializing bar {bar}')
-        CSUINITBARkw.write(bar)
+    with BarInitTracker(bars, progress=progress) as tracker:
+        started = time.monotonic()
+        bars = tracker.bars
+        tracker.command(bars)
+        if len(bars) == nbars:
+            log.info('Initializing all bars')
+            keywords.write('mcsus', 'INITBAR', 0)
+        else:
+            log.info(f'Initializing bars {", ".join(map(str, bars))}')
+            for bar in bars:
+                keywords.write('mcsus', 'INITBAR', bar, wait=False)
+        if wait is True:
+            if timeout is None:
+                timeout = movetimes.timeout('csu_init', len(bars),
+                                            default=180)
+            done = tracker.wait(bars, timeout=timeout)
+            homed = [event == 'homed' for event in tracker.events.values()]
+            if done is True and all(homed):
+                movetimes.record('csu_init', len(bars),
+                                 time.monotonic() - started)
+        results = dict(tracker.events)
 
     ##-------------------------------------------------------------------------
     ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
-        pass
-    
-    return None
+    if skippostcond is not True and wait is True:
+        failed = [bar for bar, event in results.items() if event != 'homed']
+        if len(failed) > 0:
+            raise FailedCondition(f'Failed to initialize bars '
+                                  f'{", ".join(map(str, failed))}')
+
+    return results
 
 
 ##-----------------------------------------------------------------------------
 ## Wait For CSU
 ##-----------------------------------------------------------------------------
-def waitfor_CSU(timeout=480, noshim=False, skipprecond=False, skippostcond=False):
+@locks.locked('csu', shared=True)
+@instrument_step(pre=[CSU_ok], post=[CSU_ok])
+def waitfor_CSU(timeout=None, noshim=False, skippostcond=False):
     '''Wait for a CSU move to be complete.
+
+    If a setup or move was commanded from this process, this waits for that
+    transition to finish (returning as soon as it does), otherwise it waits
+    for the CSU to be ready.  With timeout=None the timeout is predicted from
+    previous moves of the same size (480 s if there is no history).  The
+    noshim argument is no longer needed and is ignored.
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
-    ##-------------------------------------------------------------------------
-    ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
-        CSU_ok()
-    
     ##-------------------------------------------------------------------------
     ## Script Contents
-    csureadykw = ktl.cache(keyword='CSUREADY', service='mcsus')
-    csureadykw.monitor()
-    endat = dt.utcnow() + tdelta(seconds=timeout)
-    if noshim is False:
-        sleep(1)
-    while int(csureadykw) != 2 and dt.utcnow() < endat:
-        if int(csureadykw) == -1:
-            raise CSUFatalError()
-        sleep(2)
+    if timeout is None:
+        timeout = csu_machine.expected_timeout(480)
+    log.debug(f'Waiting up to {timeout:.0f} s for the CSU')
+    done = csu_machine.wait_for_cycle(['moving', 'configuring'],
+                                      ['ready', 'error'], timeout=timeout,
+                                      start_timeout=csu_start_timeout)
+    if csu_machine.state == 'error':
+        raise CSUFatalError()
 
     ##-------------------------------------------------------------------------
     ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
-        CSU_ok()
-        if int(csureadykw) != 2:
+    if skippostcond is not True:
+        if done is not True:
             raise FailedCondition('Timeout exceeded on waitfor_CSU')
-    
+
     return None
 
 
 ##-----------------------------------------------------------------------------
 ## get_current_mask
 ##-----------------------------------------------------------------------------
-def get_current_mask(skipprecond=False, skippostcond=False):
+@instrument_step(pre=[CSU_ok], post=[CSU_ok])
+def get_current_mask():
     '''Get the current state of the CSU from keywords and build a Mask object.
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
-    ##-------------------------------------------------------------------------
-    ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
-        CSU_ok()
-    
-    ##-------------------------------------------------------------------------
-    ## Script Contents
-    mcsus = ktl.cache(service='mcsus')
-
-    log.debug('Getting bar positions')
-    barpos = [float(mcsus[f"B{bar:02d}POS"].read()) for bar in range(1,93,1)]
-    log.debug('Getting bar target positions for comparison')
-    bartarg = [float(mcsus[f"B{bar:02d}TARG"].read()) for bar in range(1,93,1)]
+    log.debug('Getting bar positions and target positions')
+    state = CSUState.from_keywords()
     log.debug('Verifying differences are small')
-    deltas = [abs(pair[0]-pair[1]) < 0.01 for pair in zip(barpos, bartarg)]
-    assert np.all(deltas)
+    assert state.in_position(tolerance=0.01)
 
     log.debug('Building mask object from keyword data')
-    current_mask = Mask(None)
-    current_mask.name = str(mcsus['MASKNAME'].read())
-    slits_list = []
-    for slitno in range(1,47,1):
-        leftbar = slitno*2
-        leftmm = barpos[leftbar-1]
-        rightbar = slitno*2-1
-        rightmm = barpos[rightbar-1]
-        centermm = (leftmm + rightmm) / 2
-        slitcent = 189.62934431020133 - 1.3801254681363402 * centermm
-        width = (leftmm - rightmm)*0.7/0.507
-        slits_list.append( {'centerPositionArcsec': slitcent,
-                            'leftBarNumber': leftbar,
-                            'leftBarPositionMM': leftmm,
-                            'rightBarNumber': rightbar,
-                            'rightBarPositionMM': rightmm,
-                            'slitNumber': slitno,
-                            'slitWidthArcsec': width,
-                            'target': ''} )
-    current_mask.slitpos = Table(slits_list)
-
-    ##-------------------------------------------------------------------------
-    ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
-        CSU_ok()
+    current_mask = state.to_mask(name=str(keywords.read('mcsus', 'MASKNAME')))
 
     return current_mask
 
@@ -311,74 +432,131 @@ def get_current_mask(skipprecond=False, skippostcond=False):
 ##-----------------------------------------------------------------------------
 ## read_csu_bar_state
 ##-----------------------------------------------------------------------------
-def read_csu_bar_state(skipprecond=False, skippostcond=False):
-    '''docstring
+@instrument_step()
+def read_csu_bar_state(skipprecond=False):
+    '''Build a Mask object from the bar positions in the csu_bar_state file.
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
     ##-------------------------------------------------------------------------
     ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
+    if skipprecond is not True:
         if not csu_bar_state_file.exists():
             raise FailedCondition(f"Unable to locate csu_bar_state file: "
                                   f"{csu_bar_state_file}")
-    
-    ##-------------------------------------------------------------------------
-    ## Script Contents
-    mask = Mask(None)
-    mask.name = 'From csu_bar_state'
-    with open(csu_bar_state_file, 'r') as cbs:
-        lines = cbs.readlines()
-    t = Table(names=('slitNumber', 'leftBarNumber', 'rightBarNumber',
-                     'leftBarPositionMM', 'rightBarPositionMM',
-                     'centerPositionArcsec', 'slitWidthArcsec', 'target'),
-              dtype=('i4', 'i4', 'i4', 'f4', 'f4', 'f4', 'f4', 'a30'))
-    for line in lines:
-        barno, barpos, barstate = line.strip('\n').split(',')
-        slit = bar_to_slit(int(barno))
-        if int(barno) % 2 != 0:
-            dict = {'slitNumber': slit}
-            dict['leftBarNumber'] = -1
-            dict['leftBarPositionMM'] = float('nan')
-            dict['rightBarNumber'] = int(barno)
-            dict['rightBarPositionMM'] = float(barpos)
-            dict['centerPositionArcsec'] = float('nan')
-            dict['slitWidthArcsec'] = float('nan')
-            dict['target'] = ''
-            t.add_row(dict)
-        else:
-            t[slit-1]['leftBarNumber'] = int(barno)
-            t[slit-1]['leftBarPositionMM'] = float(barpos)
-    mask.slitpos = t
 
     ##-------------------------------------------------------------------------
-    ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
-        pass
+    ## Script Contents
+    mask = csu_bar_state().to_mask()
 
     return mask
 
 
-## ------------------------------------------------------------------
-##  Coordinate Transformation Utilities
-## ------------------------------------------------------------------
-def slit_to_bars(slit):
-    '''Given a slit number (1-46), return the two bar numbers associated
-    with that slit.
+def csu_bar_state(file=None):
+    '''Return the CSUState recorded in the csu_bar_state file (bar positions
+    and status only, no keywords are read).
     '''
-    return (slit*2-1, slit*2)
+    file = csu_bar_state_file if file is None else Path(file)
+    return CSUState.from_csu_bar_state(file.read_bytes())
 
 
-def bar_to_slit(bar):
-    '''Given a bar number, retun the slit associated with that bar.
+##-----------------------------------------------------------------------------
+## Follow csu_bar_state
+##-----------------------------------------------------------------------------
+class FileWatcher(object):
+    '''Wait for a file to change.  Uses inotify (via the optional
+    inotify_simple module) on the directory of the file, so that the file
+    being replaced is also noticed, and falls back to polling the size and
+    modification time of the file every `poll` seconds.
+    '''
+    def __init__(self, file, poll=0.5):
+        self.file = Path(file)
+        self.poll = poll
+        self.inotify = None
+        if inotify_simple is not None:
+            flags = inotify_simple.flags
+            try:
+                self.inotify = inotify_simple.INotify()
+                self.inotify.add_watch(str(self.file.parent),
+                                       flags.CLOSE_WRITE | flags.MODIFY
+                                       | flags.MOVED_TO | flags.CREATE)
+            except OSError as e:
+                log.debug(f'Unable to use inotify ({e}), polling instead')
+                self.close()
+        self.signature = self._signature()
+
+    def _signature(self):
+        try:
+            stat = self.file.stat()
+            return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            return None
+
+    def _changed(self, timeout):
+        if self.inotify is not None:
+            events = self.inotify.read(timeout=int(timeout*1000))
+            return len([e for e in events if e.name == self.file.name]) > 0
+        sleep(timeout)
+        signature = self._signature()
+        if signature != self.signature:
+            self.signature = signature
+            return True
+        return False
+
+    def wait(self, timeout=None, stop=None):
+        '''Block until the file may have changed.  Returns False if it has not
+        changed within `timeout` seconds or if the `stop` event is set.
+        '''
+        endat = None if timeout is None else time.monotonic() + timeout
+        while stop is None or not stop.is_set():
+            step = self.poll
+            if endat is not None:
+                step = min(step, endat - time.monotonic())
+                if step <= 0:
+                    return False
+            if self._changed(step):
+                return True
+        return False
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+
+
+def follow_csu_bar_state(file=None, poll=0.5, timeout=None, stop=None):
+    '''Generator which yields the CSUState from the csu_bar_state file now and
+    then again each time the file changes.  Ends if the file does not change
+    for `timeout` seconds or when the `stop` event (a threading.Event) is set.
+
+    for state in follow_csu_bar_state(timeout=600):
+        print(state.position)
     '''
-    return int((bar+1)/2)
+    file = csu_bar_state_file if file is None else Path(file)
+    watcher = FileWatcher(file, poll=poll)
+    last = None
+    try:
+        while stop is None or not stop.is_set():
+            try:
+                content = file.read_bytes()
+            except FileNotFoundError:
+                content = None
+            if content is not None and content != last:
+                try:
+                    state = CSUState.from_csu_bar_state(content)
+                except ValueError as e:
+                    ## Most likely caught the file part way through a write
+                    log.debug(f'Unable to parse {file}: {e}')
+                else:
+                    last = content
+                    yield state
+            if not watcher.wait(timeout=timeout, stop=stop):
+                return
+    finally:
+        watcher.close()
 
 
+## ------------------------------------------------------------------
+##  Coordinate Transformation Utilities
+## ------------------------------------------------------------------
 def pad(x):
     '''Pad array for affine transformation.
     '''
@@ -391,11 +569,50 @@ def unpad(x):
     return x[:,:-1]
 
 
+class CSUTransforms(object):
+    '''An immutable pair of affine transformations between pixel coordinates
+    (X, Y) and physical coordinates (mm, slit).  The matrices are read-only,
+    so one CSUTransforms object can be shared by any number of threads; to
+    change the transformations, make a new object and pass it to
+    set_transforms.
+    '''
+    __slots__ = ('Apixel_to_physical', 'Aphysical_to_pixel')
+
+    def __init__(self, Apixel_to_physical, Aphysical_to_pixel):
+        for name, A in [('Apixel_to_physical', Apixel_to_physical),
+                        ('Aphysical_to_pixel', Aphysical_to_pixel)]:
+            A = np.array(A, dtype=float)
+            A.setflags(write=False)
+            object.__setattr__(self, name, A)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('CSUTransforms are immutable')
+
+    def __iter__(self):
+        return iter((self.Apixel_to_physical, self.Aphysical_to_pixel))
+
+    @classmethod
+    def from_file(cls, file):
+        '''Load transforms from a YAML file written as
+        [Aphysical_to_pixel, Apixel_to_physical].
+        '''
+        with open(file, 'r') as FO:
+            Aphysical_to_pixel, Apixel_to_physical = yaml.safe_load(FO.read())
+        return cls(Apixel_to_physical, Aphysical_to_pixel)
+
+    def pixel_to_physical(self, x):
+        return unpad(np.dot(pad(np.array(x)), self.Apixel_to_physical))
+
+    def physical_to_pixel(self, x):
+        return unpad(np.dot(pad(np.array(x)), self.Aphysical_to_pixel))
+
+
 def fit_transforms(pixels, physical):
     '''Given a set of pixel coordinates (X, Y) and a set of physical
     coordinates (mm, slit), fit the affine transformations (forward and
-    backward) to convert between the two coordinate systems.
-    
+    backward) to convert between the two coordinate systems.  Returns a
+    CSUTransforms object, which may also be unpacked as
+    (Apixel_to_physical, Aphysical_to_pixel).
     '''
     pixels = np.array(pixels)
     physical = np.array(physical)
@@ -404,9 +621,6 @@ def fit_transforms(pixels, physical):
     assert pixels.shape[0] == physical.shape[0]
 
     # Pad the data with ones, so that our transformation can do translations too
-    n = pixels.shape[0]
-    pad = lambda x: np.hstack([x, np.ones((x.shape[0], 1))])
-    unpad = lambda x: x[:,:-1]
     X = pad(pixels)
     Y = pad(physical)
 
@@ -416,9 +630,24 @@ def fit_transforms(pixels, physical):
     Ainv, res, rank, s = np.linalg.lstsq(Y, X, rcond=None)
     A[np.abs(A) < 1e-10] = 0
     Ainv[np.abs(A) < 1e-10] = 0
-    Apixel_to_physical = A
-    Aphysical_to_pixel = Ainv
-    return Apixel_to_physical, Aphysical_to_pixel
+    return CSUTransforms(A, Ainv)
+
+
+## The transforms in use.  Replaced (never modified) by set_transforms, so a
+## reader always sees a consistent pair.
+transforms = CSUTransforms(Apixel_to_physical, Aphysical_to_pixel)
+
+
+def set_transforms(new_transforms):
+    '''Use the given CSUTransforms from now on.  The module level
+    Apixel_to_physical and Aphysical_to_pixel matrices follow.
+    '''
+    global transforms, Apixel_to_physical, Aphysical_to_pixel
+    if not isinstance(new_transforms, CSUTransforms):
+        new_transforms = CSUTransforms(*new_transforms)
+    transforms = new_transforms
+    Apixel_to_physical, Aphysical_to_pixel = transforms
+    core.Apixel_to_physical, core.Aphysical_to_pixel = transforms
 
 
 def pixel_to_physical(x):
@@ -426,9 +655,7 @@ def pixel_to_physical(x):
     convert a set of pixel coordinates (X, Y) to physical coordinates (mm,
     slit).
     '''
-    x = np.array(x)
-    result = unpad(np.dot(pad(x), Apixel_to_physical))
-    return result
+    return transforms.pixel_to_physical(x)
 
 
 def physical_to_pixel(x):
@@ -436,9 +663,7 @@ def physical_to_pixel(x):
     convert a set of physical coordinates (mm, slit) to pixel coordinates
     (X, Y).
     '''
-    x = np.array(x)
-    result = unpad(np.dot(pad(x), Aphysical_to_pixel))
-    return result
+    return transforms.physical_to_pixel(x)
 
 
 ## Set up initial transforms for pixel and physical space
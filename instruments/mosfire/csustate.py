@@ -0,0 +1,371 @@
+import numpy as np
+from astropy.table import Table
+
+from .core import *
+from .mask import Mask
+
+
+##-----------------------------------------------------------------------------
+## CSU Geometry
+##-----------------------------------------------------------------------------
+## The CSU has 92 bars forming 46 slits.  Slit n is formed by the odd
+## numbered bar 2n-1 on the right and the even numbered bar 2n on the left.
+nbars = 92
+nslits = 46
+bar_numbers = np.arange(1, nbars+1, 1)
+slit_numbers = np.arange(1, nslits+1, 1)
+arcsec_per_mm = 0.7/0.507
+
+
+def slit_to_bars(slit):
+    '''Given a slit number (1-46), return the two bar numbers associated
+    with that slit.  Also accepts an array of slit numbers.
+    '''
+    if np.ndim(slit) == 0:
+        return (int(slit)*2-1, int(slit)*2)
+    slit = np.asarray(slit, dtype=int)
+    return (slit*2-1, slit*2)
+
+
+def bar_to_slit(bar):
+    '''Given a bar number, retun the slit associated with that bar.  Also
+    accepts an array of bar numbers.
+    '''
+    if np.ndim(bar) == 0:
+        return int((bar+1)/2)
+    return (np.asarray(bar, dtype=int)+1)//2
+
+
+def slit_width_arcsec(left_mm, right_mm):
+    '''Slit width in arcsec from the left and right bar positions in mm.'''
+    return (np.asarray(left_mm) - np.asarray(right_mm)) * arcsec_per_mm
+
+
+def slit_center_arcsec(left_mm, right_mm):
+    '''Slit center in arcsec from the left and right bar positions in mm.'''
+    centermm = (np.asarray(left_mm) + np.asarray(right_mm)) / 2
+    return 189.62934431020133 - 1.3801254681363402 * centermm
+
+
+def parse_csu_bar_state(text):
+    '''Parse the text of the csu_bar_state file ("bar, position, status"
+    lines) in one pass over the whole buffer.  Returns arrays of bar numbers,
+    positions and status strings.  Raises ValueError if the text is
+    malformed.
+    '''
+    if isinstance(text, bytes):
+        text = text.decode()
+    text = text.strip()
+    if text == '':
+        return np.array([], dtype=int), np.array([]), np.array([], dtype='U1')
+    fields = text.replace('\r', '').replace('\n', ',').split(',')
+    if len(fields) % 3 != 0:
+        raise ValueError(f'csu_bar_state has {len(fields)} fields, '
+                         f'which is not 3 per line')
+    bars = np.array(fields[0::3], dtype=int)
+    positions = np.array(fields[1::3], dtype=float)
+    status = np.char.strip(np.array(fields[2::3]))
+    if np.any(bars < 1) or np.any(bars > nbars):
+        raise ValueError('csu_bar_state has a bar number out of range')
+    return bars, positions, status
+
+
+##-----------------------------------------------------------------------------
+## CSU State
+##-----------------------------------------------------------------------------
+bar_dtype = np.dtype([('bar', 'i4'),
+                      ('slit', 'i4'),
+                      ('side', 'U5'),
+                      ('position', 'f8'),
+                      ('target', 'f8'),
+                      ('status', 'U32'),
+                     ])
+
+
+class CSUState(object):
+    '''The state of the 92 CSU bars held in a single NumPy structured array
+    (`bars`, indexed by bar number - 1) with the fields: bar, slit, side
+    ('left' or 'right'), position and target (mm) and status.  Unknown
+    positions and targets are NaN.
+    '''
+    def __init__(self, position=None, target=None, status=None, name=None):
+        self.name = name
+        self.bars = np.zeros(nbars, dtype=bar_dtype)
+        self.bars['bar'] = bar_numbers
+        self.bars['slit'] = bar_to_slit(bar_numbers)
+        self.bars['side'] = np.where(bar_numbers % 2 == 0, 'left', 'right')
+        self.bars['position'] = np.nan if position is None else position
+        self.bars['target'] = np.nan if target is None else target
+        self.bars['status'] = '' if status is None else status
+
+    def __repr__(self):
+        known = np.isfinite(self.position)
+        return (f'<CSUState {self.name}: {np.sum(known)} bar positions, '
+                f'{np.sum(np.isfinite(self.target))} targets>')
+
+    def copy(self):
+        new = CSUState(name=self.name)
+        new.bars = self.bars.copy()
+        return new
+
+    @property
+    def position(self):
+        return self.bars['position']
+
+    @property
+    def target(self):
+        return self.bars['target']
+
+    @property
+    def status(self):
+        return self.bars['status']
+
+    def set(self, field, bars, values):
+        '''Set `field` of the given bar number(s) in one operation.'''
+        self.bars[field][np.asarray(bars, dtype=int)-1] = values
+
+    ##-------------------------------------------------------------------------
+    ## Per Slit Quantities
+    def left(self, field='position'):
+        '''Return `field` of the left (even) bar of each slit.'''
+        return self.bars[field][1::2]
+
+    def right(self, field='position'):
+        '''Return `field` of the right (odd) bar of each slit.'''
+        return self.bars[field][0::2]
+
+    def slit_width(self, field='position'):
+        '''Return the width of each slit in arcsec.'''
+        return slit_width_arcsec(self.left(field), self.right(field))
+
+    def slit_center(self, field='position'):
+        '''Return the center of each slit in arcsec.'''
+        return slit_center_arcsec(self.left(field), self.right(field))
+
+    ##-------------------------------------------------------------------------
+    ## Comparisons
+    def in_position(self, tolerance=0.01):
+        '''Return True if every bar with a target is within `tolerance` mm of
+        it.
+        '''
+        has_target = np.isfinite(self.target)
+        return bool(np.all(np.abs(self.position[has_target]
+                                  - self.target[has_target]) < tolerance))
+
+    def travel(self):
+        '''Return the largest distance (mm) between a bar and its target.'''
+        distance = np.abs(self.target - self.position)
+        distance = distance[np.isfinite(distance)]
+        return float(np.max(distance)) if len(distance) > 0 else 0.0
+
+    def differs(self, other, field='position', tolerance=0.01):
+        '''Return a boolean array flagging the bars for which `field` differs
+        by more than `tolerance` mm from `other` (a CSUState or an array of
+        92 values).
+        '''
+        theirs = other.bars[field] if isinstance(other, CSUState) else other
+        return ~(np.abs(self.bars[field] - np.asarray(theirs)) <= tolerance)
+
+    ##-------------------------------------------------------------------------
+    ## Conversions
+    @classmethod
+    def from_keywords(cls, status=False):
+        '''Read the bar positions and targets (and optionally status) in a
+        single bulk keyword read.
+        '''
+        kwnames = keywords.expand('B{:02d}POS', bar_numbers)\
+                  + keywords.expand('B{:02d}TARG', bar_numbers)
+        values = keywords.read_many('mcsus', kwnames, dtype=float)
+        state = cls(position=values[:nbars], target=values[nbars:])
+        if status is True:
+            state.bars['status'] = keywords.read_many('mcsus', 'B{:02d}STAT',
+                                                      bar_numbers)
+        return state
+
+    @classmethod
+    def from_mask(cls, mask):
+        '''Build a state whose targets are the bar positions of a Mask.  Bars
+        which are not used by the mask have no target.
+        '''
+        state = cls(name=mask.name)
+        slitpos = mask.slitpos
+        if slitpos is None or len(slitpos) == 0:
+            return state
+        for side in ['left', 'right']:
+            bars = np.asarray(slitpos[f'{side}BarNumber'], dtype=float)
+            mm = np.asarray(slitpos[f'{side}BarPositionMM'], dtype=float)
+            use = bars > 0
+            state.set('target', bars[use].astype(int), mm[use])
+        return state
+
+    @classmethod
+    def from_csu_bar_state(cls, text, name='From csu_bar_state'):
+        '''Build a state from the contents of the csu_bar_state file, which
+        has one "bar, position, status" line per bar.  Raises ValueError if
+        the text can not be parsed (e.g. a partially written file).
+        '''
+        bars, positions, status = parse_csu_bar_state(text)
+        state = cls(name=name)
+        state.set('position', bars, positions)
+        state.set('status', bars, status)
+        return state
+
+    def to_slitpos(self, field='position'):
+        '''Return the per slit table used as Mask.slitpos.'''
+        left = self.left(field)
+        right = self.right(field)
+        right_bars, left_bars = slit_to_bars(slit_numbers)
+        return Table({'centerPositionArcsec': slit_center_arcsec(left, right),
+                      'leftBarNumber': left_bars,
+                      'leftBarPositionMM': left,
+                      'rightBarNumber': right_bars,
+                      'rightBarPositionMM': right,
+                      'slitNumber': slit_numbers,
+                      'slitWidthArcsec': slit_width_arcsec(left, right),
+                      'target': np.full(nslits, ''),
+                      })
+
+    def to_mask(self, field='position', name=None):
+        '''Return a Mask with the bar positions (or targets) of this state.'''
+        mask = Mask(None)
+        mask.name = self.name if name is None else name
+        mask.slitpos = self.to_slitpos(field=field)
+        return mask
+
+
+##-----------------------------------------------------------------------------
+## Collision Checks
+##-----------------------------------------------------------------------------
+## Bar targets are checked locally before a mask is sent to the CSU, so that
+## a bad mask is rejected at once (with every offending row reported) rather
+## than after a setup round trip ending in "Setup aborted.  Collision
+## detected at row N".
+##   - every bar must stay within its travel (min_position to max_position)
+##   - the left (even) bar of a slit must be at least min_slit_width mm to
+##     the left of (i.e. greater than) the right (odd) bar
+##   - the left bar of a row may not pass the right bar of a neighbouring row
+##     by more than max_adjacent_overlap mm.  The default is the largest such
+##     overlap of the masks known to set up: RANDOM masks put slit centres
+##     anywhere from 54 to 219 mm, so neighbouring rows overlap by up to
+##     about 164 mm.  Set it to None to skip the check.
+min_position = 4.0
+max_position = 270.4
+min_slit_width = 0.0
+max_adjacent_overlap = 165.0
+## Allowance (mm) for rounding in mask files
+limit_tolerance = 0.001
+
+
+def as_targets(targets):
+    '''Return an array of 92 bar targets (NaN for unused bars) from a Mask, a
+    CSUState, a {bar: mm} dictionary or an array of 92 values.
+    '''
+    if isinstance(targets, Mask):
+        return CSUState.from_mask(targets).target
+    if isinstance(targets, CSUState):
+        return targets.target
+    if isinstance(targets, dict):
+        result = np.full(nbars, np.nan)
+        bars = np.array(list(targets.keys()), dtype=int)
+        result[bars-1] = np.array(list(targets.values()), dtype=float)
+        return result
+    result = np.asarray(targets, dtype=float)
+    if result.shape != (nbars,):
+        raise ValueError(f'Expected {nbars} bar targets, got {result.shape}')
+    return result
+
+
+def find_collisions(targets):
+    '''Check bar targets against the CSU geometric constraints.  Returns a
+    list of (row, problem) tuples ordered by row, empty if the targets are
+    safe.  Unused bars (NaN targets) are not checked.
+    '''
+    target = as_targets(targets)
+    left = target[1::2]
+    right = target[0::2]
+    problems = []
+    with np.errstate(invalid='ignore'):
+        low = target < min_position - limit_tolerance
+        high = target > max_position + limit_tolerance
+        crossed = left - right < min_slit_width - limit_tolerance
+    for bar in bar_numbers[low | high]:
+        problems.append((bar_to_slit(bar), f'B{bar:02d} target '
+                         f'{target[bar-1]:.3f} mm is outside the travel range '
+                         f'{min_position}-{max_position} mm'))
+    for slit in slit_numbers[crossed]:
+        problems.append((int(slit), f'slit width is '
+                         f'{left[slit-1]-right[slit-1]:.3f} mm (left bar '
+                         f'{left[slit-1]:.3f} mm, right bar '
+                         f'{right[slit-1]:.3f} mm), minimum is '
+                         f'{min_slit_width} mm'))
+    if max_adjacent_overlap is not None:
+        with np.errstate(invalid='ignore'):
+            ## row n left bar against row n+1 right bar and vice versa
+            above = right[1:] - left[:-1] > max_adjacent_overlap\
+                                            + limit_tolerance
+            below = right[:-1] - left[1:] > max_adjacent_overlap\
+                                            + limit_tolerance
+        for slit in slit_numbers[:-1][above]:
+            problems.append((int(slit), f'left bar overlaps the right bar '
+                             f'of row {slit+1} by '
+                             f'{right[slit]-left[slit-1]:.3f} mm'))
+        for slit in slit_numbers[:-1][below]:
+            problems.append((int(slit)+1, f'left bar overlaps the right bar '
+                             f'of row {slit} by '
+                             f'{right[slit-1]-left[slit]:.3f} mm'))
+    return sorted(problems, key=lambda p: p[0])
+
+
+def check_collisions(targets):
+    '''Raise FailedCondition listing every problem found by find_collisions.
+    '''
+    problems = find_collisions(targets)
+    if len(problems) > 0:
+        rows = sorted(set([row for row, problem in problems]))
+        msg = '; '.join([f'row {row}: {problem}' for row, problem in problems])
+        raise FailedCondition(f'Mask would collide at row(s) '
+                              f'{", ".join([str(r) for r in rows])}: {msg}')
+
+
+##-----------------------------------------------------------------------------
+## Mask Differences
+##-----------------------------------------------------------------------------
+## Bars within move_tolerance mm of their destination are not moved.
+move_tolerance = 0.01
+
+
+def as_state(current):
+    '''Return a CSUState for the current bar positions given as a CSUState
+    (e.g. from csu_bar_state), a Mask (e.g. from get_current_mask) or None
+    (read from the keywords).
+    '''
+    if current is None:
+        return CSUState.from_keywords()
+    if isinstance(current, Mask):
+        return CSUState(position=CSUState.from_mask(current).target,
+                        name=current.name)
+    return current
+
+
+def moving_bars(targets, positions, tolerance=None):
+    '''Return a boolean array flagging the bars which have a target which is
+    more than `tolerance` mm from their position (or whose position is not
+    known).
+    '''
+    tolerance = move_tolerance if tolerance is None else tolerance
+    targets = as_targets(targets)
+    with np.errstate(invalid='ignore'):
+        return np.isfinite(targets)\
+               & ~(np.abs(targets - np.asarray(positions)) <= tolerance)
+
+
+def mask_diff(mask, current=None, tolerance=None):
+    '''Compare a Mask (or bar targets) to the current CSU state and return
+    {bar: (current mm, target mm)} for only the bars which need to move.  An
+    empty result means the mask is already in place.
+    '''
+    state = as_state(current)
+    targets = as_targets(mask)
+    moving = moving_bars(targets, state.position, tolerance=tolerance)
+    return {int(bar): (float(state.position[bar-1]), float(targets[bar-1]))
+            for bar in bar_numbers[moving]}
@@ -12,32 +12,38 @@ except ModuleNotFoundError as e:
 from .core import *
 from .metadata import *
 from .fcs import *
+from .states import mds_machine, mds_start_timeout, lastfile_timeout
 
 
 ##-----------------------------------------------------------------------------
 ## pre- and post- conditions
 ##-----------------------------------------------------------------------------
-def waitfor_exposure(timeout=240, shim=False):
+@timing.timed
+def waitfor_exposure(timeout=None, shim=False):
     '''Block and wait for the current exposure to be complete.
-    '''
-    log.debug('Waiting for exposure to finish')
-    endat = dt.utcnow() + tdelta(seconds=timeout)
-    if shim is True:
-        sleep(1)
-    IMAGEDONEkw = ktl.cache(service='mds', keyword='IMAGEDONE')
-    IMAGEDONEkw.monitor()
-    READYkw = ktl.cache(service='mds', keyword='READY')
-    READYkw.monitor()
 
-    done_and_ready = bool(IMAGEDONEkw) and bool(READYkw)
-    while dt.utcnow() < endat and not done_and_ready:
-        sleep(1)
-        done_and_ready = bool(IMAGEDONEkw) and bool(READYkw)
-    if not done_and_ready:
+    If an exposure was started from this process, this waits for that
+    exposure cycle to finish and for LASTFILE to be updated, otherwise it
+    waits for the detector to be idle.  With timeout=None the timeout is
+    predicted from previous exposures (240 s if there is no history).  The
+    shim argument is no longer needed and is ignored.
+    '''
+    if timeout is None:
+        timeout = mds_machine.expected_timeout(240)
+    log.debug(f'Waiting up to {timeout:.0f} s for exposure to finish')
+    token = mds_machine.last_command
+    done = mds_machine.wait_for_cycle(['exposing'], ['idle'], timeout=timeout,
+                                      start_timeout=mds_start_timeout)
+    if not done:
         raise FailedCondition('Timeout exceeded on waitfor_exposure to finish')
+    if token is not None:
+        written = mds_machine.wait(lambda m: m.changed_since(token, 'LASTFILE'),
+                                   timeout=lastfile_timeout)
+        if not written:
+            log.warning('LASTFILE was not updated by the last exposure')
 
 
-def wfgo(timeout=240, shim=False):
+def wfgo(timeout=None, shim=False):
     '''Alias waitfor_exposure to wfgo
     '''
     waitfor_exposure(timeout=timeout, shim=shim)
@@ -46,160 +52,85 @@ def wfgo(timeout=240, shim=False):
 ##-----------------------------------------------------------------------------
 ## exptime
 ##-----------------------------------------------------------------------------
-def exptime(skipprecond=False, skippostcond=False):
+@instrument_step()
+def exptime():
     '''Returns the exposure time per coadd in seconds.
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
-    ##-------------------------------------------------------------------------
-    ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
-        pass
-    
-    ##-------------------------------------------------------------------------
-    ## Script Contents
-    ITIMEkw = ktl.cache(service='mds', keyword='ITIME')
-    ITIME = float(ITIMEkw.read())/1000
+    ITIME = float(keywords.read('mds', 'ITIME'))/1000
 
-    ##-------------------------------------------------------------------------
-    ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
-        pass
-    
     return ITIME
 
 
 ##-----------------------------------------------------------------------------
 ## set exptime
 ##-----------------------------------------------------------------------------
-def set_exptime(input, skipprecond=False, skippostcond=False):
+@locks.locked('detector')
+@instrument_step()
+def set_exptime(input, skippostcond=False):
     '''Set exposure time per coadd in seconds.  Note the ITIME keyword uses ms.
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
-    ##-------------------------------------------------------------------------
-    ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
-        pass
-    
     ##-------------------------------------------------------------------------
     ## Script Contents
-    ITIMEkw = ktl.cache(service='mds', keyword='ITIME')
     new_exptime = float(input)*1000
     log.debug(f'Setting exposure time to {new_exptime:.1f} ms')
-    ITIMEkw.write(new_exptime)
-    
+    keywords.write('mds', 'ITIME', new_exptime)
+
     ##-------------------------------------------------------------------------
     ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
-        ITIME = float(ITIMEkw.read())/1000
+    if skippostcond is not True:
+        ITIME = float(keywords.read('mds', 'ITIME'))/1000
         log.debug(f'Exposure time is now {ITIME:.1f} sec')
-    
+
     return None
 
 
 ##-----------------------------------------------------------------------------
 ## coadds
 ##-----------------------------------------------------------------------------
-def coadds(skipprecond=False, skippostcond=False):
+@instrument_step()
+def coadds():
     '''Return the number of coadds
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
-    ##-------------------------------------------------------------------------
-    ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
-        pass
-    
-    ##-------------------------------------------------------------------------
-    ## Script Contents
-    COADDSkw = ktl.cache(service='mds', keyword='COADDS')
-    COADDS = int(COADDSkw.read())
+    COADDS = int(keywords.read('mds', 'COADDS'))
 
-    ##-------------------------------------------------------------------------
-    ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
-        pass
-    
     return COADDS
 
 
 ##-----------------------------------------------------------------------------
 ## set OUTDIR
 ##-----------------------------------------------------------------------------
-def set_coadds(input, skipprecond=False, skippostcond=False):
+@locks.locked('detector')
+@instrument_step()
+def set_coadds(input, skippostcond=False):
     '''Set coadds
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
-    ##-------------------------------------------------------------------------
-    ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
-        pass
-    
     ##-------------------------------------------------------------------------
     ## Script Contents
-    COADDSkw = ktl.cache(service='mds', keyword='COADDS')
     log.debug(f'Setting coadds to {int(input)}')
-    COADDSkw.write(int(input))
-    
+    keywords.write('mds', 'COADDS', int(input))
+
     ##-------------------------------------------------------------------------
     ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
-        nCOADDS = COADDSkw.read()
+    if skippostcond is not True:
+        nCOADDS = int(keywords.read('mds', 'COADDS'))
         log.debug(f'Number of coadds is now {nCOADDS}')
         if nCOADDS != int(input):
             raise FailedCondition('Failed to set COADDS')
-    
+
     return None
 
 
 ##-----------------------------------------------------------------------------
 ## sampmode & numreads
 ##-----------------------------------------------------------------------------
-def sampmode(skipprecond=False, skippostcond=False):
+@instrument_step()
+def sampmode():
     '''Return the sampling mode as a string (e.g. CDS, MCDS16, etc.)
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
-
-    ##-------------------------------------------------------------------------
-    ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
-        pass
-    
-    ##-------------------------------------------------------------------------
-    ## Script Contents
-    SAMPMODEkw = ktl.cache(service='mds', keyword='SAMPMODE')
-    NUMREADSkw = ktl.cache(service='mds', keyword='NUMREADS')
-    output = {2: 'CDS', 3: 'MCDS'}.get(int(SAMPMODEkw.read()), 'UNKNOWN')
+    SAMPMODE = int(keywords.read('mds', 'SAMPMODE'))
+    output = {2: 'CDS', 3: 'MCDS'}.get(SAMPMODE, 'UNKNOWN')
     if output == 'MCDS':
-        output += NUMREADSkw.read()
-    
-    ##-------------------------------------------------------------------------
-    ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
-        pass
+        output += keywords.read('mds', 'NUMREADS')
 
     return output
 
@@ -207,36 +138,25 @@ def sampmode(skipprecond=False, skippostcond=False):
 ##-----------------------------------------------------------------------------
 ## set sampmode & numreads
 ##-----------------------------------------------------------------------------
-def set_sampmode(input, skipprecond=False, skippostcond=False):
+@locks.locked('detector')
+@instrument_step()
+def set_sampmode(input, skippostcond=False):
     '''Set the sampling mode from a string (e.g. CDS, MCDS16, etc.)
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
-
-    ##-------------------------------------------------------------------------
-    ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
-        namematch = re.match('(M?CDS)(\d*)', input.strip())
-        if namematch is None:
-            raise FailedCondition(f'Unable to parse "{input}"')
-        mode = {'CDS': 2, 'MCDS': 3}.get(namematch.group(1))
-    
     ##-------------------------------------------------------------------------
     ## Script Contents
-    SAMPMODEkw = ktl.cache(service='mds', keyword='SAMPMODE')
-    NUMREADSkw = ktl.cache(service='mds', keyword='NUMREADS')
-    SAMPMODEkw.write(mode)
+    namematch = re.match('(M?CDS)(\d*)', input.strip())
+    if namematch is None:
+        raise FailedCondition(f'Unable to parse "{input}"')
+    mode = {'CDS': 2, 'MCDS': 3}.get(namematch.group(1))
+    keywords.write('mds', 'SAMPMODE', mode)
     if mode == 3:
         nreads = int(namematch.group(2))
-        NUMREADSkw.write(nreads)
-    
+        keywords.write('mds', 'NUMREADS', nreads)
+
     ##-------------------------------------------------------------------------
     ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
+    if skippostcond is not True:
         result = sampmode()
         if input != result:
             raise FailedCondition(f'Failed to set SAMPMODE and NUMREADS. "{input}" != "{result}"')
@@ -247,6 +167,8 @@ def set_sampmode(input, skipprecond=False, skippostcond=False):
 ##-----------------------------------------------------------------------------
 ## take exposure
 ##-----------------------------------------------------------------------------
+@locks.locked('detector')
+@instrument_step()
 def take_exposure(exptime=None, coadds=None, sampmode=None, wait=True,
                   waitforFCS=True, updateFCS=True,
                   skipprecond=False, skippostcond=False):
@@ -255,16 +177,11 @@ def take_exposure(exptime=None, coadds=None, sampmode=None, wait=True,
     If the exptime, coadds, sampmode inputs are specified, those parameters for
     the exposure will be set prior to triggering the exposure.
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
-
     ##-------------------------------------------------------------------------
     ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
+    if skipprecond is not True:
         waitfor_exposure()
-    
+
     ##-------------------------------------------------------------------------
     ## Script Contents
     if exptime is not None:
@@ -279,17 +196,24 @@ def take_exposure(exptime=None, coadds=None, sampmode=None, wait=True,
     if waitforFCS is True:
         waitfor_FCS()
     
-    GOkw = ktl.cache(service='mds', keyword='GO')
     log.info('Taking exposure')
-    GOkw.write(True)
+    values = keywords.read_batch([('mds', 'ITIME'), ('mds', 'COADDS'),
+                                  ('mds', 'SAMPMODE'), ('mds', 'NUMREADS')])
+    integration = float(values[('mds', 'ITIME')])/1000\
+                  * int(values[('mds', 'COADDS')])
+    ## Readout time depends on the sampling mode, so each mode has its own
+    ## model in the move time database (e.g. mds_exposure_MCDS16)
+    mode = {2: 'CDS', 3: 'MCDS'}.get(int(values[('mds', 'SAMPMODE')]),
+                                     'UNKNOWN')
+    if mode == 'MCDS':
+        mode += values[('mds', 'NUMREADS')]
+    mds_machine.command(f'mds_exposure_{mode}', size=integration)
+    keywords.write('mds', 'GO', True)
 
     ##-------------------------------------------------------------------------
     ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
+    if skippostcond is not True:
         if wait is True:
-            sleep(2)
             waitfor_exposure()
         imagefile = lastfile()
         if imagefile.exists():
@@ -303,6 +227,7 @@ def take_exposure(exptime=None, coadds=None, sampmode=None, wait=True,
 ##-------------------------------------------------------------------------
 ## MOSFIRE Exposure Control Functions
 ##-------------------------------------------------------------------------
+@timing.timed
 def goi(exptime=None, coadds=None, sampmode=None, wait=True,
         waitforFCS=True, updateFCS=True,
         skipprecond=False, skippostcond=False):
@@ -14,117 +14,75 @@ from .core import *
 ##-----------------------------------------------------------------------------
 ## pre- and post- conditions
 ##-----------------------------------------------------------------------------
-def FCS_ok():
-    activekw = ktl.cache(keyword='ACTIVE', service='mfcs')
-    active = bool(activekw.read())
-    if active is not True:
+def FCS_ok(snapshot=None):
+    if snapshot is None:
+        snapshot = health_snapshot(mechs=False, csu=False)
+    if snapshot.fcs_active is not True:
         raise FailedCondition(f'FCS is not active')
-    enabledkw = ktl.cache(keyword='ENABLE', service='mfcs')
-    enabled = bool(enabledkw.read())
-    if enabled is not True:
+    if snapshot.fcs_enabled is not True:
         raise FailedCondition(f'FCS is not enabled')
 
 
 ##-------------------------------------------------------------------------
 ## FCS_in_position
 ##-------------------------------------------------------------------------
-def FCS_in_position(PAthreshold=0.5, ELthreshold=0.5,
-                   skipprecond=False, skippostcond=False):
+@instrument_step(pre=[FCS_ok], post=[FCS_ok])
+def FCS_in_position(PAthreshold=0.5, ELthreshold=0.5):
     '''Check whether the current FCS position is correcting for the current
     rotator angle and telescope elevation values from dcs.
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
-    ##-------------------------------------------------------------------------
-    ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
-        FCS_ok()
-    
-    ##-------------------------------------------------------------------------
-    ## Script Contents
-    FCPA_ELkw = ktl.cache(keyword='PA_EL', service='mfcs')
-    FCPA_EL = FCPA_ELkw.read()
+    FCPA_EL = keywords.read('mfcs', 'PA_EL')
     FCSPA = float(FCPA_EL.split()[0])
     FCSEL = float(FCPA_EL.split()[1])
     
-    ROTPPOSNkw = ktl.cache(keyword='ROTPPOSN', service='dcs')
-    ROTPPOSN = float(ROTPPOSNkw.read())
-    ELkw = ktl.cache(keyword='EL', service='dcs')
-    EL = float(ELkw.read())
+    ROTPPOSN = float(keywords.read('dcs', 'ROTPPOSN'))
+    EL = float(keywords.read('dcs', 'EL'))
     done = np.isclose(FCSPA, ROTPPOSN, atol=PAthreshold)\
            and np.isclose(FCSEL, EL, atol=ELthreshold)
 
-    ##-------------------------------------------------------------------------
-    ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
-        FCS_ok()
-
     return done
 
 
 ##-------------------------------------------------------------------------
 ## FCS_up_to_date
 ##-------------------------------------------------------------------------
-def update_FCS(skipprecond=False, skippostcond=False):
+@locks.locked('fcs')
+@instrument_step(pre=[FCS_ok], post=[FCS_ok])
+def update_FCS():
     '''Check whether the current FCS position is correcting for the current
     rotator angle and telescope elevation values from dcs.
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
-    ##-------------------------------------------------------------------------
-    ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
-        FCS_ok()
-    
-    ##-------------------------------------------------------------------------
-    ## Script Contents
-    ROTPPOSNkw = ktl.cache(keyword='ROTPPOSN', service='dcs')
-    ROTPPOSN = float(ROTPPOSNkw.read())
-    ELkw = ktl.cache(keyword='EL', service='dcs')
-    EL = float(ELkw.read())
+    ROTPPOSN = float(keywords.read('dcs', 'ROTPPOSN'))
+    EL = float(keywords.read('dcs', 'EL'))
 
-    FCPA_ELkw = ktl.cache(keyword='PA_EL', service='mfcs')
-    FCPA_ELkw.write(f"{ROTPPOSN:.2f} {EL:.2f}")
+    keywords.write('mfcs', 'PA_EL', f"{ROTPPOSN:.2f} {EL:.2f}")
 
     done = FCS_in_position()
 
-    ##-------------------------------------------------------------------------
-    ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
-        FCS_ok()
-    
     return done
 
 
-
-
-
-
-
-
-
-
-
-
-# def waitfor_FCS(timeout=60, PAthreshold=0.5, ELthreshold=0.5, noshim=False):
-#     '''Wait for FCS to get close to actual PA and EL.
-#     '''
-#     log.info('Waiting for FCS to reach destination')
-#     if noshim is False:
-#         sleep(1)
-#     done = check_FCS(PAthreshold=PAthreshold, ELthreshold=ELthreshold)
-#     endat = dt.utcnow() + tdelta(seconds=timeout)
-#     while done is False and dt.utcnow() < endat:
-#         sleep(1)
-#         done = check_FCS(PAthreshold=PAthreshold, ELthreshold=ELthreshold)
-#     if done is False:
-#         log.warning(f'Timeout exceeded on waitfor_FCS to finish')
-#     return done
+##-------------------------------------------------------------------------
+## waitfor_FCS
+##-------------------------------------------------------------------------
+@instrument_step(pre=[FCS_ok], post=[FCS_ok])
+def waitfor_FCS(timeout=60, PAthreshold=0.5, ELthreshold=0.5):
+    '''Wait for FCS to get close to actual PA and EL.  Wakes on updates to
+    the FCS and telescope keywords rather than polling.  Returns False (and
+    logs a warning) if the FCS is not in position within `timeout` seconds.
+    '''
+    log.info('Waiting for FCS to reach destination')
+    def in_position():
+        FCSPA, FCSEL = [float(x) for x in
+                        keywords.read('mfcs', 'PA_EL').split()[:2]]
+        ROTPPOSN = float(keywords.read('dcs', 'ROTPPOSN'))
+        EL = float(keywords.read('dcs', 'EL'))
+        return bool(np.isclose(FCSPA, ROTPPOSN, atol=PAthreshold)
+                    and np.isclose(FCSEL, EL, atol=ELthreshold))
+    done = waits.wait_for(in_position,
+                          [('mfcs', 'PA_EL'), ('dcs', 'ROTPPOSN'),
+                           ('dcs', 'EL')],
+                          timeout=timeout)
+    if done is False:
+        log.warning(f'Timeout exceeded on waitfor_FCS to finish')
+    return done
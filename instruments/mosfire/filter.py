@@ -2,6 +2,7 @@ import inspect
 from datetime import datetime as dt
 from datetime import timedelta as tdelta
 from time import sleep
+import time
 
 try:
     import ktl
@@ -14,25 +15,25 @@ from .core import *
 ##-----------------------------------------------------------------------------
 ## pre- and post- conditions
 ##-----------------------------------------------------------------------------
-def filter1_ok():
+def filter1_ok(snapshot=None):
     '''Commonly used pre- and post- condition to check whether there are errors
     in the filter wheel status.
     '''
     # Check filter wheel 1 status
-    mmf1s_status = ktl.cache(service='mmf1s', keyword='STATUS')
-    filter1_status = mmf1s_status.read()
+    filter1_status = keywords.read('mmf1s', 'STATUS') if snapshot is None\
+                     else snapshot.status('filter1')
     log.debug(f'Filter1 status is "{filter1_status}"')
     if filter1_status not in ['OK', 'Moving']:
         raise FailedCondition(f'Filter 1 status is not OK: "{filter1_status}"')
 
 
-def filter2_ok():
+def filter2_ok(snapshot=None):
     '''Commonly used pre- and post- condition to check whether there are errors
     in the filter wheel status.
     '''
     # Check filter wheel 2 status
-    mmf2s_status = ktl.cache(service='mmf2s', keyword='STATUS')
-    filter2_status = mmf2s_status.read()
+    filter2_status = keywords.read('mmf2s', 'STATUS') if snapshot is None\
+                     else snapshot.status('filter2')
     log.debug(f'Filter2 status is "{filter2_status}"')
     if filter2_status not in ['OK', 'Moving']:
         raise FailedCondition(f'Filter 2 status is not OK: "{filter2_status}"')
@@ -41,189 +42,88 @@ def filter2_ok():
 ##-----------------------------------------------------------------------------
 ## get filter
 ##-----------------------------------------------------------------------------
-def filter(skipprecond=False, skippostcond=False):
+@instrument_step(pre=[filter1_ok, filter2_ok], post=[filter1_ok, filter2_ok])
+def filter():
     '''Query for the current filter.
     
     This returns a single value which is the result of the pair of filter wheels
     in the instrument.  If you want to know the position of one filter wheel in
     particular, see filter1 and filter2 below
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
-    ##-------------------------------------------------------------------------
-    ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
-        filter1_ok()
-        filter2_ok()
-    
-    ##-------------------------------------------------------------------------
-    ## Script Contents
-    filterkw = ktl.cache(service='mosfire', keyword='FILTER')
-    filterkw.monitor()
+    filter_str = keywords.cached_read('mosfire', 'FILTER')
 
-    ##-------------------------------------------------------------------------
-    ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
-        filter1_ok()
-        filter2_ok()
-
-    return str(filterkw)
+    return filter_str
 
 
 ##-----------------------------------------------------------------------------
 ## isdark
 ##-----------------------------------------------------------------------------
-def isdark(skipprecond=False, skippostcond=False):
+@instrument_step(pre=[filter1_ok, filter2_ok], post=[filter1_ok, filter2_ok])
+def isdark():
     '''Return True if the current observing mode is dark
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
-    ##-------------------------------------------------------------------------
-    ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
-        filter1_ok()
-        filter2_ok()
-    
-    ##-------------------------------------------------------------------------
-    ## Script Contents
-    filterkw = ktl.cache(service='mosfire', keyword='FILTER')
-    filterkw.monitor()
-
-    ##-------------------------------------------------------------------------
-    ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
-        filter1_ok()
-        filter2_ok()
+    filter_str = keywords.cached_read('mosfire', 'FILTER')
 
-    return (str(filterkw) == 'Dark')
+    return (filter_str == 'Dark')
 
 
 ##-----------------------------------------------------------------------------
 ## waitfordark
 ##-----------------------------------------------------------------------------
-def waitfordark(timeout=60, skipprecond=False, skippostcond=False):
-    '''Wait for the instrument to be in a dark state.
+@instrument_step(pre=[filter1_ok, filter2_ok], post=[filter1_ok, filter2_ok])
+def waitfordark(timeout=None):
+    '''Wait for the instrument to be in a dark state.  With timeout=None the
+    timeout is predicted from previous filter wheel moves (60 s if there is no
+    history).
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
-    ##-------------------------------------------------------------------------
-    ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
-        filter1_ok()
-        filter2_ok()
-    
-    ##-------------------------------------------------------------------------
-    ## Script Contents
-    endat = dt.utcnow() + tdelta(seconds=timeout)
-    filterkw = ktl.cache(service='mosfire', keyword='FILTER')
-    filterkw.monitor()
-
-    while dt.utcnow() < endat and str(filterkw) != 'Dark':
-        sleep(1)
-    if str(filterkw) != 'Dark':
+    if timeout is None:
+        timeout = movetimes.timeout('filter_wheel', default=60)
+    dark = waits.wait_until('mosfire', 'FILTER',
+                            lambda filterkw: str(filterkw) == 'Dark',
+                            timeout=timeout)
+    if dark is not True:
         raise TimeoutError('Timed out waiting for instrument to be dark')
 
-    ##-------------------------------------------------------------------------
-    ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
-        filter1_ok()
-        filter2_ok()
-
     return None
 
 
 ##-----------------------------------------------------------------------------
 ## filter1
 ##-----------------------------------------------------------------------------
-def filter1(skipprecond=False, skippostcond=False):
+@instrument_step(pre=[filter1_ok], post=[filter1_ok])
+def filter1():
     '''Query for the filter in filter wheel 1.
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
-    ##-------------------------------------------------------------------------
-    ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
-        filter1_ok()
-    
-    ##-------------------------------------------------------------------------
-    ## Script Contents
-    filter1kw = ktl.cache(service='mmf1s', keyword='POSNAME')
-    filter1kw.monitor()
+    filter1_str = keywords.cached_read('mmf1s', 'POSNAME')
 
-    ##-------------------------------------------------------------------------
-    ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
-        filter1_ok()
-    
-    return str(filter1kw)
+    return filter1_str
 
 
 ##-----------------------------------------------------------------------------
 ## filter2
 ##-----------------------------------------------------------------------------
-def filter2(skipprecond=False, skippostcond=False):
+@instrument_step(pre=[filter2_ok], post=[filter2_ok])
+def filter2():
     '''Query for the filter in filter wheel 1.
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
-    ##-------------------------------------------------------------------------
-    ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
-        filter2_ok()
-    
-    ##-------------------------------------------------------------------------
-    ## Script Contents
-    filter2kw = ktl.cache(service='mmf2s', keyword='POSNAME')
-    filter2kw.monitor()
+    filter2_str = keywords.cached_read('mmf2s', 'POSNAME')
 
-    ##-------------------------------------------------------------------------
-    ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
-        filter2_ok()
-    
-    return str(filter2kw)
+    return filter2_str
 
 
 ##-----------------------------------------------------------------------------
 ## quick_dark
 ##-----------------------------------------------------------------------------
-def quick_dark(wait=False, timeout=30,
-               skipprecond=False, skippostcond=False):
+@locks.locked('filter_wheels')
+@instrument_step(pre=[filter1_ok, filter2_ok], post=[filter1_ok, filter2_ok])
+def quick_dark(wait=False, timeout=None,
+               skippostcond=False):
     '''Set the instrument to a dark mode which is close to the specified filter.
     Modeled after darkeff script.
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
-    ##-------------------------------------------------------------------------
-    ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
-        filter1_ok()
-        filter2_ok()
-    
     ##-------------------------------------------------------------------------
     ## Script Contents
+    started = None
     if isdark():
         log.info('Instrument is dark')
     else:
@@ -240,23 +140,20 @@ def quick_dark(wait=False, timeout=30,
                         None: ['NB1061', 'Ks'],
                         }
         f1dest, f2dest = filter_combo.get(filter())
+        started = time.monotonic()
         if filter1() != f1dest:
-            f1targkw = ktl.cache(service='mmf1s', keyword='TARGNAME')
-            f1targkw.write(f1dest)
+            keywords.write('mmf1s', 'TARGNAME', f1dest)
 
         if filter2() != f2dest:
-            f2targkw = ktl.cache(service='mmf2s', keyword='TARGNAME')
-            f2targkw.write(f2dest)
+            keywords.write('mmf2s', 'TARGNAME', f2dest)
 
     ##-------------------------------------------------------------------------
     ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
+    if skippostcond is not True:
         if wait is True:
             waitfordark(timeout=timeout)
-        filter1_ok()
-        filter2_ok()
+            if started is not None:
+                movetimes.record('filter_wheel', 0, time.monotonic() - started)
 
     return None
 
@@ -264,7 +161,8 @@ def quick_dark(wait=False, timeout=30,
 ##-----------------------------------------------------------------------------
 ## go_dark
 ##-----------------------------------------------------------------------------
-def go_dark(wait=False, timeout=30,
+@timing.timed
+def go_dark(wait=False, timeout=None,
              skipprecond=False, skippostcond=False):
     '''Alias for quick_dark
     '''
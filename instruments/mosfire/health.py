@@ -0,0 +1,39 @@
+from .core import *
+from .csu import CSU_ok, CSUbars_ok
+from .fcs import FCS_ok
+from .filter import filter1_ok, filter2_ok
+from .obsmode import grating_shim_ok, grating_turret_ok
+
+
+##-----------------------------------------------------------------------------
+## check_mechanisms
+##-----------------------------------------------------------------------------
+def check_mechanisms(snapshot=None):
+    '''Check all mechanisms against a single health snapshot (one is taken if
+    none is given).  Every check is run and all failures are reported in a
+    single FailedCondition.  Returns the snapshot used.
+    '''
+    log.info('Checking mechanisms')
+    if snapshot is None:
+        snapshot = health_snapshot()
+    checks = {'filter1': filter1_ok,
+              'filter2': filter2_ok,
+              'FCS': FCS_ok,
+              'grating_shim': grating_shim_ok,
+              'grating_turret': grating_turret_ok,
+              'pupil_rotator': pupil_rotator_ok,
+              'trapdoor': trapdoor_ok,
+              'CSU': CSU_ok,
+              'CSU bars': CSUbars_ok,
+             }
+    failures = []
+    for mech, statusfn in checks.items():
+        try:
+            statusfn(snapshot=snapshot)
+        except FailedCondition as e:
+            failures.append(f'{mech}: {e.message}')
+        except CSUFatalError:
+            failures.append(f'{mech}: CSU fatal error')
+    if len(failures) > 0:
+        raise FailedCondition('; '.join(failures))
+    return snapshot
@@ -15,46 +15,25 @@ from .core import *
 ##-----------------------------------------------------------------------------
 ## OUTDIR
 ##-----------------------------------------------------------------------------
-def outdir(skipprecond=False, skippostcond=False):
+@instrument_step()
+def outdir():
     '''Return outdir as a pathlib.Path object
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
-    ##-------------------------------------------------------------------------
-    ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
-        pass
-    
-    ##-------------------------------------------------------------------------
-    ## Script Contents
-    OUTDIRkw = ktl.cache(service='mds', keyword='OUTDIR')
-    OUTDIRp = Path(OUTDIRkw.read())
+    OUTDIRp = Path(keywords.cached_read('mds', 'OUTDIR'))
 
-    ##-------------------------------------------------------------------------
-    ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
-        pass
-    
     return OUTDIRp
 
 
 ##-----------------------------------------------------------------------------
 ## set OUTDIR
 ##-----------------------------------------------------------------------------
+@instrument_step()
 def set_outdir(input, skipprecond=False, skippostcond=False):
     '''Set outdir
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
     ##-------------------------------------------------------------------------
     ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
+    if skipprecond is not True:
         p = Path(input)
         if not p.parent.exists():
             trypath = Path('/s')
@@ -65,169 +44,89 @@ def set_outdir(input, skipprecond=False, skippostcond=False):
 
     ##-------------------------------------------------------------------------
     ## Script Contents
-    OUTDIRkw = ktl.cache(service='mds', keyword='OUTDIR')
-    OUTDIRkw.write(input)
-    
+    keywords.write_if_changed('mds', 'OUTDIR', input)
+
     ##-------------------------------------------------------------------------
     ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
-        if OUTDIRkw.read() != input:
+    if skippostcond is not True:
+        if keywords.cached_read('mds', 'OUTDIR') != input:
             raise FailedCondition(f'Failed to set outdir to "{input}"')
-    
+
     return None
 
 
 ##-----------------------------------------------------------------------------
 ## object
 ##-----------------------------------------------------------------------------
-def object(skipprecond=False, skippostcond=False):
+@instrument_step()
+def object():
     '''Return object as a string
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
-    ##-------------------------------------------------------------------------
-    ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
-        pass
-    
-    ##-------------------------------------------------------------------------
-    ## Script Contents
-    objectkw = ktl.cache(service='mds', keyword='OBJECT')
-    object_str = objectkw.read()
+    object_str = keywords.cached_read('mds', 'OBJECT')
 
-    ##-------------------------------------------------------------------------
-    ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
-        pass
-    
     return object_str
 
 
 ##-----------------------------------------------------------------------------
 ## set object
 ##-----------------------------------------------------------------------------
-def set_object(input, skipprecond=False, skippostcond=False):
+@instrument_step()
+def set_object(input, skippostcond=False):
     '''Set the object keyword header value
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
-    ##-------------------------------------------------------------------------
-    ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
-        pass
-    
     ##-------------------------------------------------------------------------
     ## Script Contents
-    objectkw = ktl.cache(service='mds', keyword='OBJECT')
-    objectkw.write(input)
-    
+    keywords.write_if_changed('mds', 'OBJECT', input)
+
     ##-------------------------------------------------------------------------
     ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
-        if objectkw.read() != input:
+    if skippostcond is not True:
+        if keywords.cached_read('mds', 'OBJECT') != input:
             raise FailedCondition(f'Failed to set object to "{input}"')
-    
+
     return None
 
 
 ##-----------------------------------------------------------------------------
 ## observer
 ##-----------------------------------------------------------------------------
-def observer(skipprecond=False, skippostcond=False):
+@instrument_step()
+def observer():
     '''Return observer as a string
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
-    ##-------------------------------------------------------------------------
-    ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
-        pass
-    
-    ##-------------------------------------------------------------------------
-    ## Script Contents
-    observerkw = ktl.cache(service='mosfire', keyword='OBSERVER')
-    observer_str = observerkw.read()
+    observer_str = keywords.cached_read('mosfire', 'OBSERVER')
 
-    ##-------------------------------------------------------------------------
-    ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
-        pass
-    
     return observer_str
 
 
 ##-----------------------------------------------------------------------------
 ## set observer
 ##-----------------------------------------------------------------------------
-def set_observer(input, skipprecond=False, skippostcond=False):
+@instrument_step()
+def set_observer(input, skippostcond=False):
     '''Set the object keyword header value
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
-    ##-------------------------------------------------------------------------
-    ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
-        pass
-    
     ##-------------------------------------------------------------------------
     ## Script Contents
-    observerkw = ktl.cache(service='mosfire', keyword='OBSERVER')
-    observerkw.write(input)
-    
+    keywords.write_if_changed('mosfire', 'OBSERVER', input)
+
     ##-------------------------------------------------------------------------
     ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
-        if observerkw.read() != input:
+    if skippostcond is not True:
+        if keywords.cached_read('mosfire', 'OBSERVER') != input:
             raise FailedCondition(f'Failed to set observer to "{input}"')
-    
+
     return None
 
 
 ##-----------------------------------------------------------------------------
 ## filename
 ##-----------------------------------------------------------------------------
-def filename(skipprecond=False, skippostcond=False):
+@instrument_step()
+def filename():
     '''Return the current filename value as a `pathlib.Path` object.
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
-
-    ##-------------------------------------------------------------------------
-    ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
-        pass
-    
-    ##-------------------------------------------------------------------------
-    ## Script Contents
-    filenamekw = ktl.cache(service='mds', keyword='FILENAME')
-    filename_path = Path(filenamekw.read())
-    
-    ##-------------------------------------------------------------------------
-    ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
-        pass
+    filename_path = Path(keywords.read('mds', 'FILENAME'))
 
     return filename_path
 
@@ -235,32 +134,20 @@ def filename(skipprecond=False, skippostcond=False):
 ##-----------------------------------------------------------------------------
 ## lastfile
 ##-----------------------------------------------------------------------------
-def lastfile(skipprecond=False, skippostcond=False):
+@instrument_step()
+def lastfile(skippostcond=False):
     '''Return the last filename value as a `pathlib.Path` object.
     
     This also checks that the file exists.  If it does not, it checks a
     similar path with /s prepended.  This handles the vm-mosfire machine case.
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
-
-    ##-------------------------------------------------------------------------
-    ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
-        pass
-    
     ##-------------------------------------------------------------------------
     ## Script Contents
-    lastfilekw = ktl.cache(service='mds', keyword='LASTFILE')
-    lastfile_path = Path(lastfilekw.read())
-    
+    lastfile_path = Path(keywords.read('mds', 'LASTFILE'))
+
     ##-------------------------------------------------------------------------
     ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
+    if skippostcond is not True:
         if lastfile_path.exists():
             log.debug(f'Found file at {lastfile_path}')
         else:
@@ -2,6 +2,7 @@ import inspect
 from datetime import datetime as dt
 from datetime import timedelta as tdelta
 from time import sleep
+import time
 
 try:
     import ktl
@@ -14,22 +15,22 @@ from .core import *
 ##-----------------------------------------------------------------------------
 ## pre- and post- conditions
 ##-----------------------------------------------------------------------------
-def grating_shim_ok():
+def grating_shim_ok(snapshot=None):
     '''Commonly used pre- and post- condition to check whether there are errors
     in the grating shim status.
     '''
-    mmgss_statuskw = ktl.cache(service='mmgss', keyword='STATUS')
-    shim_status = mmgss_statuskw.read()
+    shim_status = keywords.read('mmgss', 'STATUS') if snapshot is None\
+                  else snapshot.status('grating_shim')
     if shim_status not in ['OK', 'Moving']:
         raise FailedCondition(f'Grating shim status is: "{shim_status}"')
 
 
-def grating_turret_ok():
+def grating_turret_ok(snapshot=None):
     '''Commonly used pre- and post- condition to check whether there are errors
     in the grating turret status.
     '''
-    mmgts_statuskw = ktl.cache(service='mmgts', keyword='STATUS')
-    turret_status = mmgts_statuskw.read()
+    turret_status = keywords.read('mmgts', 'STATUS') if snapshot is None\
+                    else snapshot.status('grating_turret')
     if turret_status not in ['OK', 'Moving']:
         raise FailedCondition(f'Grating turret status is: "{turret_status}"')
 
@@ -37,31 +38,12 @@ def grating_turret_ok():
 ##-----------------------------------------------------------------------------
 ## get obsmode
 ##-----------------------------------------------------------------------------
-def obsmode(skipprecond=False, skippostcond=False):
+@instrument_step(pre=[grating_shim_ok, grating_turret_ok],
+                 post=[grating_shim_ok, grating_turret_ok])
+def obsmode():
     '''Return the current observing mode.
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
-    ##-------------------------------------------------------------------------
-    ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
-        grating_shim_ok()
-        grating_turret_ok()
-    
-    ##-------------------------------------------------------------------------
-    ## Script Contents
-    obsmodekw = ktl.cache(service='mosfire', keyword='OBSMODE')
-    obsmode_string = obsmodekw.read()
-
-    ##-------------------------------------------------------------------------
-    ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
-        grating_shim_ok()
-        grating_turret_ok()
+    obsmode_string = keywords.cached_read('mosfire', 'OBSMODE')
 
     return obsmode_string
 
@@ -69,47 +51,44 @@ def obsmode(skipprecond=False, skippostcond=False):
 ##-----------------------------------------------------------------------------
 ## set obsmode
 ##-----------------------------------------------------------------------------
-def set_obsmode(destination, wait=True, timeout=60,
+@locks.locked('filter_wheels', 'grating_turret')
+@instrument_step(pre=[grating_shim_ok, grating_turret_ok],
+                 post=[grating_shim_ok, grating_turret_ok])
+def set_obsmode(destination, wait=True, timeout=None,
                 skipprecond=False, skippostcond=False):
-    '''Set the observing mode
+    '''Set the observing mode.  With timeout=None the timeout is predicted
+    from previous mode changes (60 s if there is no history).
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
     ##-------------------------------------------------------------------------
     ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
-        filter, mode = destination.split('-')
+    if skipprecond is not True:
+        filtername, mode = destination.split('-')
         # Check valid destination
         if not mode in modes:
-            raise FailedPreCondition(f"Mode: {mode} is unknown")
-        if not filter in filters and filter != 'dark':
-            raise FailedCondition(f"Filter: {filter} is unknown")
-        grating_shim_ok()
-        grating_turret_ok()
-    
+            raise FailedCondition(f"Mode: {mode} is unknown")
+        if not filtername in filters and filtername != 'dark':
+            raise FailedCondition(f"Filter: {filtername} is unknown")
+
     ##-------------------------------------------------------------------------
     ## Script Contents
-    setobsmodekw = ktl.cache(service='mosfire', keyword='SETOBSMODE')
     log.info(f"Setting mode to {destination}")
-    setobsmodekw.write(destination, wait=True)
-    
+    changing = keywords.cached_read('mosfire', 'OBSMODE').lower()\
+               != destination.lower()
+    started = time.monotonic()
+    keywords.write('mosfire', 'SETOBSMODE', destination, wait=True)
+
     ##-------------------------------------------------------------------------
     ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
+    if skippostcond is not True:
         if wait is True:
-            endat = dt.utcnow() + tdelta(seconds=timeout)
-            obsmodekw = ktl.cache(service='mosfire', keyword='OBSMODE')
-            done = (obsmodekw.read().lower() == destination.lower())
-            while not done and dt.utcnow() < endat:
-                sleep(1)
-                done = (obsmodekw.read().lower() == destination.lower())
+            if timeout is None:
+                timeout = movetimes.timeout('obsmode', default=60)
+            done = waits.wait_until('mosfire', 'OBSMODE',
+                    lambda kw: str(kw).lower() == destination.lower(),
+                    timeout=timeout)
             if not done:
                 raise FailedCondition(f'Timeout exceeded on waiting for mode {destination}')
-        grating_shim_ok()
-        grating_turret_ok()
+            if changing is True:
+                movetimes.record('obsmode', 0, time.monotonic() - started)
 
-    return None
\ No newline at end of file
+    return None
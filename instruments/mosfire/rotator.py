@@ -2,6 +2,7 @@ import inspect
 from datetime import datetime as dt
 from datetime import timedelta as tdelta
 from time import sleep
+import time
 
 try:
     import ktl
@@ -14,33 +15,14 @@ from .core import *
 ##-----------------------------------------------------------------------------
 ## Rotator Control
 ##-----------------------------------------------------------------------------
-def rotpposn(skipprecond=False, skippostcond=False):
+@instrument_step(pre=[instrument_is_MOSFIRE])
+def rotpposn():
     '''Return ROTPPOSN in degrees.
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
-
-    ##-------------------------------------------------------------------------
-    ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
-        instrument_is_MOSFIRE()
-
-    ##-------------------------------------------------------------------------
-    ## Script Contents
-    ROTMODEkw = ktl.cache(service='dcs', keyword='ROTMODE')
-    log.info(f'Rotator mode is {ROTMODEkw.read()}')
-    ROTPPOSNkw = ktl.cache(service='dcs', keyword='ROTPPOSN')
-    ROTPPOSN = float(ROTPPOSNkw.read())
+    ROTMODE = keywords.read('dcs', 'ROTMODE')
+    log.info(f'Rotator mode is {ROTMODE}')
+    ROTPPOSN = float(keywords.read('dcs', 'ROTPPOSN'))
     log.info(f'Drive angle (ROTPPOSN) = {ROTPPOSN:.1f} deg')
-    
-    ##-------------------------------------------------------------------------
-    ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
-        pass
 
     return ROTPPOSN
 
@@ -51,58 +33,52 @@ def drive_angle(skipprecond=False, skippostcond=False):
     return rotpposn(skipprecond=skipprecond, skippostcond=skippostcond)
 
 
-def _set_rotpposn(rotpposn, skipprecond=False, skippostcond=False):
+## set_rotpposn retries once on keyword errors, it does not retry timeouts
+rotator_retry = retry.RetryPolicy(attempts=2, initial=2, jitter=0.25)
+
+
+@instrument_step(pre=[instrument_is_MOSFIRE])
+def _set_rotpposn(rotpposn, skippostcond=False):
     '''Set the rotator position in stationary mode.
     
     This only tries to set the position once, use `set_rotpposn` in practice
     as it makes multiple attempts which seems to be more reliable.
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
-
-    ##-------------------------------------------------------------------------
-    ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
-        instrument_is_MOSFIRE()
-    
     ##-------------------------------------------------------------------------
     ## Script Contents
-
     log.info(f'Setting ROTPPOSN to {rotpposn:.1f}')
-    ROTDESTkw = ktl.cache(service='dcs', keyword='ROTDEST')
-    ROTDESTkw.write(float(rotpposn))
+    travel = abs(float(keywords.read('dcs', 'ROTPPOSN')) - float(rotpposn))
+    started = time.monotonic()
+    keywords.write('dcs', 'ROTDEST', float(rotpposn))
     sleep(1)
-    ROTMODEkw = ktl.cache(service='dcs', keyword='ROTMODE')
-    ROTMODEkw.write('stationary')
+    keywords.write('dcs', 'ROTMODE', 'stationary')
     sleep(1)
-    
+
     ##-------------------------------------------------------------------------
     ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
+    if skippostcond is not True:
         log.info(f'Waiting for rotator to be "in position"')
-        ROTSTATkw = ktl.cache(service='dcs', keyword='ROTSTAT')
-        ROTSTATkw.monitor()
-        while str(ROTSTATkw) != 'in position':
+        def in_position(ROTSTATkw):
             log.debug(f'ROTSTAT = "{ROTSTATkw}"')
-            sleep(2)
+            return str(ROTSTATkw) == 'in position'
+        ## Without history allow 1 deg/s plus a minute to settle
+        timeout = movetimes.timeout('rotator', travel, default=60 + travel)
+        if not waits.wait_until('dcs', 'ROTSTAT', in_position, timeout=timeout):
+            raise FailedCondition(f'Rotator not in position after {timeout:.0f} s')
+        movetimes.record('rotator', travel, time.monotonic() - started)
 
     return None
 
 
+@locks.locked('rotator')
 def set_rotpposn(rotpposn):
-    '''Set the rotator position in stationary mode.  Performs a single retry if
-    a ktlError is raised.
+    '''Set the rotator position in stationary mode.  Performs a single retry
+    (after about 2 s) if a keyword error is raised.
     '''
-    try:
-        _set_rotpposn(rotpposn)
-    except ktlExceptions.ktlError as e:
+    def warn(e, attempt):
         log.warning(f"Failed to set rotator")
         log.warning(e)
-        sleep(2)
         log.info('Trying again ...')
-        _set_rotpposn(rotpposn)
-
+    rotator_retry.call(_set_rotpposn, rotpposn, on_retry=warn,
+                       label='rotator',
+                       give_up=(FailedCondition, keywords.ServiceUnavailable))
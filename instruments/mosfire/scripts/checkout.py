@@ -12,6 +12,7 @@ from ..obsmode import *
 from ..metadata import *
 from ..detector import *
 from ..csu import *
+from ..configure import *
 
 description = '''Perform a basic checkout of the MOSFIRE instrument.  The normal
 execution of this script performs a standard pre-run checkout.  The quick
@@ -118,9 +119,7 @@ def checkout(quick=False):
         return False
 
     log.info('Taking dark image')
-    set_exptime(2)
-    set_coadds(1)
-    set_sampmode('CDS')
+    apply(MOSFIREConfig(exptime=2, coadds=1, sampmode='CDS'))
     sleep(5)
     take_exposure()
     waitfor_exposure()
@@ -133,25 +132,15 @@ def checkout(quick=False):
 
     # Quick checkout
     if quick is True:
-        log.info('Setup 2.7x46 long slit mask')
-        setup_mask(Mask('2.7x46'))
-        waitfor_CSU()
-        log.info('Execute mask')
-        execute_mask()
-        waitfor_CSU()
-        set_obsmode('K-imaging', wait=True)
+        log.info('Configure 2.7x46 long slit mask in K-imaging')
+        configure(mask=Mask('2.7x46'), obsmode='K-imaging')
         take_exposure()
         waitfor_exposure()
         wideSlitFile = lastfile()
         go_dark()
 
-        log.info('Setup 0.7x46 long slit mask')
-        setup_mask(Mask('0.7x46'))
-        waitfor_CSU()
-        log.info('Execute mask')
-        execute_mask()
-        waitfor_CSU()
-        set_obsmode('K-imaging', wait=True)
+        log.info('Configure 0.7x46 long slit mask in K-imaging')
+        configure(mask=Mask('0.7x46'), obsmode='K-imaging')
         take_exposure()
         waitfor_exposure()
         wideSlitFile = lastfile()
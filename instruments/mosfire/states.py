@@ -0,0 +1,60 @@
+from instruments.states import KeywordStateMachine
+
+from .core import *
+
+
+##-----------------------------------------------------------------------------
+## CSU State Machine
+##-----------------------------------------------------------------------------
+## The CSU reports its state in CSUREADY.  A mask setup goes
+##     ready (2) -> configuring (4) -> ready (2)
+## and a move goes
+##     ready (2) -> moving (3) -> ready (2) or error (-1)
+## CSUREADY can take a moment to leave the ready state after SETUPGO is
+## written, so a wait measured from the command only finishes once the busy
+## state has been seen.  If no busy state is seen within csu_start_timeout
+## seconds the command is assumed to have completed without one.
+csu_start_timeout = 10
+csu_state_names = {0: 'unknown',
+                   1: 'started',
+                   2: 'ready',
+                   3: 'moving',
+                   4: 'configuring',
+                   -1: 'error',
+                   -2: 'stopped'}
+
+
+def _csu_state(values):
+    try:
+        return csu_state_names.get(int(values['CSUREADY']), 'unknown')
+    except (KeyError, ValueError):
+        return 'unknown'
+
+
+csu_machine = KeywordStateMachine('CSU', [('mcsus', 'CSUREADY'),
+                                          ('mcsus', 'CSUSTAT')], _csu_state)
+
+
+##-----------------------------------------------------------------------------
+## MDS Exposure State Machine
+##-----------------------------------------------------------------------------
+## An exposure goes
+##     idle -> exposing (GO true or READY/IMAGEDONE false) -> idle
+## with LASTFILE updated to the new image as it is written.
+mds_start_timeout = 5
+lastfile_timeout = 10
+
+
+def _mds_state(values):
+    go = keywords.same_value(values.get('GO', 'false'), True)
+    ready = keywords.same_value(values.get('READY', 'true'), True)
+    imagedone = keywords.same_value(values.get('IMAGEDONE', 'true'), True)
+    if go or not ready or not imagedone:
+        return 'exposing'
+    return 'idle'
+
+
+mds_machine = KeywordStateMachine('MDS', [('mds', 'GO'),
+                                          ('mds', 'READY'),
+                                          ('mds', 'IMAGEDONE'),
+                                          ('mds', 'LASTFILE')], _mds_state)
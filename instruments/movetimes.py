@@ -0,0 +1,195 @@
+import os
+import sqlite3
+import threading
+import time
+import warnings
+from pathlib import Path
+import numpy as np
+
+
+##-------------------------------------------------------------------------
+## Mechanism Move Time Database
+##-------------------------------------------------------------------------
+## Every timed move is stored in a small SQLite database as (mechanism,
+## size, duration), where size is whatever the duration scales with for that
+## mechanism (mm of bar travel for the CSU, degrees for the rotator, seconds
+## of integration for an exposure, encoder counts for the HIRES gratings, 0
+## when there is no natural measure).  The MOSFIRE filter wheel and obsmode
+## moves are deliberately recorded with size 0: they drive several
+## mechanisms whose individual travel is not known when the move starts, so
+## their models are a single typical (median) duration.  The predictor fits
+##     duration = intercept + slope * size
+## to the most recent successful moves of a mechanism.  Until a mechanism
+## has min_samples moves on record, callers fall back to their fixed
+## defaults.  Anything else the duration depends on (for example the readout
+## mode of an exposure) is made part of the mechanism name.
+##
+## The database location may be set with the KECK_MOVETIMES environment
+## variable.
+database = Path(os.environ.get('KECK_MOVETIMES',
+                               '~/.keck_movetimes.sqlite')).expanduser()
+enabled = True
+min_samples = 5
+history = 200
+## Timeouts are the larger of margin times the prediction or the prediction
+## plus nsigma times the scatter of the fit, and never less than the
+## prediction plus minimum_slack seconds.  The caller's fixed default is only
+## used while there is no model.
+margin = 1.5
+nsigma = 5
+minimum_slack = 5
+_lock = threading.Lock()
+_models = {}
+_listeners = []
+
+
+def _connect():
+    connection = sqlite3.connect(str(database), timeout=5)
+    connection.execute('CREATE TABLE IF NOT EXISTS moves '
+                       '(mechanism TEXT, size REAL, duration REAL, '
+                       'time REAL, success INTEGER)')
+    connection.execute('CREATE INDEX IF NOT EXISTS moves_mechanism '
+                       'ON moves (mechanism, time)')
+    return connection
+
+
+def _disable(e):
+    global enabled
+    enabled = False
+    warnings.warn(f'Move time database {database} disabled: {e}')
+
+
+def use_database(path):
+    '''Use the database at `path` from now on.'''
+    global database, enabled
+    with _lock:
+        database = Path(path).expanduser()
+        enabled = True
+        _models.clear()
+
+
+def add_listener(listener):
+    '''Register a function to be called as listener(mechanism, size,
+    duration, success) for every move recorded (whether or not the database
+    is enabled).
+    '''
+    with _lock:
+        if listener not in _listeners:
+            _listeners.append(listener)
+
+
+def remove_listener(listener):
+    '''Unregister a function added with add_listener.'''
+    with _lock:
+        if listener in _listeners:
+            _listeners.remove(listener)
+
+
+def record(mechanism, size, duration, success=True):
+    '''Store the duration (in seconds) of one move.'''
+    for listener in list(_listeners):
+        try:
+            listener(mechanism, size, duration, success)
+        except Exception:
+            pass
+    if enabled is not True:
+        return
+    with _lock:
+        try:
+            with _connect() as connection:
+                connection.execute('INSERT INTO moves VALUES (?, ?, ?, ?, ?)',
+                                   (mechanism, float(size), float(duration),
+                                    time.time(), int(bool(success))))
+            connection.close()
+        except sqlite3.Error as e:
+            _disable(e)
+        _models.pop(mechanism, None)
+
+
+def samples(mechanism, n=None):
+    '''Return the sizes and durations of the most recent `n` (default
+    `history`) successful moves of a mechanism as two numpy arrays.
+    '''
+    n = history if n is None else n
+    if enabled is not True:
+        return np.array([]), np.array([])
+    with _lock:
+        try:
+            connection = _connect()
+            rows = connection.execute('SELECT size, duration FROM moves '
+                                      'WHERE mechanism = ? AND success = 1 '
+                                      'ORDER BY time DESC LIMIT ?',
+                                      (mechanism, n)).fetchall()
+            connection.close()
+        except sqlite3.Error as e:
+            _disable(e)
+            rows = []
+    rows = np.array(rows, dtype=float).reshape(-1, 2)
+    return rows[:,0], rows[:,1]
+
+
+def model(mechanism):
+    '''Return (intercept, slope, scatter, n) of the duration model for a
+    mechanism, or None if there are fewer than min_samples moves on record.
+    '''
+    with _lock:
+        if mechanism in _models:
+            return _models[mechanism]
+    sizes, durations = samples(mechanism)
+    if len(durations) < min_samples:
+        return None
+    if len(np.unique(sizes)) > 1:
+        slope, intercept = np.polyfit(sizes, durations, 1)
+        slope = max(slope, 0)
+    else:
+        slope, intercept = 0, np.median(durations)
+    residuals = durations - (intercept + slope * sizes)
+    result = (intercept, slope, np.std(residuals), len(durations))
+    with _lock:
+        _models[mechanism] = result
+    return result
+
+
+def predict(mechanism, size=0, default=None):
+    '''Return the expected duration in seconds of a move of the given size
+    (an ETA), or `default` if the mechanism has too little history.
+    '''
+    fit = model(mechanism)
+    if fit is None:
+        return default
+    intercept, slope, scatter, n = fit
+    return max(intercept + slope * size, 0)
+
+
+def timeout(mechanism, size=0, default=None):
+    '''Return a timeout in seconds for a move of the given size, or
+    `default` if the mechanism has too little history.
+    '''
+    fit = model(mechanism)
+    if fit is None:
+        return default
+    intercept, slope, scatter, n = fit
+    expected = max(intercept + slope * size, 0)
+    return max(expected * margin, expected + nsigma * scatter,
+               expected + minimum_slack)
+
+
+class timed(object):
+    '''Context manager which records the duration of the enclosed move.  The
+    move is recorded as a failure if an exception is raised.
+
+    with movetimes.timed('hires_xdraw', abs(delta)):
+        set('hires', 'XDRAW', dest, wait=True)
+    '''
+    def __init__(self, mechanism, size=0):
+        self.mechanism = mechanism
+        self.size = size
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        record(self.mechanism, self.size, time.monotonic() - self.start,
+               success=exc_type is None)
+        return False
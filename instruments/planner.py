@@ -0,0 +1,266 @@
+import contextvars
+import dataclasses
+import time
+from concurrent.futures import wait, FIRST_COMPLETED
+
+from instruments import aio
+
+
+##-------------------------------------------------------------------------
+## Dependency Aware Move Planner
+##-------------------------------------------------------------------------
+## A Plan is a set of named steps (blocking instrument control functions)
+## and the dependencies between them.  Steps which do not depend on each
+## other are run at the same time on the control thread pool, so that a
+## configuration change takes about as long as its slowest chain of
+## dependent moves rather than the sum of all of them.
+##
+##     plan = Plan('MOSFIRE configuration')
+##     plan.add('dark', go_dark, wait=True)
+##     plan.add('setup_mask', setup_mask, mask)
+##     plan.add('execute_mask', execute_mask, after=['dark', 'setup_mask'])
+##     plan.add('rotator', set_rotpposn, 30)
+##     plan.add('FCS', update_FCS, after=['rotator'])
+##     report = plan.run()
+##
+## Steps run in a copy of the caller's context (so their timing and keyword
+## reads are attributed to the caller), but on other threads: resource locks
+## held by the caller (see instruments.locks) are not shared with its steps,
+## so a step takes the locks it needs itself.
+##
+## If a step fails, the steps which depend on it are skipped, steps which
+## are already running (or independent of the failure) are allowed to finish,
+## and a PlanError carrying the completion report is raised at the end.
+class PlanError(Exception):
+    def __init__(self, report):
+        self.report = report
+        failed = ', '.join([f'{step.name} ({step.error})'
+                            for step in report.failed])
+        super().__init__(f'{report.name} failed: {failed}')
+
+
+class Step(object):
+    '''One step of a Plan.'''
+    def __init__(self, name, function, args=(), kwargs=None, after=None):
+        self.name = name
+        self.function = function
+        self.args = args
+        self.kwargs = {} if kwargs is None else kwargs
+        self.after = [] if after is None else list(after)
+        self.status = 'pending'
+        self.result = None
+        self.error = None
+        self.start = None
+        self.end = None
+
+    @property
+    def duration(self):
+        if self.start is None or self.end is None:
+            return None
+        return self.end - self.start
+
+    def __call__(self):
+        self.start = time.monotonic()
+        try:
+            self.result = self.function(*self.args, **self.kwargs)
+            self.status = 'done'
+        except Exception as e:
+            self.error = e
+            self.status = 'failed'
+        finally:
+            self.end = time.monotonic()
+        return self
+
+
+class PlanReport(object):
+    '''Completion report for one run of a Plan.'''
+    def __init__(self, name, steps, start, end):
+        self.name = name
+        self.steps = steps
+        self.start = start
+        self.end = end
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    @property
+    def ok(self):
+        return all([step.status == 'done' for step in self.steps])
+
+    @property
+    def failed(self):
+        return [step for step in self.steps if step.status == 'failed']
+
+    @property
+    def skipped(self):
+        return [step for step in self.steps if step.status == 'skipped']
+
+    @property
+    def serial_duration(self):
+        '''Time the same steps would have taken run one after another.'''
+        return sum([step.duration for step in self.steps
+                    if step.duration is not None])
+
+    def results(self):
+        '''Return a dictionary of {step name: return value}.'''
+        return {step.name: step.result for step in self.steps}
+
+    def __str__(self):
+        lines = [f'{self.name}: {"ok" if self.ok else "FAILED"} in '
+                 f'{self.duration:.1f} s ({self.serial_duration:.1f} s if '
+                 f'run in sequence)']
+        for step in sorted(self.steps,
+                           key=lambda s: float('inf') if s.start is None
+                                         else s.start):
+            if step.start is None:
+                lines.append(f'  {step.name:20s} {step.status}')
+                continue
+            began = step.start - self.start
+            line = (f'  {step.name:20s} {step.status:7s} '
+                    f'{began:7.1f} -> {began+step.duration:7.1f} s')
+            if step.error is not None:
+                line += f'  {type(step.error).__name__}: {step.error}'
+            lines.append(line)
+        return '\n'.join(lines)
+
+
+class Plan(object):
+    '''A set of steps and the dependencies between them.'''
+    def __init__(self, name='plan'):
+        self.name = name
+        self.steps = {}
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __contains__(self, name):
+        return name in self.steps
+
+    def add(self, name, function, *args, after=None, **kwargs):
+        '''Add a step which calls function(*args, **kwargs) once all of the
+        steps named in `after` have completed.  Dependencies on steps which
+        are not in the plan are ignored, so that optional steps can be left
+        out without rewriting the rest of the plan.  Returns the step name.
+        '''
+        if name in self.steps:
+            raise ValueError(f'Step {name} is already in {self.name}')
+        self.steps[name] = Step(name, function, args=args, kwargs=kwargs,
+                                after=after)
+        return name
+
+    def dependencies(self, name):
+        '''Return the names of the steps (in this plan) which `name` waits
+        for.
+        '''
+        return [dep for dep in self.steps[name].after if dep in self.steps]
+
+    def order(self):
+        '''Return the step names grouped in to stages: every step depends
+        only on steps in earlier stages.  Raises ValueError on a dependency
+        cycle.
+        '''
+        remaining = {name: set(self.dependencies(name))
+                     for name in self.steps.keys()}
+        stages = []
+        while len(remaining) > 0:
+            ready = [name for name, deps in remaining.items()
+                     if len(deps) == 0]
+            if len(ready) == 0:
+                raise ValueError(f'Dependency cycle in {self.name} among: '
+                                 f'{", ".join(remaining.keys())}')
+            stages.append(ready)
+            for name in ready:
+                remaining.pop(name)
+            for deps in remaining.values():
+                deps.difference_update(ready)
+        return stages
+
+    def run(self, log=None, raise_on_error=True):
+        '''Execute the plan with as many steps in flight at once as the
+        dependencies allow.  Returns a PlanReport, or raises PlanError if any
+        step failed and raise_on_error is True.
+        '''
+        self.order()
+        for step in self.steps.values():
+            step.status = 'pending'
+            step.result = step.error = step.start = step.end = None
+        pending = {name: set(self.dependencies(name))
+                   for name in self.steps.keys()}
+        running = {}
+        executor = aio.get_executor()
+        start = time.monotonic()
+        while len(pending) > 0 or len(running) > 0:
+            ## Skip anything which depends on a failure
+            for name in list(pending.keys()):
+                if any([self.steps[dep].status in ['failed', 'skipped']
+                        for dep in pending[name]]):
+                    self.steps[name].status = 'skipped'
+                    pending.pop(name)
+                    if log is not None:
+                        log.warning(f'  Skipping {name}')
+            ## Start everything which is ready
+            for name in [name for name, deps in pending.items()
+                         if all([self.steps[dep].status == 'done'
+                                 for dep in deps])]:
+                pending.pop(name)
+                if log is not None:
+                    log.debug(f'  Starting {name}')
+                self.steps[name].status = 'running'
+                context = contextvars.copy_context()
+                running[executor.submit(context.run, self.steps[name])] = name
+            if len(running) == 0:
+                continue
+            finished, unfinished = wait(list(running.keys()),
+                                        return_when=FIRST_COMPLETED)
+            for future in finished:
+                step = self.steps[running.pop(future)]
+                if log is not None:
+                    if step.status == 'done':
+                        log.debug(f'  {step.name} done in {step.duration:.1f} s')
+                    else:
+                        log.error(f'  {step.name} failed: {step.error}')
+        report = PlanReport(self.name, list(self.steps.values()),
+                            start, time.monotonic())
+        if log is not None:
+            level = 'info' if report.ok else 'error'
+            for line in str(report).split('\n'):
+                getattr(log, level)(line)
+        if raise_on_error is True and report.ok is False:
+            raise PlanError(report)
+        return report
+
+
+##-------------------------------------------------------------------------
+## Configuration Differences
+##-------------------------------------------------------------------------
+def same_setting(target, current, tolerance=None):
+    '''Compare a requested setting with the current one: numbers are equal
+    within `tolerance`, strings are compared without regard to case or
+    surrounding whitespace.
+    '''
+    if tolerance is not None:
+        try:
+            return abs(float(target) - float(current)) <= tolerance
+        except (TypeError, ValueError):
+            pass
+    if isinstance(target, str) or isinstance(current, str):
+        return str(target).strip().lower() == str(current).strip().lower()
+    return target == current
+
+
+def config_diff(target, current, tolerances=None):
+    '''Return a dictionary of {field: target value} for every field of the
+    `target` configuration (a dataclass) which is set (not None) and differs
+    from the `current` configuration.
+    '''
+    tolerances = {} if tolerances is None else tolerances
+    changes = {}
+    for field in dataclasses.fields(target):
+        value = getattr(target, field.name)
+        if value is None:
+            continue
+        if not same_setting(value, getattr(current, field.name),
+                            tolerance=tolerances.get(field.name, None)):
+            changes[field.name] = value
+    return changes
@@ -0,0 +1,219 @@
+import atexit
+import sys
+import threading
+from collections import deque
+from datetime import datetime as dt
+from pathlib import Path
+import numpy as np
+
+from instruments import keywords
+
+try:
+    import pandas as pd
+except ModuleNotFoundError as e:
+    pd = None
+
+
+##-------------------------------------------------------------------------
+## Keyword Traffic Recorder
+##-------------------------------------------------------------------------
+## An opt-in recorder of every keyword read, write, wait and monitor update
+## made through the keywords module.  Events are kept in a bounded in-memory
+## ring buffer and flushed to compressed .npz files, one set per UT date
+## (which at Keck covers a whole night), named:
+##     keywords_YYYYMMDD_HHMMSS_ffffff.npz
+## Use load() to read a night back as a single table.
+##
+##     from instruments import recorder
+##     recorder.start('~/keyword_logs')
+##     ...
+##     events = recorder.load('~/keyword_logs')
+##     recorder.summarize(events, event='wait')
+columns = [('event', 'U8'),
+           ('service', 'U32'),
+           ('keyword', 'U64'),
+           ('value', 'U80'),
+           ('start', 'f8'),
+           ('duration', 'f8'),
+           ('ok', '?'),
+           ('caller', 'U96'),
+          ]
+## Frames from these modules are skipped when looking for the calling
+## function of a keyword event.
+skip_modules = ('instruments.keywords', 'instruments.waits',
+                'instruments.states', 'instruments.recorder',
+                'instruments.aio', 'concurrent.futures', 'threading',
+                'asyncio')
+_recorder = None
+
+
+def _walk(frame):
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if not module.startswith(skip_modules):
+            return f'{module}.{frame.f_code.co_name}'
+        frame = frame.f_back
+    return ''
+
+
+def find_caller(depth=2):
+    '''Return "module.function" for the first frame on the stack which is
+    outside of the keyword plumbing.  On a keyword executor thread (see
+    keywords.read_many) the stack of the submitting thread is searched.
+    '''
+    caller = _walk(sys._getframe(depth))
+    if caller == '' and keywords.origin() is not None:
+        caller = _walk(keywords.origin())
+    return caller
+
+
+def night(timestamp=None):
+    '''Return the UT date string (YYYYMMDD) for a unix time (default now).
+    '''
+    if timestamp is None:
+        return dt.utcnow().strftime('%Y%m%d')
+    return dt.utcfromtimestamp(timestamp).strftime('%Y%m%d')
+
+
+class Recorder(object):
+    '''Ring buffer of keyword events.  If `directory` is given, the buffer is
+    flushed to disk (on a background thread) whenever it fills and at exit,
+    otherwise the oldest events are dropped once `capacity` is reached.
+    '''
+    def __init__(self, directory=None, capacity=100000):
+        self.directory = None if directory is None\
+                         else Path(directory).expanduser()
+        self.capacity = capacity
+        self.buffer = deque(maxlen=capacity)
+        self.lock = threading.Lock()
+        self.dropped = 0
+        self.flushing = False
+
+    def __call__(self, event, service, keyword, value, start, duration, ok):
+        row = (event, service, keyword, '' if value is None else str(value),
+               start, duration, ok, find_caller())
+        full = False
+        with self.lock:
+            if len(self.buffer) == self.capacity:
+                self.dropped += 1
+            self.buffer.append(row)
+            full = len(self.buffer) == self.capacity\
+                   and self.directory is not None and not self.flushing
+            if full:
+                self.flushing = True
+        if full:
+            threading.Thread(target=self.flush, daemon=True).start()
+
+    def drain(self):
+        '''Remove and return all buffered events as a structured array.'''
+        with self.lock:
+            rows = list(self.buffer)
+            self.buffer.clear()
+        return to_array(rows)
+
+    def flush(self):
+        '''Write all buffered events to disk, one file per UT date.  Returns
+        the list of files written.
+        '''
+        if self.directory is None:
+            return []
+        events = self.drain()
+        with self.lock:
+            self.flushing = False
+        if len(events) == 0:
+            return []
+        self.directory.mkdir(parents=True, exist_ok=True)
+        stamp = dt.utcnow().strftime('%H%M%S_%f')
+        nights = np.array([night(t) for t in events['start']])
+        files = []
+        for date in np.unique(nights):
+            file = self.directory / f'keywords_{date}_{stamp}.npz'
+            subset = events[nights == date]
+            np.savez_compressed(file, **{name: subset[name]
+                                         for name, dtype in columns})
+            files.append(file)
+        return files
+
+
+def to_array(rows):
+    '''Convert a list of event tuples in to a structured numpy array.'''
+    return np.array(rows, dtype=columns)
+
+
+##-------------------------------------------------------------------------
+## Module Level Interface
+##-------------------------------------------------------------------------
+def start(directory=None, capacity=100000):
+    '''Start recording keyword events.  Returns the Recorder.'''
+    global _recorder
+    stop()
+    _recorder = Recorder(directory=directory, capacity=capacity)
+    keywords.add_listener(_recorder)
+    return _recorder
+
+
+def stop():
+    '''Stop recording and flush any buffered events to disk.'''
+    global _recorder
+    if _recorder is not None:
+        keywords.remove_listener(_recorder)
+        _recorder.flush()
+        _recorder = None
+
+
+def flush():
+    '''Flush the active recorder to disk.'''
+    if _recorder is not None:
+        return _recorder.flush()
+    return []
+
+
+def events():
+    '''Return the events currently in the buffer without removing them.'''
+    if _recorder is None:
+        return to_array([])
+    with _recorder.lock:
+        return to_array(list(_recorder.buffer))
+
+
+def load(directory, date=None, dataframe=False):
+    '''Load the recorded events for a UT date (YYYYMMDD, default today) and
+    return them sorted by start time as a structured numpy array, or as a
+    pandas DataFrame if dataframe=True.
+    '''
+    if date is None:
+        date = night()
+    files = sorted(Path(directory).expanduser().glob(f'keywords_{date}_*.npz'))
+    parts = []
+    for file in files:
+        with np.load(file) as data:
+            part = np.empty(len(data['start']), dtype=columns)
+            for name, dtype in columns:
+                part[name] = data[name]
+            parts.append(part)
+    result = np.concatenate(parts) if len(parts) > 0 else to_array([])
+    result = result[np.argsort(result['start'], kind='stable')]
+    if dataframe is True:
+        if pd is None:
+            raise ModuleNotFoundError('pandas is required for dataframe=True')
+        return pd.DataFrame(result)
+    return result
+
+
+def summarize(events, event=None):
+    '''Return a list of (event, service, keyword, caller, count, total, mean,
+    max) tuples, one per distinct combination, ordered by total time spent.
+    '''
+    if event is not None:
+        events = events[events['event'] == event]
+    keys = np.array([f"{e['event']}|{e['service']}|{e['keyword']}|{e['caller']}"
+                     for e in events])
+    summary = []
+    for key in np.unique(keys):
+        durations = events['duration'][keys == key]
+        summary.append((*key.split('|'), len(durations),
+                        durations.sum(), durations.mean(), durations.max()))
+    return sorted(summary, key=lambda row: row[5], reverse=True)
+
+
+atexit.register(stop)
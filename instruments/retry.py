@@ -0,0 +1,219 @@
+import functools
+import random
+import threading
+import time
+
+
+##-------------------------------------------------------------------------
+## Retry Policies and Circuit Breakers
+##-------------------------------------------------------------------------
+## A RetryPolicy retries a failing call with exponential backoff and random
+## jitter.  A CircuitBreaker is kept per keyword service: after `threshold`
+## consecutive failures the service is considered down and every further
+## access fails immediately (instead of waiting out a full timeout) until
+## `reset_after` seconds have passed.  Then a single trial access is let
+## through; if it succeeds the service is considered up again.
+##
+## The keywords module applies the policy for a service to every keyword read
+## (writes are not retried by default as they may trigger a move) and checks
+## the service's breaker before every read and write.  Control functions can
+## use the same machinery with the `retrying` decorator:
+##
+##     @retrying(attempts=2, initial=2)
+##     def set_rotpposn(rotpposn):
+##         ...
+class RetryPolicy(object):
+    '''Retry a call up to `attempts` times in total.  The n-th retry is made
+    after initial * factor**(n-1) seconds (at most `maximum`), randomly
+    shortened by up to `jitter` of its length so that many clients do not
+    retry in lock step.  Only the `exceptions` given are retried.
+    '''
+    def __init__(self, attempts=3, initial=0.2, factor=2, maximum=5,
+                 jitter=0.5, exceptions=(Exception,)):
+        self.attempts = attempts
+        self.initial = initial
+        self.factor = factor
+        self.maximum = maximum
+        self.jitter = jitter
+        self.exceptions = tuple(exceptions)
+
+    def __repr__(self):
+        return (f'RetryPolicy(attempts={self.attempts}, '
+                f'initial={self.initial}, factor={self.factor}, '
+                f'maximum={self.maximum}, jitter={self.jitter})')
+
+    def delay(self, retry):
+        '''Return the number of seconds to wait before retry number `retry`
+        (counting from 1).
+        '''
+        delay = min(self.initial * self.factor**(retry-1), self.maximum)
+        return delay * (1 - self.jitter * random.random())
+
+    def call(self, function, *args, on_retry=None, give_up=(), label=None,
+             **kwargs):
+        '''Call function(*args, **kwargs) under this policy.  `on_retry`, if
+        given, is called as on_retry(exception, attempt) before each retry.
+        Exceptions listed in `give_up` are never retried.  Retries are
+        counted in `retry_counts` under `label` (default: the function name).
+        '''
+        attempt = 1
+        while True:
+            try:
+                return function(*args, **kwargs)
+            except tuple(give_up):
+                raise
+            except self.exceptions as e:
+                if attempt >= self.attempts:
+                    raise
+                count_retry(label if label is not None
+                            else getattr(function, '__name__', repr(function)))
+                if on_retry is not None:
+                    on_retry(e, attempt)
+                time.sleep(self.delay(attempt))
+                attempt += 1
+
+
+no_retry = RetryPolicy(attempts=1)
+
+
+class CircuitBreaker(object):
+    '''Track consecutive failures of one service.  The breaker is "closed"
+    while the service is working, "open" (fail fast) once it has failed
+    `threshold` times in a row, and "half-open" when `reset_after` seconds
+    have passed and one trial access is allowed through.
+    '''
+    def __init__(self, name, threshold=5, reset_after=30):
+        self.name = name
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self.lock:
+            if self.opened is None:
+                return 'closed'
+            if time.monotonic() - self.opened >= self.reset_after:
+                return 'half-open'
+            return 'open'
+
+    def allow(self):
+        '''Return True if an access to the service may be attempted.'''
+        with self.lock:
+            if self.opened is None:
+                return True
+            if time.monotonic() - self.opened < self.reset_after:
+                return False
+            if self.trial is True:
+                return False
+            self.trial = True
+            return True
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened = None
+            self.trial = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial is True or self.failures >= self.threshold:
+                self.opened = time.monotonic()
+            self.trial = False
+
+    def reset(self):
+        self.success()
+
+    def __repr__(self):
+        return (f'CircuitBreaker({self.name}: {self.state}, '
+                f'{self.failures} failures)')
+
+
+##-------------------------------------------------------------------------
+## Per Service Configuration
+##-------------------------------------------------------------------------
+enabled = True
+default_policy = RetryPolicy()
+policies = {}
+breaker_threshold = 5
+breaker_reset_after = 30
+retry_counts = {}
+_breakers = {}
+_lock = threading.Lock()
+
+
+def count_retry(label):
+    with _lock:
+        retry_counts[label] = retry_counts.get(label, 0) + 1
+
+
+def set_policy(service, policy):
+    '''Use `policy` (a RetryPolicy, or None for the default) for reads of
+    the named service.
+    '''
+    with _lock:
+        if policy is None:
+            policies.pop(service.lower(), None)
+        else:
+            policies[service.lower()] = policy
+
+
+def policy_for(service):
+    '''Return the RetryPolicy which applies to the named service.'''
+    if enabled is not True:
+        return no_retry
+    return policies.get(service.lower(), default_policy)
+
+
+def breaker(service):
+    '''Return the CircuitBreaker of the named service.'''
+    service = service.lower()
+    with _lock:
+        if service not in _breakers:
+            _breakers[service] = CircuitBreaker(service,
+                                                threshold=breaker_threshold,
+                                                reset_after=breaker_reset_after)
+        return _breakers[service]
+
+
+def service_available(service):
+    '''Return False if the named service is known to be down.'''
+    return enabled is not True or breaker(service).state != 'open'
+
+
+def reset(service=None):
+    '''Close the breaker of one service (or of every service).'''
+    with _lock:
+        breakers = list(_breakers.values()) if service is None\
+                   else [_breakers.get(service.lower(), None)]
+    for b in breakers:
+        if b is not None:
+            b.reset()
+
+
+def status():
+    '''Return {service: (state, consecutive failures)} for every service
+    which has been accessed.
+    '''
+    with _lock:
+        breakers = list(_breakers.values())
+    return {b.name: (b.state, b.failures) for b in breakers}
+
+
+def retrying(policy=None, **kwargs):
+    '''Decorator which calls the function under a RetryPolicy.  Either pass a
+    policy or the keyword arguments for a new one.
+    '''
+    if policy is None:
+        policy = RetryPolicy(**kwargs)
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kw):
+            return policy.call(func, *args, **kw)
+        return wrapper
+    return decorator
@@ -0,0 +1,222 @@
+import threading
+import time
+from collections import deque
+
+from instruments import keywords, movetimes, subscriptions, timing, waits
+
+
+##-------------------------------------------------------------------------
+## Keyword State Machines
+##-------------------------------------------------------------------------
+## A KeywordStateMachine follows a small set of keywords on the subscription
+## hub and classifies every update in to a named state, keeping a history of
+## state changes.  Every keyword update increments a counter, so a caller can
+## mark() the moment just before it issues a command and later ask what has
+## happened since then.  Because the history is recorded as it happens, a
+## transition is never missed even if it is complete before the caller
+## starts waiting, which is what the fixed sleep "shims" used to guard
+## against.
+recheck = 5
+
+
+class KeywordStateMachine(object):
+    '''Track the state of a mechanism from keyword updates.
+
+    `watch` is a list of (service, keyword) pairs and `classify` a function
+    which takes a dictionary of {KEYWORD: ascii value} and returns a state
+    name.
+    '''
+    def __init__(self, name, watch, classify, history=1000):
+        self.name = name
+        self.watch = [(service.lower(), keyword.upper())
+                      for service, keyword in watch]
+        self.classify = classify
+        self.values = {}
+        self.counter = 0
+        self.updated = {}
+        self.history = deque(maxlen=history)
+        self.last_command = None
+        self.command_time = None
+        self.mechanism = None
+        self.size = 0
+        self.recorded = None
+        self.condition = threading.Condition()
+        self.starting = threading.Lock()
+        self.started = False
+        self.subscribers = [(service, keyword,
+                             self._subscriber(service, keyword))
+                            for service, keyword in self.watch]
+
+    def _update(self, service, keyword, value):
+        with self.condition:
+            self.counter += 1
+            if self.values.get(keyword, None) != value:
+                self.updated[keyword] = self.counter
+            self.values[keyword] = value
+            state = self.classify(self.values)
+            if len(self.history) == 0 or self.history[-1][1] != state:
+                self.history.append((self.counter, state, time.time()))
+            self.condition.notify_all()
+
+    def _subscriber(self, service, keyword):
+        def update(kw):
+            self._update(service, keyword, kw['ascii'])
+        return update
+
+    def _poll(self):
+        for service, keyword in self.watch:
+            self._update(service, keyword, keywords.read(service, keyword))
+
+    def start(self):
+        '''Subscribe to the watched keywords and read their current values.
+        Called automatically on first use.  If the first read fails, the
+        next call tries again.
+        '''
+        if self.started is True:
+            return
+        with self.starting:
+            if self.started is True:
+                return
+            for service, keyword, subscriber in self.subscribers:
+                subscriptions.subscribe(service, keyword, subscriber)
+            self._poll()
+            with self.condition:
+                self.started = True
+
+    @property
+    def state(self):
+        '''The current state, or None if it is not known yet.'''
+        self.start()
+        with self.condition:
+            if len(self.history) == 0:
+                return None
+            return self.history[-1][1]
+
+    def mark(self):
+        '''Return a token for the current moment (the update counter).'''
+        self.start()
+        with self.condition:
+            return self.counter
+
+    def command(self, mechanism=None, size=0):
+        '''Mark the moment just before a command which starts a transition is
+        issued.  Later waits measure the transition from this mark.  If a
+        `mechanism` name is given, the duration of the transition is stored
+        in the move time database with the given `size`.
+        '''
+        self.last_command = self.mark()
+        self.command_time = time.time()
+        self.mechanism = mechanism
+        self.size = size
+        return self.last_command
+
+    def expected_timeout(self, default):
+        '''Return a timeout for the last command from the move time database,
+        or `default` if there is no model for it.
+        '''
+        if self.mechanism is None:
+            return default
+        return movetimes.timeout(self.mechanism, self.size, default=default)
+
+    def _record(self, token):
+        with self.condition:
+            if self.mechanism is None or token != self.last_command\
+               or self.recorded == token or self.history[-1][0] <= token:
+                return
+            self.recorded = token
+            duration = self.history[-1][2] - self.command_time
+        movetimes.record(self.mechanism, self.size, duration)
+
+    def states_since(self, token):
+        '''Return the list of states the machine has been in since `token`,
+        starting with the state it was in at that moment.
+        '''
+        with self.condition:
+            states = [state for counter, state, t in self.history
+                      if counter > token]
+            earlier = [state for counter, state, t in self.history
+                       if counter <= token]
+            if len(earlier) > 0:
+                states.insert(0, earlier[-1])
+            return states
+
+    def changed_since(self, token, keyword):
+        '''Return True if `keyword` has changed value since `token`.'''
+        with self.condition:
+            return self.updated.get(keyword.upper(), -1) > token
+
+    def wait(self, predicate, timeout=None):
+        '''Block until predicate(self) returns True or `timeout` seconds have
+        elapsed.  Returns True if the predicate was met.
+        '''
+        self.start()
+        start = time.time()
+        result = None
+        try:
+            result = self._wait(predicate, timeout)
+            return result
+        finally:
+            if timing.enabled is True:
+                timing.add_wait(time.time() - start)
+            keywords.notify_change()
+            if keywords._listeners:
+                waits._report(self.watch, result, start)
+
+    def _wait(self, predicate, timeout):
+        endat = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while True:
+                if predicate(self) is True:
+                    return True
+                if endat is None:
+                    remaining = recheck
+                else:
+                    remaining = endat - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                if not self.condition.wait(min(remaining, recheck)):
+                    ## No update for a while, guard against a missed
+                    ## broadcast by reading the keywords directly.
+                    self.condition.release()
+                    try:
+                        self._poll()
+                    finally:
+                        self.condition.acquire()
+
+    def wait_for_cycle(self, busy, done, token=None, timeout=None,
+                       start_timeout=None):
+        '''Wait for a full transition: the machine must pass through one of
+        the `busy` states after `token` (default: the last command) and then
+        reach one of the `done` states.  If no busy state is seen within
+        `start_timeout` seconds the transition is assumed to have been
+        instantaneous and the wait ends as soon as a done state is reached.
+
+        Returns True if the transition completed, False on timeout.
+        '''
+        if token is None:
+            token = self.last_command
+        started = time.monotonic()
+
+        def complete(machine):
+            if token is None:
+                return machine.history[-1][1] in done
+            states = machine.states_since(token)
+            if states[-1] not in done:
+                return False
+            if any([state in busy for state in states]):
+                return True
+            return start_timeout is not None\
+                   and time.monotonic() - started > start_timeout
+
+        if start_timeout is not None:
+            first = start_timeout if timeout is None\
+                    else min(timeout, start_timeout)
+            if self.wait(complete, timeout=first) is True:
+                self._record(token)
+                return True
+            if timeout is not None:
+                timeout = max(0, timeout - (time.monotonic() - started))
+        if self.wait(complete, timeout=timeout) is True:
+            self._record(token)
+            return True
+        return False
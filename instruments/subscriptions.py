@@ -0,0 +1,169 @@
+import asyncio
+import threading
+from queue import Queue
+
+from instruments import keywords
+
+
+##-------------------------------------------------------------------------
+## Keyword Subscription Hub
+##-------------------------------------------------------------------------
+## Exactly one KTL callback and one monitor are set up per (service, keyword)
+## in this process, however many waits, caches and scripts are interested in
+## it.  Each broadcast is fanned out to every local subscriber.  Subscribers
+## are called in the monitor thread as function(kw), where kw is the keyword
+## handle, just as a KTL callback would be.
+##
+## Once started, a monitor is left running for the life of the connection so
+## that a keyword which is waited on repeatedly is not re-subscribed on the
+## server each time.
+_lock = threading.RLock()
+_subscribers = {}
+_attached = {}
+
+
+class Subscription(object):
+    '''Handle for one subscriber to a keyword.  Call cancel() (or use it as a
+    context manager) to stop receiving updates.
+    '''
+    def __init__(self, service, keyword, function, queue=None):
+        self.service = service
+        self.keyword = keyword
+        self.function = function
+        self.queue = queue
+
+    def cancel(self):
+        unsubscribe(self.service, self.keyword, self.function)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.cancel()
+
+
+def _key(service, keyword):
+    return (service.lower(), keyword.upper())
+
+
+def _dispatcher(key):
+    def dispatch(kw):
+        with _lock:
+            functions = list(_subscribers.get(key, []))
+        for function in functions:
+            try:
+                function(kw)
+            except Exception:
+                pass
+    return dispatch
+
+
+def _attach(key):
+    '''Register the single dispatcher on the keyword handle and start its
+    monitor, unless that has already been done on the current handle.
+    '''
+    kw = keywords.get_keyword(*key)
+    with _lock:
+        handle, dispatch = _attached.get(key, (None, None))
+        if handle is kw:
+            return kw
+        if dispatch is None:
+            dispatch = _dispatcher(key)
+        _attached[key] = (kw, dispatch)
+    kw.callback(dispatch)
+    kw.monitor()
+    return kw
+
+
+def subscribe(service, keyword, function):
+    '''Call function(kw) on every update of service.keyword.  Subscribing the
+    same function twice has no further effect.  Returns a Subscription.
+    '''
+    key = _key(service, keyword)
+    with _lock:
+        functions = _subscribers.setdefault(key, [])
+        if function not in functions:
+            functions.append(function)
+    try:
+        _attach(key)
+    except Exception:
+        unsubscribe(service, keyword, function)
+        raise
+    return Subscription(service, keyword, function)
+
+
+def unsubscribe(service, keyword, function):
+    '''Stop calling function on updates of service.keyword.'''
+    key = _key(service, keyword)
+    with _lock:
+        functions = _subscribers.get(key, [])
+        if function in functions:
+            functions.remove(function)
+
+
+def subscribe_queue(service, keyword, queue=None):
+    '''Put the ascii value of service.keyword on a queue on every update.  A
+    new queue.Queue is created if none is given.  Returns a Subscription whose
+    .queue attribute is the queue.
+    '''
+    if queue is None:
+        queue = Queue()
+    def put(kw):
+        queue.put(kw['ascii'])
+    subscription = subscribe(service, keyword, put)
+    subscription.queue = queue
+    return subscription
+
+
+async def next_value(service, keyword, timeout=None):
+    '''Coroutine which returns the ascii value of the next update of
+    service.keyword.  Raises asyncio.TimeoutError after `timeout` seconds.
+    '''
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    def resolve(value):
+        if not future.done():
+            future.set_result(value)
+    def update(kw):
+        loop.call_soon_threadsafe(resolve, kw['ascii'])
+    subscription = subscribe(service, keyword, update)
+    try:
+        return await asyncio.wait_for(future, timeout)
+    finally:
+        subscription.cancel()
+
+
+def reattach(service=None):
+    '''Called when keyword handles have been dropped (see
+    keywords.reconnect).  Forget the old handles and re-register every key
+    which still has subscribers on the new handle.  Keys which can not be
+    re-attached now are attached again on their next subscribe.
+    '''
+    with _lock:
+        keys = [key for key in _attached.keys()
+                if service is None or key[0] == service.lower()]
+        old = [_attached[key] for key in keys]
+        for key in keys:
+            _attached[key] = (None, _attached[key][1])
+    for handle, dispatch in old:
+        if handle is not None:
+            try:
+                handle.callback(dispatch, remove=True)
+            except Exception:
+                pass
+    with _lock:
+        keys = [key for key in keys if len(_subscribers.get(key, [])) > 0]
+    for key in keys:
+        try:
+            _attach(key)
+        except Exception:
+            pass
+
+
+def stats():
+    '''Return the number of monitored keywords and of local subscribers.'''
+    with _lock:
+        monitors = len([key for key, value in _attached.items()
+                        if value[0] is not None])
+        subscribers = sum([len(value) for value in _subscribers.values()])
+    return {'monitors': monitors, 'subscribers': subscribers}
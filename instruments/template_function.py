@@ -8,34 +8,33 @@ try:
 except ModuleNotFoundError as e:
     pass
 
+from instruments.conditions import instrument_step
+
 
 ##-----------------------------------------------------------------------------
 ## Instrument Function
 ##-----------------------------------------------------------------------------
+## Conditions which take no arguments go in the pre and post lists of the
+## instrument_step decorator, which also handles skipprecond and skippostcond.
+## Checks which depend on the arguments stay in the function body.
+@instrument_step(pre=[condition1_ok], post=[condition2_ok])
 def function(arguments, skipprecond=False, skippostcond=False):
     '''docstring
     '''
-    this_function_name = inspect.currentframe().f_code.co_name
-    log.debug(f"Executing: {this_function_name}")
-
     ##-------------------------------------------------------------------------
     ## Pre-Condition Checks
-    if skipprecond is True:
-        log.debug('Skipping pre condition checks')
-    else:
+    if skipprecond is not True:
         if condition1 is not True:
             raise FailedCondition('description of failure')
-    
+
     ##-------------------------------------------------------------------------
     ## Script Contents
 
     # ----> insert instrument script here <----
-    
+
     ##-------------------------------------------------------------------------
     ## Post-Condition Checks
-    if skippostcond is True:
-        log.debug('Skipping post condition checks')
-    else:
+    if skippostcond is not True:
         if condition2 is not True:
             raise FailedCondition('description of failure')
 
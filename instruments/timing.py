@@ -0,0 +1,231 @@
+import contextvars
+import functools
+import math
+import threading
+import time
+
+
+##-------------------------------------------------------------------------
+## Call Timing Instrumentation
+##-------------------------------------------------------------------------
+## When enabled, every instrument function (everything wrapped by
+## instrument_step or decorated with `timed`) records its wall time per call
+## split in to phases:
+##     total - the whole call
+##     pre   - pre-condition checks
+##     body  - the function itself
+##     post  - post-condition checks
+##     wait  - time spent blocked in keyword waits (waits.wait_for and the
+##             keyword state machines), charged to the innermost instrumented
+##             function
+## Each (function, phase) pair is aggregated in a Histogram.  When disabled
+## (the default) the only cost is one flag check per call.
+##
+##     from instruments import timing
+##     timing.enable()
+##     setup_mask(mask); waitfor_CSU(); execute_mask(); waitfor_CSU()
+##     print(timing.report())
+enabled = False
+phases = ['total', 'pre', 'body', 'post', 'wait']
+_lock = threading.Lock()
+_histograms = {}
+_current = contextvars.ContextVar('timing_current', default=None)
+
+
+class Histogram(object):
+    '''HDR-style histogram of durations.  Values are stored in microseconds
+    in buckets which are exact below 2**sub_bits us and otherwise keep
+    `sub_bits` significant bits, i.e. a relative error below 2**-sub_bits
+    (under 1% with the default) over any range of values, in a fixed small
+    amount of memory.
+    '''
+    def __init__(self, sub_bits=7):
+        self.sub_bits = sub_bits
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.lock = threading.Lock()
+
+    def _bucket(self, us):
+        shift = max(us.bit_length() - self.sub_bits, 0)
+        return (shift, us >> shift)
+
+    @staticmethod
+    def _value(bucket):
+        '''The middle of a bucket, in seconds.'''
+        shift, sub = bucket
+        return ((sub << shift) + ((1 << shift) - 1) / 2) / 1e6
+
+    def record(self, seconds):
+        us = max(int(seconds * 1e6), 0)
+        bucket = self._bucket(us)
+        with self.lock:
+            self.counts[bucket] = self.counts.get(bucket, 0) + 1
+            self.count += 1
+            self.total += seconds
+            self.min = seconds if self.min is None else min(self.min, seconds)
+            self.max = seconds if self.max is None else max(self.max, seconds)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count > 0 else None
+
+    def percentile(self, p):
+        '''Return the p-th percentile (0 to 100) in seconds.'''
+        with self.lock:
+            if self.count == 0:
+                return None
+            target = max(math.ceil(self.count * p / 100), 1)
+            seen = 0
+            for bucket in sorted(self.counts.keys(),
+                                 key=lambda b: b[1] << b[0]):
+                seen += self.counts[bucket]
+                if seen >= target:
+                    return min(max(self._value(bucket), self.min), self.max)
+        return self.max
+
+    def count_below(self, seconds):
+        '''Return the number of values recorded which were at most `seconds`
+        (to within the bucket resolution).
+        '''
+        with self.lock:
+            return sum([n for bucket, n in self.counts.items()
+                        if self._value(bucket) <= seconds])
+
+    def merge(self, other):
+        '''Add the counts of another Histogram (with the same sub_bits).'''
+        with other.lock:
+            counts = dict(other.counts)
+            count, total = other.count, other.total
+            lo, hi = other.min, other.max
+        with self.lock:
+            for bucket, n in counts.items():
+                self.counts[bucket] = self.counts.get(bucket, 0) + n
+            self.count += count
+            self.total += total
+            if lo is not None:
+                self.min = lo if self.min is None else min(self.min, lo)
+                self.max = hi if self.max is None else max(self.max, hi)
+
+    def __repr__(self):
+        if self.count == 0:
+            return '<Histogram empty>'
+        return (f'<Histogram n={self.count} mean={self.mean:.3f} '
+                f'p50={self.percentile(50):.3f} p99={self.percentile(99):.3f} '
+                f'max={self.max:.3f}>')
+
+
+def histogram(name, phase):
+    '''Return the Histogram for one phase of the named function.'''
+    key = (name, phase)
+    with _lock:
+        if key not in _histograms:
+            _histograms[key] = Histogram()
+        return _histograms[key]
+
+
+def record(name, phase, seconds):
+    histogram(name, phase).record(seconds)
+
+
+def add_wait(seconds):
+    '''Charge time spent blocked in a keyword wait to the innermost
+    instrumented function which is running in this context.
+    '''
+    name = _current.get()
+    if name is not None:
+        record(name, 'wait', seconds)
+
+
+class Clock(object):
+    '''Times one call of the named function.  Call lap(phase) at the end of
+    each phase and stop() when the call is over.
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.token = _current.set(name)
+        self.start = self.last = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        record(self.name, phase, now - self.last)
+        self.last = now
+
+    def stop(self):
+        record(self.name, 'total', time.perf_counter() - self.start)
+        _current.reset(self.token)
+
+
+def function_name(func):
+    module = func.__module__.replace('instruments.', '')
+    return f'{module}.{func.__qualname__}'
+
+
+def timed(func):
+    '''Decorator which records the wall time of every call of a function
+    while timing is enabled.
+    '''
+    name = function_name(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if enabled is not True:
+            return func(*args, **kwargs)
+        clock = Clock(name)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            clock.stop()
+    return wrapper
+
+
+##-------------------------------------------------------------------------
+## Control and Reporting
+##-------------------------------------------------------------------------
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    '''Forget all recorded timings.'''
+    with _lock:
+        _histograms.clear()
+
+
+def histograms():
+    '''Return {(function, phase): Histogram} for everything recorded.'''
+    with _lock:
+        return dict(_histograms)
+
+
+def summary():
+    '''Return a list of (function, phase, count, total, mean, p50, p90, p99,
+    max) tuples ordered by total time per function.
+    '''
+    rows = []
+    for (name, phase), h in histograms().items():
+        if h.count == 0:
+            continue
+        rows.append((name, phase, h.count, h.total, h.mean, h.percentile(50),
+                     h.percentile(90), h.percentile(99), h.max))
+    totals = {row[0]: row[3] for row in rows if row[1] == 'total'}
+    return sorted(rows, key=lambda row: (-totals.get(row[0], row[3]),
+                                         row[0], phases.index(row[1])))
+
+
+def report():
+    '''Return the timing summary as a printable table (times in seconds).'''
+    lines = [f'{"function":36s} {"phase":5s} {"calls":>6s} {"total":>9s} '
+             f'{"mean":>8s} {"p50":>8s} {"p90":>8s} {"p99":>8s} {"max":>8s}']
+    for name, phase, n, total, mean, p50, p90, p99, top in summary():
+        lines.append(f'{name:36s} {phase:5s} {n:6d} {total:9.3f} {mean:8.3f} '
+                     f'{p50:8.3f} {p90:8.3f} {p99:8.3f} {top:8.3f}')
+    return '\n'.join(lines)
@@ -0,0 +1,136 @@
+import asyncio
+import threading
+import time
+
+from instruments import keywords, subscriptions, timing
+
+
+##-------------------------------------------------------------------------
+## Event Driven Waits
+##-------------------------------------------------------------------------
+## Rather than sleeping between polls, waits subscribe to each watched
+## keyword on the subscription hub and block on a condition variable which is
+## notified every time one of those keywords is updated.  The predicate is
+## re-evaluated on every update, so a wait returns as soon as the condition
+## is met.  A slow periodic re-check (`recheck` seconds) guards against a
+## missed broadcast.
+recheck = 5
+
+
+def wait_for(predicate, watch, timeout=None):
+    '''Block until `predicate()` returns True or until `timeout` seconds have
+    elapsed (timeout=None waits forever).  `watch` is a list of (service,
+    keyword) pairs whose updates trigger a re-evaluation of the predicate.
+
+    Returns True if the predicate was met, False on timeout.  Any exception
+    raised by the predicate is passed on to the caller.
+    '''
+    condition = threading.Condition()
+
+    def notify(*args, **kwargs):
+        with condition:
+            condition.notify_all()
+
+    subs = [subscriptions.subscribe(service, keyword, notify)
+            for service, keyword in watch]
+
+    start = time.time()
+    endat = None if timeout is None else time.monotonic() + timeout
+    result = None
+    try:
+        with condition:
+            while True:
+                if predicate() is True:
+                    result = True
+                    return result
+                if endat is None:
+                    remaining = recheck
+                else:
+                    remaining = endat - time.monotonic()
+                    if remaining <= 0:
+                        result = False
+                        return result
+                condition.wait(min(remaining, recheck))
+    finally:
+        for sub in subs:
+            sub.cancel()
+        if timing.enabled is True:
+            timing.add_wait(time.time() - start)
+        keywords.notify_change()
+        if keywords._listeners:
+            _report(watch, result, start)
+
+
+def _report(watch, result, start):
+    '''Pass a completed wait on to the keyword event listeners.  A result of
+    None means the predicate raised.
+    '''
+    services = ','.join(sorted(set([service.lower() for service, kw in watch])))
+    names = ','.join([kw.upper() for service, kw in watch])
+    keywords.notify_listeners('wait', services, names, result, start,
+                              time.time() - start, ok=result is not None)
+
+
+def wait_until(service, keyword, predicate, timeout=None):
+    '''Block until `predicate(kw)` returns True, where kw is the monitored
+    keyword handle for service.keyword, or until `timeout` seconds elapse.
+
+    Example: wait_until('mcsus', 'CSUREADY', lambda kw: int(kw) == 2, 480)
+
+    Returns True if the predicate was met, False on timeout.
+    '''
+    kw = keywords.get_keyword(service, keyword)
+    return wait_for(lambda: predicate(kw), [(service, keyword)],
+                    timeout=timeout)
+
+
+##-------------------------------------------------------------------------
+## Asyncio Waits
+##-------------------------------------------------------------------------
+async def wait_for_async(predicate, watch, timeout=None):
+    '''Coroutine version of `wait_for` which waits on the running event loop
+    instead of blocking a thread.
+    '''
+    loop = asyncio.get_running_loop()
+    event = asyncio.Event()
+
+    def notify(*args, **kwargs):
+        loop.call_soon_threadsafe(event.set)
+
+    subs = [subscriptions.subscribe(service, keyword, notify)
+            for service, keyword in watch]
+
+    start = time.time()
+    endat = None if timeout is None else loop.time() + timeout
+    result = None
+    try:
+        while True:
+            event.clear()
+            if predicate() is True:
+                result = True
+                return result
+            if endat is None:
+                remaining = recheck
+            else:
+                remaining = endat - loop.time()
+                if remaining <= 0:
+                    result = False
+                    return result
+            try:
+                await asyncio.wait_for(event.wait(), min(remaining, recheck))
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        for sub in subs:
+            sub.cancel()
+        keywords.notify_change()
+        if keywords._listeners:
+            _report(watch, result, start)
+
+
+async def wait_until_async(service, keyword, predicate, timeout=None):
+    '''Coroutine version of `wait_until`.
+    '''
+    kw = keywords.get_keyword(service, keyword)
+    return await wait_for_async(lambda: predicate(kw), [(service, keyword)],
+                                timeout=timeout)
@@ -0,0 +1,17 @@
+import pytest
+
+from instruments import create_log, fakektl, locks
+
+
+@pytest.fixture(scope='session')
+def sim(tmp_path_factory):
+    '''Use the simulated keyword backend (and a private lock directory) for
+    the whole test session.
+    '''
+    directory = locks.directory
+    locks.directory = tmp_path_factory.mktemp('locks')
+    simulator = fakektl.install(read_latency=0.001, write_latency=0.001,
+                                time_scale=0.001)
+    create_log('MOSFIRE', loglevel='WARNING')
+    yield simulator
+    locks.directory = directory
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from instruments import mosfire
+from instruments.mosfire import csustate
+from instruments.mosfire.csustate import CSUState, check_collisions,\
+                                         find_collisions
+
+
+##-------------------------------------------------------------------------
+## Collision Check Tests
+##-------------------------------------------------------------------------
+def move_slit(mask, slit, center, width=1.0):
+    '''Put one slit of a Mask at `center` mm.'''
+    row = list(mask.slitpos['slitNumber']).index(slit)
+    mask.slitpos['leftBarPositionMM'][row] = center + width/2
+    mask.slitpos['rightBarPositionMM'][row] = center - width/2
+    return mask
+
+
+def test_known_masks_pass():
+    masks = [mosfire.Mask('OPEN'), mosfire.Mask('0.7x46')]
+    masks += [mosfire.Mask('RANDOM') for i in range(50)]
+    for mask in masks:
+        assert find_collisions(mask) == [], mask.name
+
+
+def test_adjacent_row_crossing():
+    '''A slit far to one side of its neighbour's is rejected by default.'''
+    assert csustate.max_adjacent_overlap is not None
+    mask = move_slit(move_slit(mosfire.Mask('0.7x46'), 10, 10.0), 11, 260.0)
+    problems = find_collisions(mask)
+    assert [row for row, problem in problems] == [10]
+    assert 'right bar of row 11' in problems[0][1]
+    with pytest.raises(mosfire.FailedCondition, match='row\\(s\\) 10:'):
+        check_collisions(mask)
+
+
+def test_same_row_crossing_and_travel():
+    target = CSUState.from_mask(mosfire.Mask('0.7x46')).target.copy()
+    target[4] = target[5] + 1   # B05 (right) past B06 (left)
+    target[21] = 300.0          # B22 beyond max_position
+    problems = find_collisions(target)
+    assert [row for row, problem in problems] == [3, 11]
+    assert 'slit width' in problems[0][1]
+    assert 'travel range' in problems[1][1]
+
+
+def test_setup_mask_rejects_collision(sim):
+    mask = move_slit(move_slit(mosfire.Mask('0.7x46'), 10, 10.0), 11, 260.0)
+    with pytest.raises(mosfire.FailedCondition, match='collide'):
+        mosfire.setup_mask(mask)
@@ -0,0 +1,174 @@
+import logging
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from instruments import create_log, keywords, locks, timing
+from instruments import mosfire
+from instruments.mosfire import core, csu
+
+
+##-------------------------------------------------------------------------
+## Thread Safety Tests
+##-------------------------------------------------------------------------
+## Drive MOSFIRE control functions from a thread pool against the simulated
+## keyword backend (instruments.fakektl) and check that nothing breaks: no
+## exceptions, no torn coordinate transforms, no duplicated log handlers and
+## cached keyword values which follow writes.  No real keywords are touched.
+##
+##     python -m pytest tests
+threads = 32
+calls = 1000
+
+
+def run_all(functions):
+    '''Call every function in `functions` from the thread pool.  Returns a
+    list of (name, exception) for the calls which failed.
+    '''
+    def run(function):
+        try:
+            function()
+        except Exception as e:
+            return function.__name__, e
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(run, functions))
+    return [result for result in results if result is not None]
+
+
+##-------------------------------------------------------------------------
+## Workload
+##-------------------------------------------------------------------------
+def check_transforms():
+    '''Round trip a set of physical coordinates through the (shared) CSU
+    transforms while other threads replace them.
+    '''
+    physical = np.array([[random.uniform(4.0, 270.4), random.randint(1, 46)]
+                         for i in range(10)])
+    pixels = csu.physical_to_pixel(physical)
+    assert np.allclose(csu.pixel_to_physical(pixels), physical, atol=0.01)
+
+
+def replace_transforms():
+    csu.set_transforms(csu.CSUTransforms(*csu.transforms))
+
+
+def recreate_log():
+    log = create_log('MOSFIRE', loglevel='WARNING')
+    assert len(log.handlers) == 1, f'{len(log.handlers)} handlers on log'
+
+
+def set_exptime():
+    exptime = random.choice([1.5, 2.0, 3.0, 10.0])
+    with locks.acquire('detector'):
+        mosfire.set_exptime(exptime)
+        assert mosfire.exptime() == exptime
+
+
+def set_coadds():
+    mosfire.set_coadds(random.randint(1, 10))
+
+
+def set_sampmode():
+    mosfire.set_sampmode(random.choice(['CDS', 'MCDS4', 'MCDS16']))
+
+
+def read_bars():
+    positions = keywords.read_many('mcsus', 'B{:02d}POS', range(1,93,1),
+                                   dtype=float)
+    assert len(positions) == 92
+
+
+def change_obsmode():
+    mosfire.set_obsmode(random.choice(['K-imaging', 'H-imaging',
+                                       'dark-imaging']))
+
+
+def go_dark():
+    mosfire.quick_dark(wait=True)
+
+
+workload = [mosfire.obsmode, mosfire.filter, mosfire.isdark, mosfire.exptime,
+            mosfire.coadds, mosfire.sampmode, mosfire.rotpposn,
+            mosfire.CSU_ok, mosfire.check_mechanisms, mosfire.current_config,
+            read_bars, check_transforms, replace_transforms, recreate_log,
+            set_exptime, set_coadds, set_sampmode, change_obsmode, go_dark]
+
+
+##-------------------------------------------------------------------------
+## Tests
+##-------------------------------------------------------------------------
+def test_cached_read(sim):
+    '''Concurrent cached reads only ever see written values, and see a new
+    value as soon as the write returns.
+    '''
+    values = ['1', '2', '5', '10']
+    keywords.write('mds', 'COADDS', values[0])
+    keywords.clear_cache()
+    seen = set()
+    seen_lock = threading.Lock()
+    def reader():
+        for i in range(20):
+            value = str(keywords.cached_read('mds', 'COADDS'))
+            with seen_lock:
+                seen.add(value)
+    def writer():
+        for value in values[1:]:
+            keywords.write('mds', 'COADDS', value)
+            assert str(keywords.cached_read('mds', 'COADDS')) == value
+    hits = keywords.cache_stats['hits']
+    failures = run_all([writer] + [reader] * (threads - 1))
+    assert failures == []
+    assert seen <= set(values)
+    assert keywords.cache_stats['hits'] > hits
+    assert str(keywords.cached_read('mds', 'COADDS')) == values[-1]
+
+
+def test_create_log(sim, tmp_path):
+    '''Setting up the same log from many threads adds each handler once.'''
+    logfile = tmp_path / 'stress.log'
+    def setup():
+        create_log('MOSFIRE_stress', loglevel='WARNING', logfile=logfile)
+    assert run_all([setup] * threads) == []
+    log = logging.getLogger('MOSFIRE_stress')
+    assert len(log.handlers) == 2
+    for handler in list(log.handlers):
+        log.removeHandler(handler)
+        handler.close()
+
+
+def test_transforms_are_immutable(sim):
+    with pytest.raises(ValueError):
+        csu.transforms.Apixel_to_physical[0, 0] = 0
+    with pytest.raises(AttributeError):
+        csu.transforms.Apixel_to_physical = np.eye(3)
+
+
+def test_set_transforms(sim):
+    '''Coordinates round trip while other threads replace the transforms,
+    and the module level matrices follow the transforms in use.
+    '''
+    functions = [random.choice([check_transforms, replace_transforms])
+                 for i in range(calls)]
+    assert run_all(functions) == []
+    assert csu.Apixel_to_physical is csu.transforms.Apixel_to_physical
+    assert csu.Aphysical_to_pixel is csu.transforms.Aphysical_to_pixel
+    assert core.Apixel_to_physical is csu.transforms.Apixel_to_physical
+    assert core.Aphysical_to_pixel is csu.transforms.Aphysical_to_pixel
+
+
+def test_control_functions(sim):
+    '''A random mix of control functions runs from many threads at once
+    without errors, and every call is timed.
+    '''
+    timing.reset()
+    timing.enable()
+    try:
+        failures = run_all(random.choices(workload, k=calls))
+    finally:
+        timing.disable()
+    assert failures == [], '\n'.join([f'{name}: {type(e).__name__}: {e}'
+                                      for name, e in failures[:20]])
+    assert len(timing.summary()) > 0